@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Kiểm soát tải (admission control) dùng chung giữa các uvicorn worker.
+
+- Mỗi "slot" là một file khoá trong thư mục dùng chung (mặc định trên /dev/shm);
+  giữ flock trên file = giữ slot. flock tự nhả khi process chết nên slot không bị rò.
+- Số slot đang bị giữ được đếm theo pid trong một file JSON (không thử khoá các slot, để
+  /metrics hay chunk_workers_for không giành mất slot trống của admit()/slot()); phần của
+  process đã chết bị bỏ qua.
+- Pool "admit" giới hạn số request đang nằm trong hệ thống (đang chạy + đang chờ),
+  pool "run" giới hạn số job xử lý docx chạy đồng thời trên toàn bộ worker.
+- Khi pool "admit" đầy, request bị từ chối (API trả 429 + Retry-After).
+- Bộ đếm dùng chung (số request bị từ chối, ...) lưu trong một file JSON có khoá.
+"""
+
+import os
+import json
+import time
+import errno
+import fcntl
+import random
+import asyncio
+import tempfile
+import contextlib
+
+
+def default_state_dir():
+    """Thư mục trạng thái dùng chung: ưu tiên RAM (/dev/shm), nếu không có thì thư mục tạm."""
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "docx_processor")
+
+
+class AdmissionRejected(Exception):
+    """Hàng đợi đã đầy; client nên thử lại sau retry_after giây."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Hàng đợi đã đầy, thử lại sau {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SlotPool:
+    """Tập `size` slot liên process, mỗi slot là một file khoá `<name>_<i>.lock`; số slot
+    mỗi process đang giữ được ghi trong `<name>_holders.json`."""
+
+    def __init__(self, directory, name, size):
+        self.size = max(1, int(size))
+        self.paths = [os.path.join(directory, f"{name}_{i}.lock") for i in range(self.size)]
+        self.holders = SlotHolders(os.path.join(directory, f"{name}_holders.json"))
+
+    def _try_lock(self, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return None
+            raise
+        return fd
+
+    @staticmethod
+    def _unlock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def try_acquire(self):
+        """Lấy một slot trống; trả về fd giữ khoá, hoặc None nếu tất cả đang bận."""
+        # Bắt đầu từ vị trí ngẫu nhiên để các worker không cùng tranh slot đầu tiên
+        start = random.randrange(self.size)
+        for i in range(self.size):
+            fd = self._try_lock(self.paths[(start + i) % self.size])
+            if fd is not None:
+                try:
+                    self.holders.add(1)
+                except BaseException:
+                    # Không ghi được số holder: trả slot ngay, không để rò fd đang giữ khoá
+                    self._unlock(fd)
+                    raise
+                return fd
+        return None
+
+    def release(self, fd):
+        try:
+            self.holders.add(-1)
+        finally:
+            self._unlock(fd)
+
+    def in_use(self):
+        """Số slot đang bị giữ (bởi bất kỳ process nào), không đụng tới khoá của các slot."""
+        return min(self.size, self.holders.count())
+
+
+class SharedCounters:
+    """Bộ đếm dùng chung giữa các process, lưu trong một file JSON được khoá bằng flock."""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def _locked(self, mode):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, mode)
+            with os.fdopen(os.dup(fd), "r+", encoding="utf-8") as f:
+                yield f
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    @staticmethod
+    def _read(f):
+        f.seek(0)
+        raw = f.read()
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return {}
+
+    def incr(self, name, amount=1):
+        with self._locked(fcntl.LOCK_EX) as f:
+            data = self._read(f)
+            data[name] = data.get(name, 0) + amount
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+            f.flush()
+
+    def snapshot(self):
+        with self._locked(fcntl.LOCK_SH) as f:
+            return self._read(f)
+
+
+class SlotHolders(SharedCounters):
+    """Số slot đang giữ theo từng pid; process chết mà không nhả (flock đã tự nhả) thì
+    phần của nó bị bỏ qua khi đếm và bị xoá ở lần ghi kế tiếp."""
+
+    def add(self, amount):
+        pid = os.getpid()
+        with self._locked(fcntl.LOCK_EX) as f:
+            data = {key: held for key, held in self._read(f).items()
+                    if held > 0 and (int(key) == pid or _pid_alive(int(key)))}
+            held = data.get(str(pid), 0) + amount
+            if held > 0:
+                data[str(pid)] = held
+            else:
+                data.pop(str(pid), None)
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+            f.flush()
+
+    def count(self):
+        return sum(held for key, held in self.snapshot().items() if held > 0 and _pid_alive(int(key)))
+
+
+class AdmissionController:
+    """
+    Giới hạn toàn cục: tối đa max_active job chạy cùng lúc và tối đa max_queued request
+    chờ phía sau; vượt quá thì admit() ném AdmissionRejected.
+    """
+
+    def __init__(self, state_dir, max_active, max_queued, retry_after=5, poll_interval=0.05):
+        os.makedirs(state_dir, exist_ok=True)
+        self.max_active = max(1, int(max_active))
+        self.max_queued = max(0, int(max_queued))
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        self.admitted = SlotPool(state_dir, "admit", self.max_active + self.max_queued)
+        self.running = SlotPool(state_dir, "run", self.max_active)
+        self.counters = SharedCounters(os.path.join(state_dir, "counters.json"))
+        self.waiting_local = 0
+
+    def admit(self):
+        """Nhận một request vào hệ thống; trả về token để leave(), hoặc ném AdmissionRejected."""
+        token = self.admitted.try_acquire()
+        if token is None:
+            self.counters.incr("rejected_total")
+            raise AdmissionRejected(self.retry_after)
+        self.counters.incr("admitted_total")
+        return token
+
+    def leave(self, token):
+        self.admitted.release(token)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Chờ (không chặn event loop) đến khi có slot chạy job, giữ slot trong khối with."""
+        fd = self.running.try_acquire()
+        if fd is None:
+            self.waiting_local += 1
+            started = time.monotonic()
+            try:
+                while fd is None:
+                    await asyncio.sleep(self.poll_interval)
+                    fd = self.running.try_acquire()
+            finally:
+                self.waiting_local -= 1
+            self.counters.incr("queue_wait_ms_total", int((time.monotonic() - started) * 1000))
+        try:
+            yield
+        finally:
+            self.running.release(fd)
+
+    def stats(self):
+        in_flight = self.admitted.in_use()
+        active = self.running.in_use()
+        stats = {
+            "max_active_jobs": self.max_active,
+            "max_queued_requests": self.max_queued,
+            "requests_in_flight": in_flight,
+            "jobs_active": active,
+            # Request đã được nhận nhưng chưa có job nào chạy (xấp xỉ với batch nhiều file)
+            "queue_depth": max(0, in_flight - active),
+            "jobs_waiting_this_worker": self.waiting_local,
+        }
+        stats.update(self.counters.snapshot())
+        return stats
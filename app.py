@@ -3,10 +3,10 @@
 FastAPI application để xử lý file docx
 UPDATED: Xử lý đúng nhiều cặp START-END liên tiếp trong cùng paragraph
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from typing import List
+from urllib.parse import quote, unquote
 import os
 import tempfile
 import shutil
@@ -19,7 +19,24 @@ from logging.handlers import RotatingFileHandler
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import io
+import time
+import uuid
+import functools
+import threading
+import contextvars
 import main as docx_main_logic
+from admission import AdmissionController, AdmissionRejected, default_state_dir
+from storage import ScratchStorage, RetentionSweeper, unique_name
+from staticpage import CachedPage
+from jobmemory import MemoryBudget, MemoryBudgetExceeded, estimate_docx_memory
+from docxlimits import DocxLimits, DocumentLimitExceeded, check_member, extract_docx
+from bulkzip import ZipStreamWriter, extract_member, list_members
+from uploadstream import UploadStreamError, receive_body, receive_files
+from singleflight import SingleFlight, content_key
+from ledger import JobLedger
+from jobcontrol import JobAborted, RequestControl, cancel_stats, request_control_var
+from profiling import StackProfiler, function_totals, to_collapsed, to_speedscope
+from logtail import LOG_FORMAT, RequestIdFilter, RecordFilter, filtered_tail, follow, request_id_var
 
 # Cấu hình logging
 LOG_DIR = "logs"
@@ -42,10 +59,12 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 
 formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    LOG_FORMAT,
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+request_id_filter = RequestIdFilter()
 console_handler.setFormatter(formatter)
+console_handler.addFilter(request_id_filter)
 logger.addHandler(console_handler)
 
 try:
@@ -56,6 +75,7 @@ try:
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
+    file_handler.addFilter(request_id_filter)
     logger.addHandler(file_handler)
 except (PermissionError, OSError) as e:
     logger.warning(f"Could not create log file: {e}. Logging to console only.")
@@ -70,790 +90,171 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(ZIP_DIR, exist_ok=True)
 
-executor = ThreadPoolExecutor(max_workers=4)
-
-logger.info("Application started with 4 workers")
-
-# ===== CÁC HÀM XỬ LÝ - UPDATED =====
-
-def unpack_docx(docx_path, extract_dir):
-    """Giải nén file docx"""
-    with zipfile.ZipFile(docx_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_dir)
-
-def pack_docx(source_dir, output_path):
-    """Nén lại thành file docx"""
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as docx:
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, source_dir)
-                docx.write(file_path, arcname)
-
-#!/usr/bin/env python3
-
-"""
-
-FastAPI application để xử lý file docx
-
-UPDATED: Xử lý đúng nhiều cặp START-END liên tiếp trong cùng paragraph
-
-"""
-
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-
-from fastapi.responses import FileResponse, HTMLResponse
-
-from fastapi.staticfiles import StaticFiles
-
-from typing import List
-
-import os
-
-import tempfile
-
-import shutil
-
-from datetime import datetime
-
-import zipfile
-
-from defusedxml import minidom
-
-import re
-
-import logging
-
-from logging.handlers import RotatingFileHandler
-
-import asyncio
-
-from concurrent.futures import ThreadPoolExecutor
-
-import io
-
-import main as docx_main_logic
-
-
-
-# Cấu hình logging
-
-LOG_DIR = "logs"
-
-try:
-
-    os.makedirs(LOG_DIR, exist_ok=True)
-
-    test_file = os.path.join(LOG_DIR, ".test")
-
-    with open(test_file, 'w') as f:
-
-        f.write('test')
-
-    os.remove(test_file)
-
-except (PermissionError, OSError):
-
-    import tempfile
-
-    LOG_DIR = tempfile.gettempdir()
-
-    print(f"Warning: Using temp directory for logs: {LOG_DIR}")
-
-
-
-# Tạo logger
-
-logger = logging.getLogger("docx_processor")
-
-logger.setLevel(logging.INFO)
-
-
-
-console_handler = logging.StreamHandler()
-
-console_handler.setLevel(logging.INFO)
-
-
-
-formatter = logging.Formatter(
-
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-
-    datefmt='%Y-%m-%d %H:%M:%S'
-
-)
-
-console_handler.setFormatter(formatter)
-
-logger.addHandler(console_handler)
-
-
-
-try:
-
-    file_handler = RotatingFileHandler(
-
-        os.path.join(LOG_DIR, "app.log"),
-
-        maxBytes=10*1024*1024,
-
-        backupCount=5
-
-    )
-
-    file_handler.setLevel(logging.INFO)
-
-    file_handler.setFormatter(formatter)
-
-    logger.addHandler(file_handler)
-
-except (PermissionError, OSError) as e:
-
-    logger.warning(f"Could not create log file: {e}. Logging to console only.")
-
-
-
-app = FastAPI(title="DOCX Processor API", description="API để xử lý file DOCX")
-
-
-
-# Tạo thư mục
-
-UPLOAD_DIR = "uploads"
-
-OUTPUT_DIR = "outputs"
-
-ZIP_DIR = "zips"
-
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-os.makedirs(ZIP_DIR, exist_ok=True)
-
-
-
-executor = ThreadPoolExecutor(max_workers=4)
-
-
-
-logger.info("Application started with 4 workers")
-
-
-
-# ===== CÁC HÀM XỬ LÝ - UPDATED =====
-
-
-
-def unpack_docx(docx_path, extract_dir):
-
-    """Giải nén file docx"""
-
-    with zipfile.ZipFile(docx_path, 'r') as zip_ref:
-
-        zip_ref.extractall(extract_dir)
-
-
-
-def pack_docx(source_dir, output_path):
-
-    """Nén lại thành file docx"""
-
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as docx:
-
-        for root, dirs, files in os.walk(source_dir):
-
-            for file in files:
-
-                file_path = os.path.join(root, file)
-
-                arcname = os.path.relpath(file_path, source_dir)
-
-                docx.write(file_path, arcname)
-
-
-
-def process_document_xml(xml_path):
-
-    """Xử lý file document.xml"""
-
-    logger.info("Bắt đầu xử lý document.xml (thông qua main.py)")
-
-    # Call the process_document_xml from main.py
-
-    docx_main_logic.process_document_xml(xml_path)
-
-    logger.info("Hoàn thành xử lý document.xml (thông qua main.py)")
-
-
-
-def process_docx_file(input_path, output_path):
-
-    """Xử lý file docx"""
-
-    logger.info(f"Bắt đầu xử lý file: {input_path}")
-
-    temp_dir = tempfile.mkdtemp()
-
-
-
-    try:
-
-        logger.info("Đang giải nén file docx...")
-
-        unpack_docx(input_path, temp_dir)
-
-
-
-        doc_xml_path = os.path.join(temp_dir, 'word', 'document.xml')
-
-        if not os.path.exists(doc_xml_path):
-
-            logger.error("Không tìm thấy word/document.xml trong file docx")
-
-            raise Exception("Không tìm thấy word/document.xml trong file docx")
-
-
-
-        process_document_xml(doc_xml_path)
-
-
-
-        logger.info(f"Đang tạo file output: {output_path}")
-
-        pack_docx(temp_dir, output_path)
-
-
-
-        logger.info(f"✅ Hoàn thành! File đã được lưu tại: {output_path}")
-
-
-
-    finally:
-
-        shutil.rmtree(temp_dir)
-
-        logger.info(f"Đã dọn dẹp thư mục tạm: {temp_dir}")
-
-
-
-def cleanup_file(file_path: str):
-
-    """Xóa file sau khi download xong"""
-
-    try:
-
-        if os.path.exists(file_path):
-
-            os.remove(file_path)
-
-            logger.info(f"Đã xóa file sau khi download: {file_path}")
-
-    except Exception as e:
-
-        logger.error(f"Lỗi khi xóa file {file_path}: {str(e)}")
-
-
-
-# ===== API ENDPOINTS =====
-
-
-
-@app.get("/", response_class=HTMLResponse)
-
-async def index():
-
-    """Trang chủ với giao diện upload file"""
-
-    with open("index.html", "r", encoding="utf-8") as f:
-
-        html_content = f.read()
-
-    return HTMLResponse(content=html_content)
-
-
-
-@app.post("/process")
-
-async def process_file(file: UploadFile = File(...)):
-
-    """Endpoint để xử lý file docx được upload"""
-
-    logger.info(f"Nhận request xử lý file: {file.filename}")
-
-
-
-    if not file.filename.endswith('.docx'):
-
-        logger.warning(f"File không hợp lệ: {file.filename}")
-
-        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
-
-
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    input_filename = f"input_{timestamp}.docx"
-
-    output_filename = f"processed_{timestamp}.docx"
-
-
-
-    input_path = os.path.join(UPLOAD_DIR, input_filename)
-
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-
-
-    try:
-
-        logger.info(f"Lưu file upload: {input_filename}")
-
-        with open(input_path, "wb") as buffer:
-
-            shutil.copyfileobj(file.file, buffer)
-
-
-
-        process_docx_file(input_path, output_path)
-
-
-
-        os.remove(input_path)
-
-        logger.info(f"Xử lý thành công file: {file.filename} -> {output_filename}")
-
-
-
-        return {
-
-            "message": "Xử lý file thành công",
-
-            "output_filename": output_filename
-
-        }
-
-
-
-    except Exception as e:
-
-        logger.error(f"Lỗi khi xử lý file {file.filename}: {str(e)}", exc_info=True)
-
-        if os.path.exists(input_path):
-
-            os.remove(input_path)
-
-        if os.path.exists(output_path):
-
-            os.remove(output_path)
-
-
-
-        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
-
-
-
-@app.post("/process-multiple")
-
-async def process_multiple_files(files: List[UploadFile] = File(...)):
-
-    """Endpoint để xử lý nhiều file docx song song"""
-
-    logger.info(f"Nhận request xử lý {len(files)} file(s)")
-
-
-
-    for file in files:
-
-        if not file.filename.endswith('.docx'):
-
-            logger.warning(f"File không hợp lệ: {file.filename}")
-
-            raise HTTPException(status_code=400, detail=f"File {file.filename} không phải .docx")
-
-
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-
-
-    if len(files) == 1:
-
-        file = files[0]
-
-        input_filename = f"input_{timestamp}.docx"
-
-        output_filename = f"processed_{timestamp}.docx"
-
-
-
-        input_path = os.path.join(UPLOAD_DIR, input_filename)
-
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-
-
-        try:
-
-            logger.info(f"Lưu file upload: {input_filename}")
-
-            with open(input_path, "wb") as buffer:
-
-                shutil.copyfileobj(file.file, buffer)
-
-
-
-            process_docx_file(input_path, output_path)
-
-
-
-            os.remove(input_path)
-
-            logger.info(f"Xử lý thành công file: {file.filename} -> {output_filename}")
-
-
-
-            return {
-
-                "message": "Xử lý file thành công",
-
-                "output_filename": output_filename,
-
-                "processed_count": 1,
-
-                "is_zip": False
-
-            }
-
-
-
-        except Exception as e:
-
-            logger.error(f"Lỗi khi xử lý file {file.filename}: {str(e)}", exc_info=True)
-
-            if os.path.exists(input_path):
-
-                os.remove(input_path)
-
-            if os.path.exists(output_path):
-
-                os.remove(output_path)
-
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
-
-
-
-    else:
-
-        try:
-
-            input_paths = []
-
-            output_paths = []
-
-
-
-            for idx, file in enumerate(files):
-
-                input_filename = f"input_{timestamp}_{idx}.docx"
-
-                output_filename = f"processed_{timestamp}_{idx}.docx"
-
-
-
-                input_path = os.path.join(UPLOAD_DIR, input_filename)
-
-                output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-
-
-                logger.info(f"Lưu file upload {idx + 1}/{len(files)}: {input_filename}")
-
-                with open(input_path, "wb") as buffer:
-
-                    shutil.copyfileobj(file.file, buffer)
-
-
-
-                input_paths.append(input_path)
-
-                output_paths.append((output_path, file.filename))
-
-
-
-            logger.info(f"Bắt đầu xử lý song song {len(files)} files với ThreadPoolExecutor")
-
-            loop = asyncio.get_event_loop()
-
-
-
-            async def process_file_async(inp, outp):
-
-                return await loop.run_in_executor(executor, process_docx_file, inp, outp)
-
-
-
-            tasks = [process_file_async(inp, outp[0]) for inp, outp in zip(input_paths, output_paths)]
-
-            await asyncio.gather(*tasks)
-
-
-
-            for input_path in input_paths:
-
-                if os.path.exists(input_path):
-
-                    os.remove(input_path)
-
-
-
-            zip_filename = f"processed_{timestamp}.zip"
-
-            zip_path = os.path.join(ZIP_DIR, zip_filename)
-
-
-
-            logger.info(f"Tạo file zip: {zip_filename}")
-
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-
-                for output_path, original_name in output_paths:
-
-                    if os.path.exists(output_path):
-
-                        arcname = f"processed_{original_name}"
-
-                        zipf.write(output_path, arcname)
-
-                        os.remove(output_path)
-
-
-
-            logger.info(f"Xử lý thành công {len(files)} files -> {zip_filename}")
-
-
-
-            return {
-
-                "message": f"Xử lý thành công {len(files)} files",
-
-                "output_filename": zip_filename,
-
-                "processed_count": len(files),
-
-                "is_zip": True
-
-            }
-
-
-
-        except Exception as e:
-
-            logger.error(f"Lỗi khi xử lý nhiều files: {str(e)}", exc_info=True)
-
-
-
-            for input_path in input_paths:
-
-                if os.path.exists(input_path):
-
-                    os.remove(input_path)
-
-            for output_path, _ in output_paths:
-
-                if os.path.exists(output_path):
-
-                    os.remove(output_path)
-
-
-
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý files: {str(e)}")
-
-
-
-@app.get("/download/{filename}")
-
-async def download_file(filename: str, background_tasks: BackgroundTasks):
-
-    """Endpoint để tải file đã xử lý"""
-
-    file_path = os.path.join(OUTPUT_DIR, filename)
-
-
-
-    if not os.path.exists(file_path):
-
-        raise HTTPException(status_code=404, detail="File không tồn tại")
-
-
-
-    background_tasks.add_task(cleanup_file, file_path)
-
-    
-
-    logger.info(f"Đang gửi file để download: {filename}")
-
-
-
-    return FileResponse(
-
-        path=file_path,
-
-        filename=filename,
-
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-
-    )
-
-
-
-@app.get("/download-zip/{filename}")
-
-async def download_zip(filename: str, background_tasks: BackgroundTasks):
-
-    """Endpoint để tải file zip"""
-
-    file_path = os.path.join(ZIP_DIR, filename)
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
+executor = ThreadPoolExecutor(max_workers=4)
 
+# Giới hạn đồng thời & hàng đợi dùng chung cho mọi uvicorn worker
+MAX_ACTIVE_JOBS = int(os.environ.get("MAX_ACTIVE_JOBS", os.cpu_count() or 4))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", 32))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 5))
+ADMISSION_DIR = os.environ.get("ADMISSION_DIR", default_state_dir())
+ADMISSION_PATHS = {"/process", "/process-multiple", "/process-archive", "/process-raw", "/analyze"}
+
+# /admin/profile (chạy job dưới profiler, chậm hơn bình thường vài lần) mặc định tắt; khi tắt
+# endpoint không được đăng ký nên trả 404 mà không đọc file upload
+ENABLE_ADMIN_PROFILE = os.environ.get("ENABLE_ADMIN_PROFILE", "0").lower() in ("1", "true", "yes")
+if ENABLE_ADMIN_PROFILE:
+    ADMISSION_PATHS.add("/admin/profile")
+
+admission = AdmissionController(
+    os.path.join(ADMISSION_DIR, "admission"),
+    MAX_ACTIVE_JOBS,
+    MAX_QUEUED_REQUESTS,
+    retry_after=RETRY_AFTER_SECONDS
+)
 
-    if not os.path.exists(file_path):
-
-        raise HTTPException(status_code=404, detail="File không tồn tại")
-
-
-
-    background_tasks.add_task(cleanup_file, file_path)
-
-    
-
-    logger.info(f"Đang gửi file zip để download: {filename}")
-
-
-
-    return FileResponse(
-
-        path=file_path,
-
-        filename=filename,
-
-        media_type="application/zip"
-
-    )
-
-
-
-@app.get("/health")
-
-async def health_check():
-
-    """Health check endpoint"""
-
-    return {"status": "ok"}
-
-
-
-@app.get("/logs")
-
-async def get_logs():
-
-    """Endpoint để xem logs gần đây"""
-
-    log_file = os.path.join(LOG_DIR, "app.log")
-
-
-
-    if not os.path.exists(log_file):
-
-        return {"logs": "Không có logs nào."}
-
-
-
-    try:
-
-        with open(log_file, 'r', encoding='utf-8') as f:
-
-            lines = f.readlines()
-
-            recent_logs = ''.join(lines[-50:]) if len(lines) > 50 else ''.join(lines)
-
-
-
-        return {"logs": recent_logs}
-
-    except Exception as e:
-
-        logger.error(f"Lỗi khi đọc logs: {str(e)}")
+# document.xml lớn được chia đoạn và xử lý bằng nhiều process khi còn slot chạy job rảnh
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", min(4, os.cpu_count() or 1)))
+PARALLEL_MIN_BYTES = int(os.environ.get("PARALLEL_MIN_BYTES", docx_main_logic.PARALLEL_MIN_BYTES))
+
+# Ngân sách bộ nhớ cho các job của mỗi worker; bộ nhớ đỉnh của job ước tính bằng
+# JOB_MEMORY_OVERHEAD_BYTES + JOB_MEMORY_FACTOR * kích thước giải nén của document.xml
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_BYTES", 1024 * 1024 * 1024))
+JOB_MEMORY_FACTOR = float(os.environ.get("JOB_MEMORY_FACTOR", 16))
+JOB_MEMORY_OVERHEAD_BYTES = int(os.environ.get("JOB_MEMORY_OVERHEAD_BYTES", 32 * 1024 * 1024))
+
+memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+# Giới hạn an toàn cho file upload (chống zip bomb): tổng bytes giải nén, số member, tỉ lệ nén
+# của từng member; document.xml giới hạn độ sâu lồng nhau và số element. Vượt giới hạn -> 413
+DOCX_LIMITS = DocxLimits(
+    max_unpacked_bytes=int(os.environ.get("UNPACK_MAX_BYTES", 512 * 1024 * 1024)),
+    max_members=int(os.environ.get("UNPACK_MAX_MEMBERS", 2000)),
+    max_ratio=float(os.environ.get("UNPACK_MAX_RATIO", 200)),
+    max_xml_depth=int(os.environ.get("XML_MAX_DEPTH", 256)),
+    max_xml_elements=int(os.environ.get("XML_MAX_ELEMENTS", 2000000)),
+)
 
-        return {"logs": f"Lỗi khi đọc logs: {str(e)}"}
+# Request trùng nội dung (sha256 của file upload) với một job đang chạy ở bất kỳ worker nào
+# sẽ chờ và dùng chung kết quả của job đó; kết quả chỉ được công bố sang thư mục dùng chung khi
+# có request đang chờ và được giữ SINGLE_FLIGHT_TTL_SECONDS giây (dọn cùng RetentionSweeper)
+SINGLE_FLIGHT_TTL_SECONDS = int(os.environ.get("SINGLE_FLIGHT_TTL_SECONDS", 30))
+
+single_flight = SingleFlight(os.path.join(ADMISSION_DIR, "singleflight"), SINGLE_FLIGHT_TTL_SECONDS)
+
+# /process-archive: số member tối đa đang được giải nén/xử lý/chờ gửi cùng lúc cho một request
+ARCHIVE_WINDOW = int(os.environ.get("ARCHIVE_WINDOW", 4))
+# /process-archive: số member .docx tối đa của một archive (vượt quá -> 413)
+ARCHIVE_MAX_MEMBERS = int(os.environ.get("ARCHIVE_MAX_MEMBERS", 500))
+
+# Hạn xử lý mỗi request (giây, 0: không giới hạn); client có thể rút ngắn bằng header
+# X-Deadline-Seconds. Request quá hạn hoặc client ngắt kết nối thì job bị huỷ.
+# /process-archive dùng JOB_DEADLINE_SECONDS cho từng member và ARCHIVE_DEADLINE_SECONDS
+# cho cả request (tính tới khi gửi xong archive)
+JOB_DEADLINE_SECONDS = float(os.environ.get("JOB_DEADLINE_SECONDS", 300))
+ARCHIVE_DEADLINE_SECONDS = float(os.environ.get("ARCHIVE_DEADLINE_SECONDS", 3600))
+
+# Sổ ghi job (SQLite) cho /stats: giữ LEDGER_MAX_ROWS job gần nhất, ghi theo lô bằng thread nền
+LEDGER_PATH = os.environ.get("LEDGER_PATH", os.path.join(LOG_DIR, "jobs.db"))
+LEDGER_MAX_ROWS = int(os.environ.get("LEDGER_MAX_ROWS", 100000))
+
+ledger = JobLedger(LEDGER_PATH, LEDGER_MAX_ROWS)
+
+# Workspace tạm cho từng request: mặc định trên RAM, file lớn thì xuống đĩa (UPLOAD_DIR)
+SCRATCH_DIR = os.environ.get("SCRATCH_DIR", os.path.join(ADMISSION_DIR, "scratch"))
+SCRATCH_RAM_MAX_BYTES = int(os.environ.get("SCRATCH_RAM_MAX_BYTES", 32 * 1024 * 1024))
+
+storage = ScratchStorage(SCRATCH_DIR, UPLOAD_DIR, SCRATCH_RAM_MAX_BYTES)
+stale_workspaces = storage.purge_stale()
+if stale_workspaces:
+    logger.info(f"Đã dọn {stale_workspaces} workspace còn sót từ process cũ")
+
+# Dọn file không được download: TTL + quota tổng dung lượng cho uploads/outputs/zips
+RETENTION_TTL_SECONDS = int(os.environ.get("RETENTION_TTL_SECONDS", 3600))
+RETENTION_MAX_BYTES = int(os.environ.get("RETENTION_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+RETENTION_SWEEP_INTERVAL = int(os.environ.get("RETENTION_SWEEP_INTERVAL", 60))
+
+sweeper = RetentionSweeper(
+    [UPLOAD_DIR, OUTPUT_DIR, ZIP_DIR],
+    RETENTION_TTL_SECONDS,
+    RETENTION_MAX_BYTES,
+    interval_seconds=RETENTION_SWEEP_INTERVAL,
+    hooks=[single_flight.purge]
+)
 
+# Trang chủ giữ trong bộ nhớ (đọc lại khi file đổi), nén sẵn, có ETag/304
+INDEX_CACHE_CONTROL = os.environ.get("INDEX_CACHE_CONTROL", "public, max-age=60")
+index_page = CachedPage("index.html", cache_control=INDEX_CACHE_CONTROL)
+index_page.preload()
 
+logger.info("Application started with 4 workers")
+logger.info(f"Admission control: {MAX_ACTIVE_JOBS} job đồng thời, tối đa {MAX_QUEUED_REQUESTS} request chờ")
 
-if __name__ == "__main__":
+# ===== CÁC HÀM XỬ LÝ - UPDATED =====
 
-    import uvicorn
+def unpack_docx(docx_path, extract_dir):
+    """Giải nén file docx theo từng đoạn, dừng sớm khi vượt DOCX_LIMITS"""
+    extract_docx(docx_path, extract_dir, DOCX_LIMITS)
 
-    logger.info("Starting server on http://0.0.0.0:8000")
+def pack_docx(source_dir, output_path):
+    """Nén lại thành file docx"""
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as docx:
+        for root, dirs, files in os.walk(source_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, source_dir)
+                docx.write(file_path, arcname)
 
-    logger.info("For production with workers, use: uvicorn app:app --host 0.0.0.0 --port 8000 --workers 4")
+def chunk_workers_for(xml_path):
+    """Số process dùng cho một document.xml: chỉ chia đoạn khi file đủ lớn và còn đủ slot chạy
+    job rảnh (xem main.parallel_workers)."""
+    if PARALLEL_WORKERS <= 1:
+        return 1
+    idle = admission.max_active - admission.running.in_use()
+    return docx_main_logic.parallel_workers(xml_path, min(PARALLEL_WORKERS, idle + 1), PARALLEL_MIN_BYTES)
+
+def process_document_xml(xml_path, report=None, cancel=None, workers=None):
+    """Xử lý file document.xml (report: dict nhận số liệu của lần chạy; cancel: Event để
+    dừng giữa các bước, xem main.py; workers: số process, mặc định theo chunk_workers_for)"""
+    logger.info("Bắt đầu xử lý document.xml (thông qua main.py)")
+    if workers is None:
+        workers = chunk_workers_for(xml_path)
+    if workers > 1:
+        logger.info(f"document.xml lớn, xử lý song song tối đa {workers} đoạn")
+    # Call the process_document_xml from main.py
+    docx_main_logic.process_document_xml(xml_path, workers, report, cancel, DOCX_LIMITS)
+    logger.info("Hoàn thành xử lý document.xml (thông qua main.py)")
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
-    """Xử lý file document.xml"""
-    logger.info("Bắt đầu xử lý document.xml")
-    with open(xml_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    dom = minidom.parseString(content)
-    body = dom.getElementsByTagName('w:body')[0]
-
-    # Bước 0: Xóa trang đầu nếu chỉ có "thẻ 1"
-    remove_first_page_if_the1(body)
-
-    # Bước 1: Xử lý BLOCK_START0 và BLOCK_END
-    logger.info("Bước 1: Xử lý xóa nội dung giữa BLOCK_START0 và BLOCK_END")
-    elements_removed = process_removal_between_tags(body, 'BLOCK_START', 'BLOCK_END', '0')
-    logger.info(f"  Đã xóa {elements_removed} elements giữa các BLOCK tags")
-
-    # Bước 2: Xử lý SECTION_START0 và SECTION_END
-    logger.info("Bước 2: Xử lý xóa nội dung giữa SECTION_START0 và SECTION_END")
-    elements_removed = process_removal_between_tags(body, 'SECTION_START', 'SECTION_END', '0')
-    logger.info(f"  Đã xóa {elements_removed} elements giữa các SECTION tags")
-
-    # Bước 3: Xóa các table row có ROW0
-    logger.info("Bước 3: Xóa các table row có ROW0")
-    rows_removed = remove_rows_with_tag(body, '0')
-    logger.info(f"  Đã xóa {rows_removed} rows có ROW0")
-
-    # Bước 4: Xóa tất cả các tag còn lại
-    logger.info("Bước 4: Xóa tất cả các tag còn lại")
-    tags_removed = remove_all_remaining_tags(body)
-    logger.info(f"  Đã xóa tags từ {tags_removed} elements")
-
-    # Bước 5: Lưu document.xml
-    logger.info("Bước 5: Lưu document.xml")
-    with open(xml_path, 'w', encoding='utf-8') as f:
-        f.write(dom.toxml())
-    logger.info("Hoàn thành xử lý document.xml")
-
-def process_docx_file(input_path, output_path):
-    """Xử lý file docx"""
+def process_docx_file(input_path, output_path, work_dir=None, report=None, cancel=None, workers=None):
+    """Xử lý file docx (giải nén vào work_dir nếu có, mặc định thư mục tạm hệ thống).
+    output_path có thể là đường dẫn hoặc file-like object (vd io.BytesIO).
+    report: dict (tuỳ chọn) nhận số liệu của lần chạy, thêm thời gian giải nén/đóng gói.
+    cancel: threading.Event (tuỳ chọn); khi được set, job dừng ở ranh giới bước kế tiếp.
+    workers: số process xử lý document.xml (mặc định theo chunk_workers_for)."""
     logger.info(f"Bắt đầu xử lý file: {input_path}")
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(dir=work_dir)
+    if report is None:
+        report = {}
 
     try:
         logger.info("Đang giải nén file docx...")
+        started = time.perf_counter()
         unpack_docx(input_path, temp_dir)
+        unpack_seconds = time.perf_counter() - started
 
         doc_xml_path = os.path.join(temp_dir, 'word', 'document.xml')
         if not os.path.exists(doc_xml_path):
             logger.error("Không tìm thấy word/document.xml trong file docx")
             raise Exception("Không tìm thấy word/document.xml trong file docx")
 
-        process_document_xml(doc_xml_path)
+        process_document_xml(doc_xml_path, report, cancel, workers)
 
         logger.info(f"Đang tạo file output: {output_path}")
+        started = time.perf_counter()
         pack_docx(temp_dir, output_path)
+        report['steps'] = {'unpack': round(unpack_seconds, 4), **report.get('steps', {}),
+                           'pack': round(time.perf_counter() - started, 4)}
 
         logger.info(f"✅ Hoàn thành! File đã được lưu tại: {output_path}")
 
@@ -861,6 +262,119 @@ def process_docx_file(input_path, output_path):
         shutil.rmtree(temp_dir)
         logger.info(f"Đã dọn dẹp thư mục tạm: {temp_dir}")
 
+def profile_docx_file(input_path, work_dir, cancel=None):
+    """Chạy process_docx_file (tuần tự, một process) dưới StackProfiler; trả về (profiler, report)"""
+    profiler = StackProfiler()
+    report = {}
+    profiler.run(process_docx_file, input_path, os.path.join(work_dir, "profiled.docx"), work_dir,
+                 report, cancel, workers=1)
+    return profiler, report
+
+def estimate_job_memory(input_path):
+    """Bộ nhớ đỉnh ước tính (bytes) khi xử lý file docx input_path"""
+    return int(estimate_docx_memory(input_path, JOB_MEMORY_FACTOR, JOB_MEMORY_OVERHEAD_BYTES))
+
+async def run_job(func, *args, memory=0):
+    """Chạy một job xử lý trong executor sau khi đủ ngân sách bộ nhớ của worker (memory bytes
+    ước tính) và giành được slot chạy toàn cục. func nhận thêm tham số cancel (threading.Event).
+    Coroutine bị huỷ khi job còn chờ thì job bị bỏ khỏi hàng đợi; khi job đang chạy thì cancel
+    được set và slot chỉ được trả sau khi thread đã dừng (ở ranh giới bước kế tiếp)."""
+    cancel = threading.Event()
+    started = None
+    try:
+        async with memory_budget.reserve(memory), admission.slot():
+            loop = asyncio.get_running_loop()
+            # Mang context (request id cho log) sang thread của executor
+            ctx = contextvars.copy_context()
+            job = functools.partial(ctx.run, memory_budget.run_measured, memory,
+                                    functools.partial(func, cancel=cancel), *args)
+            started = time.monotonic()
+            future = loop.run_in_executor(executor, job)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancel.set()
+                await asyncio.wait([future])
+                if not future.cancelled():
+                    future.exception()
+                cancel_stats.jobs_aborted_running += 1
+                cancel_stats.wasted_seconds += time.monotonic() - started
+                logger.info(f"Job bị huỷ khi đang chạy, đã dừng sau {time.monotonic() - started:.2f}s")
+                raise
+    except asyncio.CancelledError:
+        if started is None:
+            cancel_stats.jobs_cancelled_queued += 1
+            logger.info("Job bị huỷ khi còn trong hàng đợi")
+        raise
+
+async def process_docx_job(input_path, output, work_dir):
+    """Xử lý file docx input_path thành file output (đường dẫn, ghi thẳng vào đó) qua run_job;
+    nếu đang có job với cùng nội dung input thì chờ và dùng chung kết quả của nó.
+    Lỗi/bị huỷ thì output không còn tồn tại.
+    Mỗi lần gọi được ghi một dòng vào sổ job (ledger), kể cả khi lỗi/bị từ chối."""
+    started = time.perf_counter()
+    report = {}
+    done = False
+    entry = {"outcome": "error", "input_bytes": os.path.getsize(input_path)}
+    try:
+        key = await asyncio.to_thread(content_key, input_path)
+
+        async def compute(target):
+            await run_job(process_docx_file, input_path, target, work_dir, report,
+                          memory=estimate_job_memory(input_path))
+
+        control = request_control_var.get()
+        if control is None:
+            await single_flight.run(key, compute, output)
+        else:
+            await control.run(single_flight.run(key, compute, output))
+        entry["output_bytes"] = os.path.getsize(output)
+        if control is not None and control.reason is not None:
+            # Job xong khi request đã bị huỷ: không để lại kết quả ở nơi không ai tải về
+            cancel_stats.results_discarded += 1
+            control.check()
+        # report rỗng: kết quả dùng chung từ job trùng nội dung, không chạy pipeline
+        entry["outcome"] = "ok" if report else "shared"
+        done = True
+    except (MemoryBudgetExceeded, DocumentLimitExceeded):
+        entry["outcome"] = "rejected"
+        raise
+    except (JobAborted, asyncio.CancelledError):
+        entry["outcome"] = "cancelled"
+        raise
+    finally:
+        if not done and os.path.exists(output):
+            os.remove(output)
+        entry.update(
+            request_id=request_id_var.get(),
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            paragraphs=report.get("paragraphs"),
+            tables=report.get("tables"),
+            table_rows=report.get("rows"),
+            tags=report.get("tags"),
+            removed=report.get("removed"),
+            steps=report.get("steps"),
+        )
+        ledger.record(entry)
+
+def attachment_headers(filename):
+    """Content-Disposition cho file tải về, hỗ trợ tên file có dấu (RFC 5987)"""
+    ascii_name = filename.encode("ascii", "ignore").decode() or "download"
+    return {"Content-Disposition": f"attachment; filename=\"{ascii_name}\"; filename*=utf-8''{quote(filename)}"}
+
+async def stream_file(path, cleanup, chunk_size=1024 * 1024):
+    """Đọc file theo từng đoạn (trong thread) để trả về dạng stream; gọi cleanup() khi gửi
+    xong hoặc khi client ngắt kết nối giữa chừng"""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        cleanup()
+
 def cleanup_file(file_path: str):
     """Xóa file sau khi download xong"""
     try:
@@ -872,161 +386,627 @@ def cleanup_file(file_path: str):
 
 # ===== API ENDPOINTS =====
 
-@app.get("/", response_class=HTMLResponse)
-async def index():
-    """Trang chủ với giao diện upload file"""
-    with open("index.html", "r", encoding="utf-8") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content)
-
-@app.post("/process")
-async def process_file(file: UploadFile = File(...)):
-    """Endpoint để xử lý file docx được upload"""
-    logger.info(f"Nhận request xử lý file: {file.filename}")
-
-    if not file.filename.endswith('.docx'):
-        logger.warning(f"File không hợp lệ: {file.filename}")
-        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    input_filename = f"input_{timestamp}.docx"
-    output_filename = f"processed_{timestamp}.docx"
+@app.on_event("startup")
+async def start_background_tasks():
+    sweeper.start()
+    ledger.start()
 
-    input_path = os.path.join(UPLOAD_DIR, input_filename)
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-    try:
-        logger.info(f"Lưu file upload: {input_filename}")
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    sweeper.stop()
+    ledger.stop()
 
-        process_docx_file(input_path, output_path)
+class AdmissionControl:
+    """Middleware ASGI thuần: từ chối sớm (429) trước khi đọc/spool body upload khi hàng đợi
+    đã đầy; request được nhận thì có hạn xử lý và được theo dõi client ngắt kết nối
+    (RequestControl). Slot admission và RequestControl được giữ tới khi app gửi xong toàn bộ
+    response, kể cả body dạng stream (StreamingResponse của /process-archive, /process-raw);
+    việc theo dõi ngắt kết nối dừng ngay trước đoạn body cuối cùng."""
 
-        os.remove(input_path)
-        logger.info(f"Xử lý thành công file: {file.filename} -> {output_filename}")
+    def __init__(self, app):
+        self.app = app
 
-        return {
-            "message": "Xử lý file thành công",
-            "output_filename": output_filename
-        }
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in ADMISSION_PATHS:
+            await self.app(scope, receive, send)
+            return
 
-    except Exception as e:
-        logger.error(f"Lỗi khi xử lý file {file.filename}: {str(e)}", exc_info=True)
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        request = Request(scope)
+        try:
+            token = admission.admit()
+        except AdmissionRejected as e:
+            logger.warning(f"Từ chối request {request.url.path}: hàng đợi đã đầy")
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Máy chủ đang quá tải, vui lòng thử lại sau"},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        control = RequestControl(request_deadline(request))
+        control_token = request_control_var.set(control)
+
+        async def send_until_complete(message):
+            # Ngừng theo dõi trước khi gửi đoạn body cuối: sau đó receive() trả http.disconnect
+            # vì response đã xong, không phải vì client ngắt kết nối
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                control.close()
+            await send(message)
 
-        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
+        try:
+            await self.app(scope, receive, send_until_complete)
+        finally:
+            control.close()
+            request_control_var.reset(control_token)
+            admission.leave(token)
+
+app.add_middleware(AdmissionControl)
+
+def request_deadline(request: Request):
+    """Hạn xử lý (giây) của request: JOB_DEADLINE_SECONDS (ARCHIVE_DEADLINE_SECONDS với
+    /process-archive), hoặc ngắn hơn theo header X-Deadline-Seconds"""
+    if request.url.path == "/process-archive":
+        deadline = ARCHIVE_DEADLINE_SECONDS or None
+    else:
+        deadline = JOB_DEADLINE_SECONDS or None
+    try:
+        requested = float(request.headers["x-deadline-seconds"])
+    except (KeyError, ValueError):
+        return deadline
+    if requested > 0 and (deadline is None or requested < deadline):
+        return requested
+    return deadline
+
+def watch_disconnect(request: Request):
+    """Bắt đầu theo dõi client ngắt kết nối cho request (sau khi đã đọc hết body)"""
+    control = request_control_var.get()
+    if control is not None:
+        control.watch_disconnect(request)
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Gắn request id (từ header X-Request-ID hoặc sinh mới) vào log và response"""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
-@app.post("/process-multiple")
-async def process_multiple_files(files: List[UploadFile] = File(...)):
-    """Endpoint để xử lý nhiều file docx song song"""
-    logger.info(f"Nhận request xử lý {len(files)} file(s)")
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def index(request: Request):
+    """Trang chủ với giao diện upload file"""
+    return index_page.response(request)
 
-    for file in files:
-        if not file.filename.endswith('.docx'):
-            logger.warning(f"File không hợp lệ: {file.filename}")
-            raise HTTPException(status_code=400, detail=f"File {file.filename} không phải .docx")
+@app.post("/process")
+async def process_file(request: Request, file: UploadFile = File(...), download: bool = False):
+    """Endpoint để xử lý file docx được upload.
+    Với ?download=true hoặc header Accept là docx, file kết quả được trả thẳng trong response
+    (không lưu vào OUTPUT_DIR, không cần gọi /download)."""
+    logger.info(f"Nhận request xử lý file: {file.filename}")
+    watch_disconnect(request)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if not file.filename.endswith('.docx'):
+        logger.warning(f"File không hợp lệ: {file.filename}")
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
 
-    if len(files) == 1:
-        file = files[0]
-        input_filename = f"input_{timestamp}.docx"
-        output_filename = f"processed_{timestamp}.docx"
+    if download or DOCX_MEDIA_TYPE in request.headers.get("accept", ""):
+        return await process_file_inline(file)
 
-        input_path = os.path.join(UPLOAD_DIR, input_filename)
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
+    output_filename = unique_name("processed", ".docx")
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
 
+    with storage.workspace(file.size or 0) as ws:
+        input_path = ws.path("input.docx")
         try:
-            logger.info(f"Lưu file upload: {input_filename}")
+            logger.info(f"Lưu file upload vào workspace: {ws.root}")
             with open(input_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
 
-            process_docx_file(input_path, output_path)
+            await process_docx_job(input_path, output_path, ws.root)
 
-            os.remove(input_path)
             logger.info(f"Xử lý thành công file: {file.filename} -> {output_filename}")
 
             return {
                 "message": "Xử lý file thành công",
-                "output_filename": output_filename,
-                "processed_count": 1,
-                "is_zip": False
+                "output_filename": output_filename
             }
 
+        except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+            logger.warning(f"Từ chối file {file.filename}: {e}")
+            raise HTTPException(status_code=413, detail=str(e))
+        except JobAborted as e:
+            logger.warning(f"Huỷ xử lý file {file.filename}: {e}")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
         except Exception as e:
             logger.error(f"Lỗi khi xử lý file {file.filename}: {str(e)}", exc_info=True)
-            if os.path.exists(input_path):
-                os.remove(input_path)
             if os.path.exists(output_path):
                 os.remove(output_path)
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
 
-    else:
-        try:
-            input_paths = []
-            output_paths = []
-
-            for idx, file in enumerate(files):
-                input_filename = f"input_{timestamp}_{idx}.docx"
-                output_filename = f"processed_{timestamp}_{idx}.docx"
-
-                input_path = os.path.join(UPLOAD_DIR, input_filename)
-                output_path = os.path.join(OUTPUT_DIR, output_filename)
-
-                logger.info(f"Lưu file upload {idx + 1}/{len(files)}: {input_filename}")
-                with open(input_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
+            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
 
-                input_paths.append(input_path)
-                output_paths.append((output_path, file.filename))
+async def process_file_inline(file: UploadFile):
+    """Xử lý và trả file docx kết quả ngay trong response (một round trip); file kết quả nằm
+    trong workspace và được gửi dạng stream, workspace bị xoá khi gửi xong"""
+    ws = storage.workspace(file.size or 0)
+    streaming = False
+    try:
+        input_path = ws.path("input.docx")
+        with open(input_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
 
-            logger.info(f"Bắt đầu xử lý song song {len(files)} files với ThreadPoolExecutor")
-            loop = asyncio.get_event_loop()
+        result_path = ws.path("processed.docx")
+        await process_docx_job(input_path, result_path, ws.root)
+        result_size = os.path.getsize(result_path)
+        logger.info(f"Xử lý thành công file: {file.filename} -> trả trực tiếp {result_size} bytes")
+        response = StreamingResponse(
+            stream_file(result_path, ws.close),
+            media_type=DOCX_MEDIA_TYPE,
+            headers={**attachment_headers(f"processed_{file.filename}"), "Content-Length": str(result_size)}
+        )
+        streaming = True
+        return response
+    except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+        logger.warning(f"Từ chối file {file.filename}: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except JobAborted as e:
+        logger.warning(f"Huỷ xử lý file {file.filename}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý file {file.filename}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
+    finally:
+        if not streaming:
+            ws.close()
+
+# /process-multiple đọc body dạng stream nên khai báo lại schema cho trang docs
+MULTIPLE_FILES_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["files"],
+            "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+        }}},
+    }
+}
+
+# Mã HTTP tương ứng với trạng thái lỗi của từng file trong batch
+FILE_ERROR_STATUS_CODES = {"invalid": 400, "rejected": 413, "cancelled": 504, "error": 500}
+
+@app.post("/process-multiple", openapi_extra=MULTIPLE_FILES_OPENAPI)
+async def process_multiple_files(request: Request):
+    """Endpoint để xử lý nhiều file docx song song.
+    Body được nhận dạng stream: mỗi file được đưa vào xử lý ngay khi part của nó upload xong,
+    trong lúc các file sau vẫn đang được upload; kết quả được gom bằng as_completed.
+    File lỗi không làm hỏng cả batch: zip chỉ chứa các file thành công, `results` ghi trạng
+    thái từng file (ok / invalid / rejected / cancelled / error) để client chỉ gửi lại các file lỗi."""
+    logger.info("Nhận request xử lý nhiều file")
+
+    expected_bytes = int(request.headers.get("content-length") or 0)
+    # File kết quả đầu tiên ghi thẳng vào OUTPUT_DIR (trường hợp chỉ có một file),
+    # các file sau nằm trong workspace cho tới khi được nén vào zip
+    output_filename = unique_name("processed", ".docx")
+    first_output_path = os.path.join(OUTPUT_DIR, output_filename)
+    zip_filename = unique_name("processed", ".zip")
+    zip_path = os.path.join(ZIP_DIR, zip_filename)
+    received = []
+    results = {}
+    tasks = []
 
-            async def process_file_async(inp, outp):
-                return await loop.run_in_executor(executor, process_docx_file, inp, outp)
+    try:
+        with storage.workspace(expected_bytes) as ws:
+            async def process_one(item):
+                output_path = first_output_path if item.index == 0 else ws.path(f"processed_{item.index}.docx")
+                result = {"index": item.index, "filename": item.filename}
+                try:
+                    await process_docx_job(item.path, output_path, ws.root)
+                    result["status"] = "ok"
+                    return result, output_path
+                except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+                    logger.warning(f"Từ chối file {item.filename}: {e}")
+                    result.update(status="rejected", detail=str(e))
+                except JobAborted as e:
+                    logger.warning(f"Huỷ xử lý file {item.filename}: {e}")
+                    result.update(status="cancelled", detail=str(e))
+                except Exception as e:
+                    logger.error(f"Lỗi khi xử lý file {item.filename}: {str(e)}", exc_info=True)
+                    result.update(status="error", detail=f"Lỗi khi xử lý file: {str(e)}")
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                return result, None
+
+            try:
+                async for item in receive_files(request, "files", lambda idx, _: ws.path(f"input_{idx}.docx")):
+                    received.append(item)
+                    if not item.filename.endswith('.docx'):
+                        logger.warning(f"File không hợp lệ: {item.filename}")
+                        results[item.index] = ({"index": item.index, "filename": item.filename, "status": "invalid",
+                                                "detail": f"File {item.filename} không phải .docx"}, None)
+                        continue
+                    logger.info(f"Đã nhận file {item.index + 1}: {item.filename} ({item.size} bytes), bắt đầu xử lý")
+                    tasks.append(asyncio.ensure_future(process_one(item)))
+
+                if not received:
+                    raise HTTPException(status_code=400, detail="Không có file nào được upload")
+
+                logger.info(f"Đã nhận đủ {len(received)} file(s), chờ các job còn lại")
+                watch_disconnect(request)
+                for future in asyncio.as_completed(tasks):
+                    result, output_path = await future
+                    results[result["index"]] = (result, output_path)
+            finally:
+                # Lỗi giữa chừng: huỷ các job chưa xong trước khi workspace bị xoá
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            ordered = [results[item.index] for item in received]
+            succeeded = [(result, path) for result, path in ordered if path is not None]
+            failed = [result for result, path in ordered if path is None]
+
+            if len(received) == 1:
+                result, _ = ordered[0]
+                if failed:
+                    raise HTTPException(status_code=FILE_ERROR_STATUS_CODES[result["status"]], detail=result["detail"])
+                logger.info(f"Xử lý thành công file: {result['filename']} -> {output_filename}")
+                return {
+                    "message": "Xử lý file thành công",
+                    "output_filename": output_filename,
+                    "processed_count": 1,
+                    "is_zip": False
+                }
+
+            if failed:
+                logger.warning(f"{len(failed)}/{len(received)} file lỗi: {', '.join(r['filename'] for r in failed)}")
+            if not succeeded:
+                codes = {FILE_ERROR_STATUS_CODES[r["status"]] for r in failed}
+                return JSONResponse(
+                    status_code=codes.pop() if len(codes) == 1 else 500,
+                    content={"detail": f"Không xử lý được file nào trong {len(received)} files",
+                             "failed_count": len(failed),
+                             "results": failed}
+                )
 
-            tasks = [process_file_async(inp, outp[0]) for inp, outp in zip(input_paths, output_paths)]
-            await asyncio.gather(*tasks)
+            logger.info(f"Tạo file zip: {zip_filename}")
+            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for result, output_path in succeeded:
+                    zipf.write(output_path, f"processed_{result['filename']}")
+            if os.path.exists(first_output_path):
+                os.remove(first_output_path)
 
-            for input_path in input_paths:
-                if os.path.exists(input_path):
-                    os.remove(input_path)
+        logger.info(f"Xử lý thành công {len(succeeded)}/{len(received)} files -> {zip_filename}")
 
-            zip_filename = f"processed_{timestamp}.zip"
-            zip_path = os.path.join(ZIP_DIR, zip_filename)
+        return {
+            "message": f"Xử lý thành công {len(succeeded)}/{len(received)} files",
+            "output_filename": zip_filename,
+            "processed_count": len(succeeded),
+            "failed_count": len(failed),
+            "is_zip": True,
+            "results": [result for result, _ in ordered]
+        }
 
-            logger.info(f"Tạo file zip: {zip_filename}")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for output_path, original_name in output_paths:
-                    if os.path.exists(output_path):
-                        arcname = f"processed_{original_name}"
-                        zipf.write(output_path, arcname)
-                        os.remove(output_path)
+    except HTTPException:
+        if os.path.exists(first_output_path):
+            os.remove(first_output_path)
+        raise
+    except UploadStreamError as e:
+        logger.warning(f"Upload không hợp lệ: {e}")
+        if os.path.exists(first_output_path):
+            os.remove(first_output_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý nhiều files: {str(e)}", exc_info=True)
+        for path in (first_output_path, zip_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý files: {str(e)}")
+
+# Content-Type được nhận ở /process-raw
+RAW_CONTENT_TYPES = {"application/octet-stream", DOCX_MEDIA_TYPE}
+
+@app.post("/process-raw")
+async def process_raw(request: Request):
+    """Xử lý file docx gửi thẳng trong body (không multipart), dành cho gọi giữa các service.
+    Body được ghi thẳng vào workspace theo từng đoạn (hỗ trợ Transfer-Encoding: chunked).
+    Header:
+    - Content-Type: application/octet-stream hoặc kiểu docx;
+    - X-Filename: tên file gốc (có thể percent-encode UTF-8), mặc định document.docx;
+    - X-Response-Mode: inline (mặc định, trả file kết quả dạng stream) hoặc stored
+      (lưu vào OUTPUT_DIR, trả JSON như /process để tải qua /download)."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in RAW_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Content-Type phải là application/octet-stream hoặc docx")
+
+    filename = unquote(request.headers.get("x-filename") or "document.docx")
+    if not filename.endswith('.docx'):
+        logger.warning(f"File không hợp lệ: {filename}")
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
 
-            logger.info(f"Xử lý thành công {len(files)} files -> {zip_filename}")
+    mode = (request.headers.get("x-response-mode") or "inline").strip().lower()
+    if mode not in ("inline", "stored"):
+        raise HTTPException(status_code=400, detail="X-Response-Mode phải là inline hoặc stored")
 
+    try:
+        expected_bytes = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        # Chunked: không biết trước kích thước, coi như file lớn (workspace trên đĩa)
+        expected_bytes = storage.ram_max_bytes + 1
+
+    ws = storage.workspace(expected_bytes)
+    streaming = False
+    output_path = None
+    try:
+        input_path = ws.path("input.docx")
+        size = await receive_body(request, input_path)
+        if not size:
+            raise HTTPException(status_code=400, detail="Body rỗng, không có file docx")
+        logger.info(f"Nhận file raw: {filename} ({size} bytes), chế độ {mode}")
+        watch_disconnect(request)
+
+        if mode == "stored":
+            output_filename = unique_name("processed", ".docx")
+            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            await process_docx_job(input_path, output_path, ws.root)
+            logger.info(f"Xử lý thành công file: {filename} -> {output_filename}")
             return {
-                "message": f"Xử lý thành công {len(files)} files",
-                "output_filename": zip_filename,
-                "processed_count": len(files),
-                "is_zip": True
+                "message": "Xử lý file thành công",
+                "output_filename": output_filename
             }
 
-        except Exception as e:
-            logger.error(f"Lỗi khi xử lý nhiều files: {str(e)}", exc_info=True)
+        result_path = ws.path("processed.docx")
+        await process_docx_job(input_path, result_path, ws.root)
+        result_size = os.path.getsize(result_path)
+        logger.info(f"Xử lý thành công file: {filename} -> trả trực tiếp {result_size} bytes")
+        response = StreamingResponse(
+            stream_file(result_path, ws.close),
+            media_type=DOCX_MEDIA_TYPE,
+            headers={**attachment_headers(f"processed_{filename}"), "Content-Length": str(result_size)}
+        )
+        streaming = True
+        return response
+
+    except HTTPException:
+        raise
+    except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+        logger.warning(f"Từ chối file {filename}: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except JobAborted as e:
+        logger.warning(f"Huỷ xử lý file {filename}: {e}")
+        if output_path is not None and os.path.exists(output_path):
+            os.remove(output_path)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý file {filename}: {str(e)}", exc_info=True)
+        if output_path is not None and os.path.exists(output_path):
+            os.remove(output_path)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý file: {str(e)}")
+    finally:
+        if not streaming:
+            ws.close()
+
+async def process_archive_member(archive, member, ws):
+    """Giải nén một member .docx của archive vào workspace rồi xử lý nó như một job, với hạn
+    JOB_DEADLINE_SECONDS riêng cho member, tính từ khi member đến lượt (gồm cả thời gian chờ slot
+    như một request /process).
+    Trả về (mục manifest, đường dẫn file kết quả hoặc None nếu lỗi)."""
+    entry = {"index": member.index, "name": member.name, "input_bytes": member.info.file_size}
+    input_path = ws.path(f"input_{member.index}.docx")
+    output_path = ws.path(f"processed_{member.index}.docx")
+    started = time.monotonic()
+    control = request_control_var.get()
+    try:
+        if control is not None:
+            # Request đã quá hạn / client đã ngắt kết nối: không giải nén member còn lại
+            control.check()
+        check_member(member.info, DOCX_LIMITS)
+        await asyncio.to_thread(extract_member, archive, member.info, input_path)
+        await asyncio.wait_for(process_docx_job(input_path, output_path, ws.root), JOB_DEADLINE_SECONDS or None)
+        entry.update(status="ok", output=member.output_name, output_bytes=os.path.getsize(output_path))
+        return entry, output_path
+    except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+        logger.warning(f"Từ chối member {member.name}: {e}")
+        entry.update(status="rejected", detail=str(e))
+    except JobAborted as e:
+        logger.warning(f"Huỷ xử lý member {member.name}: {e}")
+        entry.update(status="cancelled", detail=str(e))
+    except asyncio.TimeoutError:
+        detail = f"Quá thời hạn xử lý member ({JOB_DEADLINE_SECONDS:g} giây)"
+        logger.warning(f"Huỷ xử lý member {member.name}: {detail}")
+        entry.update(status="cancelled", detail=detail)
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý member {member.name}: {str(e)}", exc_info=True)
+        entry.update(status="error", detail=f"Lỗi khi xử lý file: {str(e)}")
+    finally:
+        entry["seconds"] = round(time.monotonic() - started, 3)
+        if os.path.exists(input_path):
+            os.remove(input_path)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return entry, None
+
+async def close_archive_after(tasks, archive, ws):
+    """Đóng archive và xoá workspace sau khi các job member đã bị huỷ dừng hẳn"""
+    await asyncio.gather(*tasks, return_exceptions=True)
+    archive.close()
+    ws.close()
+
+@app.post("/process-archive")
+async def process_archive(request: Request, file: UploadFile = File(...)):
+    """Nhận một file zip chứa nhiều file .docx, trả về (dạng stream) file zip kết quả cùng thứ
+    tự member, kèm manifest.json ghi trạng thái từng member. Member được giải nén khi đến lượt,
+    tối đa ARCHIVE_WINDOW member cùng lúc; member lỗi không làm hỏng cả archive. Archive có
+    quá ARCHIVE_MAX_MEMBERS member .docx bị từ chối (413).
+    Mỗi member có hạn JOB_DEADLINE_SECONDS; cả request có hạn ARCHIVE_DEADLINE_SECONDS tính tới
+    khi gửi xong archive: quá hạn thì member đó / các member còn lại được ghi "cancelled"
+    trong manifest."""
+    logger.info(f"Nhận archive: {file.filename}")
+    watch_disconnect(request)
+
+    if not file.filename.lower().endswith('.zip'):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .zip")
+
+    ws = storage.workspace(file.size or 0)
+    try:
+        # Form upload bị đóng khi endpoint return (trước khi stream), nên giữ một bản archive
+        # trong workspace; các member chỉ được giải nén lúc xử lý
+        archive_path = ws.path("archive.zip")
+        with open(archive_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile as e:
+        ws.close()
+        raise HTTPException(status_code=400, detail=f"File zip không hợp lệ: {str(e)}")
+    except BaseException:
+        ws.close()
+        raise
+
+    members = list_members(archive)
+    docx_members = [m for m in members if m.output_name is not None]
+    if not docx_members:
+        archive.close()
+        ws.close()
+        raise HTTPException(status_code=400, detail="Archive không chứa file .docx nào")
+    if len(docx_members) > ARCHIVE_MAX_MEMBERS:
+        archive.close()
+        ws.close()
+        logger.warning(f"Từ chối archive {file.filename}: {len(docx_members)} member .docx")
+        raise HTTPException(
+            status_code=413,
+            detail=f"Archive có {len(docx_members)} file .docx, vượt giới hạn {ARCHIVE_MAX_MEMBERS}"
+        )
+
+    logger.info(f"Archive {file.filename}: {len(docx_members)}/{len(members)} member .docx")
+    archive_name = file.filename
+
+    async def stream():
+        writer = ZipStreamWriter()
+        manifest = []
+        pending = []
+        remaining = iter(docx_members)
+
+        def start_next():
+            member = next(remaining, None)
+            if member is not None:
+                pending.append(asyncio.ensure_future(process_archive_member(archive, member, ws)))
 
-            for input_path in input_paths:
-                if os.path.exists(input_path):
-                    os.remove(input_path)
-            for output_path, _ in output_paths:
-                if os.path.exists(output_path):
+        try:
+            for _ in range(max(1, ARCHIVE_WINDOW)):
+                start_next()
+            # Gửi kết quả theo đúng thứ tự member; member xong trước thì chờ trong workspace
+            for member in members:
+                if member.output_name is None:
+                    manifest.append({"index": member.index, "name": member.name, "status": "skipped",
+                                     "detail": "Không phải file .docx"})
+                    continue
+                entry, output_path = await pending.pop(0)
+                start_next()
+                manifest.append(entry)
+                if output_path is not None:
+                    yield await asyncio.to_thread(writer.add_file, output_path, member.output_name)
                     os.remove(output_path)
 
-            raise HTTPException(status_code=500, detail=f"Lỗi khi xử lý files: {str(e)}")
+            counts = {status: sum(1 for e in manifest if e["status"] == status)
+                      for status in ("ok", "error", "rejected", "cancelled", "skipped")}
+            logger.info(f"Xử lý xong archive {archive_name}: {counts}")
+            yield writer.add_json("manifest.json", {"archive": archive_name, **counts, "members": manifest})
+            yield writer.close()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                # Client ngắt kết nối giữa chừng: job đang chạy chỉ dừng ở ranh giới bước kế
+                # tiếp, không chờ được trong generator đã bị huỷ nên dọn dẹp trong task riêng
+                asyncio.ensure_future(close_archive_after(pending, archive, ws))
+            else:
+                archive.close()
+                ws.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers=attachment_headers(f"processed_{archive_name}")
+    )
+
+@app.post("/analyze")
+async def analyze_file(file: UploadFile = File(...)):
+    """Thống kê tag (BLOCK/SECTION/ROW), tag không cân bằng và trang bìa 'thẻ 1' mà không sửa file.
+    Lượt parse cả document.xml chiếm một slot chạy job như các job xử lý."""
+    if not file.filename.endswith('.docx'):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
+
+    try:
+        async with admission.slot():
+            report = await asyncio.to_thread(docx_main_logic.analyze_docx, file.file, DOCX_LIMITS)
+    except DocumentLimitExceeded as e:
+        logger.warning(f"Từ chối file {file.filename}: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"File docx không hợp lệ: {str(e)}")
+    except Exception as e:
+        logger.error(f"Lỗi khi phân tích file {file.filename}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Lỗi khi phân tích file: {str(e)}")
+
+    logger.info(f"Phân tích {file.filename}: {report['tags']}")
+    return {"filename": file.filename, **report}
+
+# Định dạng kết quả của /admin/profile
+PROFILE_FORMATS = ("speedscope", "collapsed", "summary")
+
+async def profile_file(request: Request, file: UploadFile = File(...), format: str = "speedscope", top: int = 30):
+    """Xử lý một file docx dưới profiler để tìm lý do tài liệu chạy chậm (không lưu file kết quả).
+    format: speedscope (JSON mở bằng https://www.speedscope.app), collapsed (collapsed stacks
+    cho flamegraph.pl) hoặc summary (thời gian từng bước, các hàm chính của pipeline và top
+    stack theo self time). Job chạy tuần tự và chậm hơn bình thường vài lần do profiler.
+    Chỉ có khi ENABLE_ADMIN_PROFILE bật."""
+    watch_disconnect(request)
+    if format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format phải là một trong {', '.join(PROFILE_FORMATS)}")
+    if not file.filename.endswith('.docx'):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file .docx")
+
+    with storage.workspace(file.size or 0) as ws:
+        input_path = ws.path("input.docx")
+        try:
+            with open(input_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            job = run_job(profile_docx_file, input_path, ws.root, memory=estimate_job_memory(input_path))
+            control = request_control_var.get()
+            profiler, report = await (job if control is None else control.run(job))
+        except (MemoryBudgetExceeded, DocumentLimitExceeded) as e:
+            logger.warning(f"Từ chối file {file.filename}: {e}")
+            raise HTTPException(status_code=413, detail=str(e))
+        except JobAborted as e:
+            logger.warning(f"Huỷ profile file {file.filename}: {e}")
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except Exception as e:
+            logger.error(f"Lỗi khi profile file {file.filename}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Lỗi khi profile file: {str(e)}")
+
+    seconds = round(profiler.total_ns / 1e9, 3)
+    logger.info(f"Profile {file.filename}: {seconds}s, bước: {report.get('steps')}")
+    base = os.path.splitext(file.filename)[0]
+    if format == "collapsed":
+        return Response(content=to_collapsed(profiler), media_type="text/plain; charset=utf-8",
+                        headers=attachment_headers(f"{base}.folded"))
+    if format == "speedscope":
+        return JSONResponse(content=to_speedscope(profiler, file.filename),
+                            headers=attachment_headers(f"{base}.speedscope.json"))
+    stacks = [line.rsplit(" ", 1) for line in to_collapsed(profiler).splitlines()]
+    stacks.sort(key=lambda item: -int(item[1]))
+    return {
+        "filename": file.filename,
+        "profiled_seconds": seconds,
+        "steps": report.get("steps"),
+        "functions": function_totals(profiler, docx_main_logic.PROFILE_FUNCTIONS),
+        "top_stacks_us": [{"stack": stack, "self_us": int(us)} for stack, us in stacks[:max(1, top)]],
+    }
+
+if ENABLE_ADMIN_PROFILE:
+    app.post("/admin/profile")(profile_file)
 
 @app.get("/download/{filename}")
 async def download_file(filename: str, background_tasks: BackgroundTasks):
@@ -1043,7 +1023,7 @@ async def download_file(filename: str, background_tasks: BackgroundTasks):
     return FileResponse(
         path=file_path,
         filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        media_type=DOCX_MEDIA_TYPE
     )
 
 @app.get("/download-zip/{filename}")
@@ -1069,24 +1049,58 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    """Số liệu vận hành: hàng đợi, job đang chạy, số request bị từ chối, dung lượng lưu trữ,
+    ngân sách bộ nhớ, số job trùng nội dung được gộp và số request/job bị huỷ của worker này"""
+    return {"admission": admission.stats(), "storage": sweeper.stats(), "memory": memory_budget.stats(),
+            "single_flight": single_flight.stats(), "ledger": ledger.writer_stats(),
+            "cancellation": cancel_stats.stats()}
+
+@app.get("/stats")
+async def job_stats(hours: float = None):
+    """Thống kê job từ sổ ghi job (của mọi worker): số job, kết quả, phân vị thời gian xử lý
+    tổng và từng bước theo nhóm kích thước input; hours: chỉ tính các job trong N giờ gần nhất"""
+    since = time.time() - hours * 3600 if hours else None
+    try:
+        return await asyncio.to_thread(ledger.stats, since)
+    except Exception as e:
+        logger.error(f"Lỗi khi đọc sổ ghi job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Lỗi khi đọc sổ ghi job: {str(e)}")
+
 @app.get("/logs")
-async def get_logs():
-    """Endpoint để xem logs gần đây"""
+async def get_logs(lines: int = 50, level: str = None, request_id: str = None):
+    """Endpoint để xem logs gần đây (chỉ đọc phần cuối file, lọc theo level/request id)"""
     log_file = os.path.join(LOG_DIR, "app.log")
 
     if not os.path.exists(log_file):
         return {"logs": "Không có logs nào."}
 
     try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            recent_logs = ''.join(lines[-50:]) if len(lines) > 50 else ''.join(lines)
+        lines = max(1, min(lines, 5000))
+        recent = filtered_tail(log_file, lines, RecordFilter(level, request_id))
+        recent_logs = ''.join(line + '\n' for line in recent)
 
         return {"logs": recent_logs}
     except Exception as e:
         logger.error(f"Lỗi khi đọc logs: {str(e)}")
         return {"logs": f"Lỗi khi đọc logs: {str(e)}"}
 
+@app.get("/logs/stream")
+async def stream_logs(request: Request, level: str = None, request_id: str = None):
+    """Live tail logs dạng Server-Sent Events, theo dõi cả khi file log bị xoay"""
+    log_file = os.path.join(LOG_DIR, "app.log")
+
+    async def events():
+        async for line in follow(log_file, RecordFilter(level, request_id), is_disconnected=request.is_disconnected):
+            yield f"data: {line}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting server on http://0.0.0.0:8000")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Xử lý hàng loạt dạng archive vào / archive ra:
+- liệt kê member của file zip upload (không giải nén trước), đánh dấu member nào là .docx
+  cần xử lý, member nào bỏ qua (thư mục, file khác, rác __MACOSX/);
+- giải nén từng member khi đến lượt xử lý;
+- ghi zip kết quả dạng stream: zipfile ghi vào một bộ đệm không seek được (dùng data
+  descriptor), sau mỗi member lấy các bytes đã ghi ra để gửi ngay cho client.
+"""
+
+import json
+import shutil
+import zipfile
+import posixpath
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ArchiveMember:
+    """Một member của archive upload: vị trí, ZipInfo và tên file kết quả (None nếu bỏ qua)."""
+
+    __slots__ = ("index", "info", "output_name")
+
+    def __init__(self, index, info, output_name):
+        self.index = index
+        self.info = info
+        self.output_name = output_name
+
+    @property
+    def name(self):
+        return self.info.filename
+
+
+def output_name_for(member_name):
+    """'a/b.docx' -> 'a/processed_b.docx' (giữ cấu trúc thư mục trong archive)."""
+    directory, base = posixpath.split(member_name)
+    return posixpath.join(directory, f"processed_{base}")
+
+
+def list_members(archive):
+    """Các member (không gồm thư mục) theo thứ tự trong archive."""
+    members = []
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = info.filename
+        if name.lower().endswith(".docx") and not name.startswith("__MACOSX/"):
+            output_name = output_name_for(name)
+        else:
+            output_name = None
+        members.append(ArchiveMember(len(members), info, output_name))
+    return members
+
+
+def extract_member(archive, info, target_path):
+    """Giải nén một member ra target_path (đọc từng đoạn, không giữ cả file trong bộ nhớ)."""
+    with archive.open(info) as src, open(target_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+
+class _StreamSink:
+    """Đích ghi cho zipfile: không có seek() nên zipfile ghi theo kiểu stream."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """
+    Tạo file zip từng phần: mỗi lần thêm member trả về các bytes mới cần gửi đi.
+    File docx đã được nén sẵn nên lưu nguyên (ZIP_STORED), manifest thì nén.
+    """
+
+    def __init__(self):
+        self._sink = _StreamSink()
+        self._zip = zipfile.ZipFile(self._sink, "w")
+
+    def add_file(self, path, arcname):
+        self._zip.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+        return self._sink.drain()
+
+    def add_json(self, arcname, data):
+        self._zip.writestr(arcname, json.dumps(data, ensure_ascii=False, indent=2),
+                           compress_type=zipfile.ZIP_DEFLATED)
+        return self._sink.drain()
+
+    def close(self):
+        """Ghi central directory, trả về phần bytes cuối cùng của file zip."""
+        self._zip.close()
+        return self._sink.drain()
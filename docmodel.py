@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Mô hình tài liệu gọn cho pipeline xử lý document.xml, thay cho cây minidom đầy đủ.
+
+- Chỉ các element mà pipeline đọc/sửa (truyền vào qua keep_tags, vd w:p, w:tbl, w:t) và các
+  element chứa chúng được dựng thành node; node dùng __slots__, thuộc tính lưu dạng tuple
+  (tên, giá trị) thay vì dict + object Attr như minidom.
+- Mọi cây con còn lại (w:rPr, w:tblPr, hình vẽ không có chữ, ...) được gộp thành một node
+  RawXML giữ sẵn chuỗi XML đã chuẩn hoá, không tạo object cho từng element bên trong.
+  Các RawXML liền nhau được gộp làm một.
+- API là tập con của minidom mà main.py dùng (childNodes, firstChild, tagName, nodeValue,
+  getAttribute, getElementsByTagName, appendChild, removeChild, createTextNode, toxml);
+  toxml() cho kết quả giống hệt minidom (cùng thứ tự thuộc tính, cùng cách escape).
+- Tài liệu có DOCTYPE, comment, processing instruction hoặc CDATA: parse() ném Unsupported
+  để nơi gọi quay về minidom.
+"""
+
+from xml.parsers import expat
+
+from docxlimits import DocumentLimitExceeded
+
+RAW_NODE = 0
+
+
+class Unsupported(Exception):
+    """Tài liệu có cấu trúc mà mô hình gọn không biểu diễn được (dùng minidom thay thế)."""
+
+
+def _escape(data):
+    # Giống minidom._write_data
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class Node:
+    __slots__ = ('parentNode', 'previousSibling', 'nextSibling')
+
+    ELEMENT_NODE = 1
+    TEXT_NODE = 3
+    DOCUMENT_NODE = 9
+
+    childNodes = ()
+    firstChild = None
+    lastChild = None
+    nodeValue = None
+
+    def __init__(self):
+        self.parentNode = None
+        self.previousSibling = None
+        self.nextSibling = None
+
+    @property
+    def ownerDocument(self):
+        node = self
+        while node.parentNode is not None:
+            node = node.parentNode
+        return node if isinstance(node, Document) else None
+
+    def toxml(self):
+        out = []
+        self._write(out.append)
+        return ''.join(out)
+
+
+class Text(Node):
+    __slots__ = ('data',)
+
+    nodeType = Node.TEXT_NODE
+    nodeName = '#text'
+
+    def __init__(self, data):
+        Node.__init__(self)
+        self.data = data
+
+    @property
+    def nodeValue(self):
+        return self.data
+
+    @nodeValue.setter
+    def nodeValue(self, value):
+        self.data = value
+
+    def _write(self, write):
+        if self.data:
+            write(_escape(self.data))
+
+
+class RawXML(Node):
+    """Một hoặc nhiều cây con liền nhau mà pipeline không đọc tới, giữ dạng chuỗi XML."""
+
+    __slots__ = ('xml',)
+
+    nodeType = RAW_NODE
+    nodeName = '#raw'
+
+    def __init__(self, xml):
+        Node.__init__(self)
+        self.xml = xml
+
+    def _write(self, write):
+        write(self.xml)
+
+
+def _link_children(parent, children):
+    prev = None
+    for child in children:
+        child.parentNode = parent
+        child.previousSibling = prev
+        if prev is not None:
+            prev.nextSibling = child
+        prev = child
+    if prev is not None:
+        prev.nextSibling = None
+
+
+class _Container(Node):
+    __slots__ = ()
+
+    @property
+    def firstChild(self):
+        return self.childNodes[0] if self.childNodes else None
+
+    @property
+    def lastChild(self):
+        return self.childNodes[-1] if self.childNodes else None
+
+    def getElementsByTagName(self, name):
+        """Các element con cháu có tagName == name (hoặc '*'), theo thứ tự tài liệu."""
+        result = []
+        stack = [iter(self.childNodes)]
+        while stack:
+            for node in stack[-1]:
+                if node.nodeType == Node.ELEMENT_NODE:
+                    if name == '*' or node.tagName == name:
+                        result.append(node)
+                    if node.childNodes:
+                        stack.append(iter(node.childNodes))
+                        break
+            else:
+                stack.pop()
+        return result
+
+    def appendChild(self, node):
+        if node.parentNode is not None:
+            node.parentNode.removeChild(node)
+        last = self.childNodes[-1] if self.childNodes else None
+        self.childNodes.append(node)
+        node.parentNode = self
+        node.previousSibling = last
+        node.nextSibling = None
+        if last is not None:
+            last.nextSibling = node
+        return node
+
+    def removeChild(self, node):
+        self.childNodes.remove(node)
+        if node.previousSibling is not None:
+            node.previousSibling.nextSibling = node.nextSibling
+        if node.nextSibling is not None:
+            node.nextSibling.previousSibling = node.previousSibling
+        node.parentNode = node.previousSibling = node.nextSibling = None
+        return node
+
+
+class Element(_Container):
+    __slots__ = ('tagName', 'childNodes', '_attrs')
+
+    nodeType = Node.ELEMENT_NODE
+
+    def __init__(self, tagName, attrs=()):
+        Node.__init__(self)
+        self.tagName = tagName
+        self.childNodes = []
+        self._attrs = attrs
+
+    @property
+    def nodeName(self):
+        return self.tagName
+
+    def getAttribute(self, name):
+        for key, value in self._attrs:
+            if key == name:
+                return value
+        return ''
+
+    def hasAttribute(self, name):
+        return any(key == name for key, _ in self._attrs)
+
+    def _write(self, write):
+        write(_start_tag(self.tagName, self._attrs))
+        if self.childNodes:
+            write('>')
+            for child in self.childNodes:
+                child._write(write)
+            write(f'</{self.tagName}>')
+        else:
+            write('/>')
+
+
+class Document(_Container):
+    __slots__ = ('childNodes', '_id_cache', '_id_search_stack')
+
+    nodeType = Node.DOCUMENT_NODE
+    nodeName = '#document'
+
+    def __init__(self):
+        Node.__init__(self)
+        self.childNodes = []
+        # Giữ tương thích với remove_nodes (minidom có cache getElementById)
+        self._id_cache = {}
+        self._id_search_stack = None
+
+    @property
+    def ownerDocument(self):
+        return None
+
+    @property
+    def documentElement(self):
+        for node in self.childNodes:
+            if node.nodeType == Node.ELEMENT_NODE:
+                return node
+        return None
+
+    def createTextNode(self, data):
+        if not isinstance(data, str):
+            raise TypeError("node contents must be a string")
+        return Text(data)
+
+    def _write(self, write):
+        write('<?xml version="1.0" ?>')
+        for child in self.childNodes:
+            child._write(write)
+
+
+def _start_tag(tag, attrs):
+    if not attrs:
+        return '<' + tag
+    return '<' + tag + ''.join(f' {name}="{_escape(value)}"' for name, value in attrs)
+
+
+def parse(content, keep_tags, max_depth=None):
+    """
+    Dựng Document từ nội dung document.xml (str hoặc bytes), giống minidom.parseString
+    (xử lý namespace, gộp text liền nhau). Element có tagName thuộc keep_tags và tổ tiên
+    của chúng được giữ làm Element; các cây con khác thành RawXML.
+    max_depth: độ sâu lồng nhau tối đa, vượt quá thì dừng parse (DocumentLimitExceeded).
+    """
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.namespace_prefixes = True
+    parser.buffer_text = True
+    parser.ordered_attributes = True
+    parser.specified_attributes = True
+
+    qnames = {}
+    ns_decls = []
+    document = Document()
+    # Mỗi frame: [element, children, keep]; children gồm Element, Text hoặc list các chuỗi XML
+    # (một đoạn RawXML đang gom), keep=True khi element phải giữ làm node
+    stack = [[document, [], True]]
+
+    def qname(name):
+        # Như expatbuilder._parse_ns_name: "uri local prefix" -> "prefix:local", "uri local" -> "local"
+        q = qnames.get(name)
+        if q is None:
+            parts = name.split(' ')
+            if len(parts) == 3:
+                q = f'{parts[2]}:{parts[1]}'
+            elif len(parts) == 2:
+                q = parts[1]
+            elif len(parts) == 1:
+                q = name
+            else:
+                raise Unsupported(f"Khoảng trắng trong namespace URI: {name!r}")
+            qnames[name] = q
+        return q
+
+    def start_namespace(prefix, uri):
+        ns_decls.append((f'xmlns:{prefix}' if prefix else 'xmlns', uri))
+
+    def start_element(name, attributes):
+        attrs = ()
+        if ns_decls or attributes:
+            pairs = list(ns_decls)
+            ns_decls.clear()
+            for i in range(0, len(attributes), 2):
+                pairs.append((qname(attributes[i]), attributes[i + 1]))
+            attrs = tuple(pairs)
+        tag = qname(name)
+        if max_depth is not None and len(stack) > max_depth:
+            raise DocumentLimitExceeded(f"document.xml lồng nhau sâu hơn {max_depth} cấp")
+        stack.append([Element(tag, attrs), [], tag in keep_tags])
+
+    def end_element(name):
+        element, children, keep = stack.pop()
+        parent = stack[-1]
+        siblings = parent[1]
+        if keep:
+            nodes = []
+            for child in children:
+                if isinstance(child, list):
+                    nodes.append(RawXML(''.join(child)))
+                else:
+                    nodes.append(child)
+            element.childNodes = nodes
+            _link_children(element, nodes)
+            siblings.append(element)
+            parent[2] = True
+            return
+
+        pieces = [_start_tag(element.tagName, element._attrs)]
+        if children:
+            pieces.append('>')
+            for child in children:
+                if isinstance(child, list):
+                    pieces.extend(child)
+                elif child.data:
+                    pieces.append(_escape(child.data))
+            pieces.append(f'</{element.tagName}>')
+        else:
+            pieces.append('/>')
+        xml = ''.join(pieces)
+        if siblings and isinstance(siblings[-1], list):
+            siblings[-1].append(xml)
+        else:
+            siblings.append([xml])
+
+    def character_data(data):
+        siblings = stack[-1][1]
+        if siblings and isinstance(siblings[-1], Text):
+            siblings[-1].data += data
+        else:
+            siblings.append(Text(data))
+
+    def unsupported(*args):
+        raise Unsupported("DOCTYPE/comment/processing instruction/CDATA")
+
+    parser.StartNamespaceDeclHandler = start_namespace
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.StartDoctypeDeclHandler = unsupported
+    parser.CommentHandler = unsupported
+    parser.ProcessingInstructionHandler = unsupported
+    parser.StartCdataSectionHandler = unsupported
+    parser.Parse(content, True)
+
+    children = stack[0][1]
+    nodes = [RawXML(''.join(c)) if isinstance(c, list) else c for c in children]
+    document.childNodes = nodes
+    _link_children(document, nodes)
+    return document
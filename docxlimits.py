@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Giới hạn an toàn cho file docx upload (chống zip bomb, XML lồng quá sâu / quá nhiều node):
+- giải nén từng member theo kiểu stream thay cho extractall: kiểm tra trước trên central
+  directory (số member, tổng kích thước giải nén khai báo, tỉ lệ nén của từng member), rồi
+  đếm bytes thực ghi ra đĩa và dừng ngay khi vượt ngân sách;
+- đọc thẳng một member từ zip (open_member, cho /analyze): kiểm tra kích thước/tỉ lệ nén
+  khai báo trước, rồi đếm bytes thực đọc ra như khi giải nén;
+- document.xml: đếm số element ngay trên bytes (trước khi dựng DOM) và giới hạn độ sâu lồng
+  nhau trong lúc parse (docmodel) hoặc bằng một lượt expat trước khi dùng minidom.
+"""
+
+import os
+import zipfile
+from xml.parsers import expat
+
+MB = 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class DocumentLimitExceeded(Exception):
+    """File docx vượt giới hạn an toàn (kích thước giải nén, tỉ lệ nén, số member, XML)."""
+
+
+class DocxLimits:
+    """
+    max_unpacked_bytes: tổng bytes giải nén tối đa của một file docx;
+    max_members: số member tối đa trong file zip;
+    max_ratio: tỉ lệ giải nén/nén tối đa của một member, chỉ áp dụng cho member giải nén
+    lớn hơn ratio_min_bytes (file XML nhỏ có thể nén rất tốt);
+    max_xml_depth, max_xml_elements: độ sâu lồng nhau và số element tối đa của document.xml.
+    """
+
+    __slots__ = ("max_unpacked_bytes", "max_members", "max_ratio", "ratio_min_bytes",
+                 "max_xml_depth", "max_xml_elements")
+
+    def __init__(self, max_unpacked_bytes=512 * MB, max_members=2000, max_ratio=200, ratio_min_bytes=MB,
+                 max_xml_depth=256, max_xml_elements=2000000):
+        self.max_unpacked_bytes = max_unpacked_bytes
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.ratio_min_bytes = ratio_min_bytes
+        self.max_xml_depth = max_xml_depth
+        self.max_xml_elements = max_xml_elements
+
+
+DEFAULT_LIMITS = DocxLimits()
+
+
+def _check_ratio(name, unpacked, compressed, limits):
+    if unpacked > limits.ratio_min_bytes and unpacked > limits.max_ratio * max(1, compressed):
+        raise DocumentLimitExceeded(
+            f"Member {name} có tỉ lệ nén vượt {limits.max_ratio:g}:1 (nghi zip bomb)"
+        )
+
+
+def check_member(info, limits=DEFAULT_LIMITS):
+    """Kiểm tra một member (ZipInfo) theo kích thước/tỉ lệ nén khai báo trong central directory."""
+    if info.file_size > limits.max_unpacked_bytes:
+        raise DocumentLimitExceeded(
+            f"Member {info.filename} giải nén ra {info.file_size // MB} MB, "
+            f"vượt giới hạn {limits.max_unpacked_bytes // MB} MB"
+        )
+    _check_ratio(info.filename, info.file_size, info.compress_size, limits)
+
+
+def check_archive(infos, limits=DEFAULT_LIMITS):
+    """Kiểm tra danh sách member trước khi giải nén: số member, tổng kích thước, tỉ lệ nén."""
+    if len(infos) > limits.max_members:
+        raise DocumentLimitExceeded(f"File có {len(infos)} member, vượt giới hạn {limits.max_members}")
+    total = sum(info.file_size for info in infos)
+    if total > limits.max_unpacked_bytes:
+        raise DocumentLimitExceeded(
+            f"File giải nén ra {total // MB} MB, vượt giới hạn {limits.max_unpacked_bytes // MB} MB"
+        )
+    for info in infos:
+        _check_ratio(info.filename, info.file_size, info.compress_size, limits)
+
+
+def _member_path(target_dir, name):
+    # Như ZipFile._extract_member: bỏ ổ đĩa, '/' đầu, '.' và '..' để không ghi ra ngoài target_dir
+    parts = [p for p in os.path.splitdrive(name)[1].split('/') if p not in ('', '.', '..')]
+    if not parts:
+        return None
+    return os.path.join(target_dir, *parts)
+
+
+def extract_docx(docx_path, target_dir, limits=DEFAULT_LIMITS):
+    """Giải nén docx vào target_dir theo từng đoạn, dừng (DocumentLimitExceeded) khi vượt giới hạn."""
+    with zipfile.ZipFile(docx_path) as archive:
+        infos = archive.infolist()
+        check_archive(infos, limits)
+        total = 0
+        for info in infos:
+            path = _member_path(target_dir, info.filename)
+            if path is None:
+                continue
+            if info.is_dir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            written = 0
+            with archive.open(info) as src, open(path, "wb") as dst:
+                for chunk in iter(lambda: src.read(COPY_BUFFER_SIZE), b""):
+                    written += len(chunk)
+                    total += len(chunk)
+                    # Kích thước khai báo có thể sai: đếm lại trên bytes thực tế
+                    if total > limits.max_unpacked_bytes:
+                        raise DocumentLimitExceeded(
+                            f"File giải nén vượt giới hạn {limits.max_unpacked_bytes // MB} MB"
+                        )
+                    _check_ratio(info.filename, written, info.compress_size, limits)
+                    dst.write(chunk)
+
+
+class _LimitedReader:
+    """File-like đọc một member zip; dừng (DocumentLimitExceeded) khi bytes giải nén thực tế
+    vượt max_unpacked_bytes hoặc tỉ lệ nén vượt max_ratio."""
+
+    def __init__(self, src, info, limits):
+        self._src = src
+        self._info = info
+        self._limits = limits
+        self._read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = COPY_BUFFER_SIZE
+        chunk = self._src.read(size)
+        self._read += len(chunk)
+        if self._read > self._limits.max_unpacked_bytes:
+            raise DocumentLimitExceeded(
+                f"Member {self._info.filename} giải nén vượt giới hạn {self._limits.max_unpacked_bytes // MB} MB"
+            )
+        _check_ratio(self._info.filename, self._read, self._info.compress_size, self._limits)
+        return chunk
+
+    def close(self):
+        self._src.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_member(archive, name, limits=DEFAULT_LIMITS):
+    """Mở member name của archive (zipfile.ZipFile) để đọc theo kiểu stream, có giới hạn."""
+    info = archive.getinfo(name)
+    check_member(info, limits)
+    return _LimitedReader(archive.open(info), info, limits)
+
+
+def check_xml_elements(raw, limits=DEFAULT_LIMITS):
+    """Số element của XML (str hoặc bytes), đếm theo thẻ mở mà không parse; raise nếu vượt giới hạn."""
+    marks = ("<", "</", "<?", "<!") if isinstance(raw, str) else (b"<", b"</", b"<?", b"<!")
+    count = raw.count(marks[0]) - sum(raw.count(mark) for mark in marks[1:])
+    if count > limits.max_xml_elements:
+        raise DocumentLimitExceeded(
+            f"document.xml có khoảng {count} element, vượt giới hạn {limits.max_xml_elements}"
+        )
+    return count
+
+
+def check_xml_depth(content, limits=DEFAULT_LIMITS):
+    """Một lượt expat chỉ đo độ sâu lồng nhau (dùng trước khi dựng DOM bằng minidom)."""
+    depth = 0
+
+    def start(name, attributes):
+        nonlocal depth
+        depth += 1
+        if depth > limits.max_xml_depth:
+            raise DocumentLimitExceeded(f"document.xml lồng nhau sâu hơn {limits.max_xml_depth} cấp")
+
+    def end(name):
+        nonlocal depth
+        depth -= 1
+
+    def entity_declared(*args):
+        # Không để expat tự mở rộng entity (billion laughs) trong lượt kiểm tra này
+        raise DocumentLimitExceeded("document.xml khai báo entity trong DTD")
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.EntityDeclHandler = entity_declared
+    parser.Parse(content, True)
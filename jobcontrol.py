@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Hạn xử lý (deadline) và phát hiện client ngắt kết nối cho từng request:
+- mỗi request xử lý file có một RequestControl (đặt vào contextvar), hết hạn sau N giây;
+- sau khi endpoint đã đọc xong body, control chờ message tiếp theo của request: khi đó chỉ
+  còn http.disconnect (không theo dõi trong lúc đang upload vì sẽ lấy mất các đoạn body);
+- khi quá hạn hoặc client đã ngắt kết nối, các job đang chờ qua control.run() bị huỷ:
+  job còn trong hàng đợi được bỏ luôn, job đang chạy được báo dừng ở ranh giới bước kế tiếp
+  (xem run_job trong app.py) và nơi gọi nhận JobAborted.
+"""
+
+import asyncio
+import contextvars
+
+DEADLINE = "deadline"
+DISCONNECTED = "disconnected"
+
+
+class JobAborted(Exception):
+    """Request bị huỷ trước khi job xử lý xong: quá hạn (504) hoặc client đã ngắt kết nối (499)."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = 504 if reason == DEADLINE else 499
+
+
+class CancelStats:
+    """Bộ đếm request/job bị huỷ và thời gian xử lý bị bỏ phí của worker này."""
+
+    def __init__(self):
+        self.requests_aborted = {DEADLINE: 0, DISCONNECTED: 0}
+        self.jobs_cancelled_queued = 0
+        self.jobs_aborted_running = 0
+        self.results_discarded = 0
+        self.wasted_seconds = 0.0
+
+    def stats(self):
+        return {
+            "deadline_total": self.requests_aborted[DEADLINE],
+            "disconnected_total": self.requests_aborted[DISCONNECTED],
+            "jobs_cancelled_queued_total": self.jobs_cancelled_queued,
+            "jobs_aborted_running_total": self.jobs_aborted_running,
+            "results_discarded_total": self.results_discarded,
+            "wasted_job_seconds_total": round(self.wasted_seconds, 3),
+        }
+
+
+cancel_stats = CancelStats()
+
+request_control_var = contextvars.ContextVar("request_control", default=None)
+
+
+class RequestControl:
+    """Deadline và trạng thái kết nối của một request; huỷ các job đang chờ khi request bị huỷ."""
+
+    def __init__(self, deadline_seconds=None):
+        self.deadline_seconds = deadline_seconds
+        self.reason = None
+        self._tasks = set()
+        self._watchers = []
+        if deadline_seconds:
+            self._watchers.append(asyncio.get_running_loop().call_later(deadline_seconds, self.abort, DEADLINE))
+
+    def close(self):
+        """Ngừng theo dõi (khi response sắp gửi xong hoặc endpoint đã kết thúc)."""
+        for watcher in self._watchers:
+            watcher.cancel()
+        self._watchers.clear()
+
+    def watch_disconnect(self, request):
+        """Bắt đầu theo dõi client ngắt kết nối; chỉ gọi sau khi đã đọc hết body của request."""
+        self._watchers.append(asyncio.ensure_future(self._wait_disconnect(request.receive)))
+
+    async def _wait_disconnect(self, receive):
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            self.abort(DISCONNECTED)
+
+    def abort(self, reason):
+        if self.reason is not None:
+            return
+        self.reason = reason
+        cancel_stats.requests_aborted[reason] += 1
+        for task in list(self._tasks):
+            task.cancel()
+
+    def check(self):
+        """Raise JobAborted nếu request đã bị huỷ."""
+        if self.reason == DEADLINE:
+            raise JobAborted(DEADLINE, f"Quá thời hạn xử lý ({self.deadline_seconds:g} giây)")
+        if self.reason == DISCONNECTED:
+            raise JobAborted(DISCONNECTED, "Client đã ngắt kết nối")
+
+    async def run(self, awaitable):
+        """Chờ awaitable trong một task riêng; task bị huỷ khi request bị huỷ và khi đó
+        raise JobAborted thay cho CancelledError."""
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        self._tasks.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            # Chỉ đổi thành JobAborted khi chính control huỷ task (không phải nơi gọi bị huỷ)
+            if self.reason is not None and not asyncio.current_task().cancelling():
+                self.check()
+            raise
+        finally:
+            self._tasks.discard(task)
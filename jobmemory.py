@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Ngân sách bộ nhớ cho các job xử lý docx trong một worker (process).
+
+- Ước tính trước bộ nhớ đỉnh của job từ kích thước giải nén của word/document.xml
+  (đọc từ central directory của file zip, không cần giải nén).
+- Job chỉ được chạy khi tổng ước tính của các job đang chạy trong worker cộng với job mới
+  không vượt ngân sách; nếu vượt thì chờ, còn job tự nó đã lớn hơn cả ngân sách thì bị
+  từ chối (MemoryBudgetExceeded).
+- Đo bộ nhớ thực tế bằng cách lấy mẫu RSS của process trong lúc job chạy; mức tăng RSS
+  đỉnh so với lúc bắt đầu được ghi lại cạnh ước tính để hiệu chỉnh hệ số. Khi nhiều job
+  chạy chồng nhau trong cùng worker, số đo của mỗi job là cận trên (gồm cả job khác).
+"""
+
+import os
+import time
+import asyncio
+import logging
+import zipfile
+import threading
+import contextlib
+from collections import deque
+
+logger = logging.getLogger("docx_processor")
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Bộ nhớ ước tính của job lớn hơn toàn bộ ngân sách của worker."""
+
+    def __init__(self, estimate, budget):
+        super().__init__(
+            f"Job cần khoảng {estimate // MB} MB bộ nhớ, vượt ngân sách {budget // MB} MB của worker"
+        )
+        self.estimate = estimate
+        self.budget = budget
+
+
+def current_rss():
+    """RSS hiện tại của process (bytes), None nếu không đọc được (không có /proc)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def estimate_docx_memory(docx_path, factor, overhead):
+    """Bộ nhớ đỉnh ước tính (bytes): overhead + factor * kích thước giải nén của word/document.xml."""
+    try:
+        with zipfile.ZipFile(docx_path) as zf:
+            size = zf.getinfo("word/document.xml").file_size
+    except (OSError, KeyError, zipfile.BadZipFile):
+        # File hỏng sẽ lỗi ngay khi xử lý, không cần giữ chỗ
+        size = 0
+    return overhead + factor * size
+
+
+class MemoryBudget:
+    """Giữ chỗ bộ nhớ ước tính cho job (trên event loop) và đo RSS thực tế (trong thread job)."""
+
+    def __init__(self, budget_bytes, poll_interval=0.05, sample_interval=0.05, history=20):
+        self.budget = max(0, int(budget_bytes))  # 0: không giới hạn
+        self.poll_interval = poll_interval
+        self.sample_interval = sample_interval
+        self.reserved = 0
+        self.waiting = 0
+        self.refused_total = 0
+        self.delayed_total = 0
+        self.wait_ms_total = 0
+        self.measured_total = 0
+        self.max_ratio = None
+        self.recent = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._tracked = {}  # id job -> [rss lúc bắt đầu, rss đỉnh]
+        self._wake = threading.Event()
+        self._sampler = None
+
+    def check(self, estimate):
+        """Ném MemoryBudgetExceeded nếu job không bao giờ chạy được trong ngân sách."""
+        if self.budget and estimate > self.budget:
+            self.refused_total += 1
+            raise MemoryBudgetExceeded(estimate, self.budget)
+
+    def _fits(self, estimate):
+        return not self.budget or self.reserved + estimate <= self.budget
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, estimate):
+        """Chờ (không chặn event loop) đến khi đủ ngân sách cho estimate bytes, giữ chỗ trong khối with."""
+        self.check(estimate)
+        if not self._fits(estimate):
+            self.delayed_total += 1
+            self.waiting += 1
+            started = time.monotonic()
+            try:
+                while not self._fits(estimate):
+                    await asyncio.sleep(self.poll_interval)
+            finally:
+                self.waiting -= 1
+            self.wait_ms_total += int((time.monotonic() - started) * 1000)
+        self.reserved += estimate
+        try:
+            yield
+        finally:
+            self.reserved -= estimate
+
+    def _sample(self):
+        while True:
+            self._wake.wait()
+            rss = current_rss()
+            with self._lock:
+                if not self._tracked:
+                    self._wake.clear()
+                    continue
+                if rss is not None:
+                    for entry in self._tracked.values():
+                        if rss > entry[1]:
+                            entry[1] = rss
+            time.sleep(self.sample_interval)
+
+    def run_measured(self, estimate, func, *args):
+        """Chạy func(*args) (trong thread của executor) và ghi lại mức tăng RSS đỉnh."""
+        start = current_rss()
+        if start is None:
+            return func(*args)
+        key = object()
+        with self._lock:
+            self._tracked[key] = [start, start]
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+                self._sampler.start()
+            self._wake.set()
+        try:
+            return func(*args)
+        finally:
+            end = current_rss() or start
+            with self._lock:
+                _, peak = self._tracked.pop(key)
+            self._record(estimate, start, max(peak, end))
+
+    def _record(self, estimate, start, peak):
+        growth = max(0, peak - start)
+        ratio = round(growth / estimate, 3) if estimate else None
+        self.measured_total += 1
+        if ratio is not None and (self.max_ratio is None or ratio > self.max_ratio):
+            self.max_ratio = ratio
+        self.recent.append({
+            "estimate_bytes": estimate,
+            "rss_growth_bytes": growth,
+            "rss_peak_bytes": peak,
+            "ratio": ratio,
+        })
+        logger.info(f"Bộ nhớ job: ước tính {estimate // MB} MB, RSS tăng tối đa {growth // MB} MB")
+        if estimate and growth > estimate:
+            logger.warning("Bộ nhớ thực tế vượt ước tính, nên tăng JOB_MEMORY_FACTOR")
+
+    def stats(self):
+        return {
+            "budget_bytes": self.budget,
+            "reserved_bytes": self.reserved,
+            "jobs_waiting": self.waiting,
+            "rss_bytes": current_rss(),
+            "refused_total": self.refused_total,
+            "delayed_total": self.delayed_total,
+            "wait_ms_total": self.wait_ms_total,
+            "measured_total": self.measured_total,
+            "max_ratio": self.max_ratio,
+            "recent_jobs": list(self.recent),
+        }
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Sổ ghi job (job ledger) trong SQLite cục bộ, phục vụ lập kế hoạch năng lực:
+- mỗi job xử lý docx được ghi một dòng: bytes vào/ra, số đoạn/bảng/hàng, số tag, thời gian
+  từng bước, pid worker, kết quả (ok / error / rejected / shared / cancelled ...);
+- record() chỉ đưa bản ghi vào hàng đợi trong bộ nhớ; một thread nền ghi theo lô
+  (mỗi flush_interval giây hoặc đủ batch_size dòng), không chặn request;
+- giới hạn kích thước: chỉ giữ max_rows dòng mới nhất;
+- nhiều uvicorn worker ghi chung một file (WAL + busy timeout);
+- stats(): phân vị thời gian xử lý theo nhóm kích thước input.
+"""
+
+import os
+import json
+import math
+import time
+import queue
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger("docx_processor")
+
+KB = 1024
+MB = 1024 * 1024
+
+# Nhóm kích thước input: (tên, từ bytes, đến bytes - không gồm)
+SIZE_BUCKETS = [
+    ("<100KB", 0, 100 * KB),
+    ("100KB-1MB", 100 * KB, MB),
+    ("1-10MB", MB, 10 * MB),
+    ("10-50MB", 10 * MB, 50 * MB),
+    (">=50MB", 50 * MB, None),
+]
+
+PERCENTILES = (50, 90, 95, 99)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished_at REAL NOT NULL,
+    pid INTEGER,
+    request_id TEXT,
+    outcome TEXT NOT NULL,
+    input_bytes INTEGER,
+    output_bytes INTEGER,
+    duration_ms REAL,
+    paragraphs INTEGER,
+    tables INTEGER,
+    table_rows INTEGER,
+    tags TEXT,
+    removed TEXT,
+    steps TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+COLUMNS = ("finished_at", "pid", "request_id", "outcome", "input_bytes", "output_bytes",
+           "duration_ms", "paragraphs", "tables", "table_rows", "tags", "removed", "steps")
+
+
+def percentile(sorted_values, p):
+    """Phân vị p (0-100) theo nearest-rank trên danh sách đã sắp xếp."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _bucket_of(size):
+    for name, lo, hi in SIZE_BUCKETS:
+        if size >= lo and (hi is None or size < hi):
+            return name
+    return SIZE_BUCKETS[0][0]
+
+
+class JobLedger:
+    """Ghi bản ghi job vào SQLite bằng thread nền, theo lô; đọc thống kê theo nhóm kích thước."""
+
+    def __init__(self, path, max_rows=100000, flush_interval=1.0, batch_size=500, max_pending=10000):
+        self.path = path
+        self.max_rows = max(1, int(max_rows))
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._thread = None
+        self.recorded_total = 0
+        self.written_total = 0
+        self.dropped_total = 0
+        self.failed_batches = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(self, entry):
+        """Đưa một bản ghi (dict theo COLUMNS, tags/removed/steps là dict) vào hàng đợi ghi."""
+        entry.setdefault("finished_at", time.time())
+        entry.setdefault("pid", os.getpid())
+        self.recorded_total += 1
+        try:
+            self._pending.put_nowait(entry)
+        except queue.Full:
+            # Ghi sổ không được làm chậm request: đĩa chậm thì bỏ bớt bản ghi
+            self.dropped_total += 1
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="job-ledger", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Dừng thread nền sau khi ghi nốt các bản ghi còn trong hàng đợi."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _take_batch(self):
+        batch = []
+        try:
+            batch.append(self._pending.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._pending.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not (self._stop.is_set() and self._pending.empty()):
+                batch = self._take_batch()
+                if batch:
+                    self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def _write(self, conn, batch):
+        rows = []
+        for entry in batch:
+            row = []
+            for column in COLUMNS:
+                value = entry.get(column)
+                if column in ("tags", "removed", "steps") and value is not None:
+                    value = json.dumps(value, separators=(",", ":"))
+                row.append(value)
+            rows.append(row)
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows
+                )
+                conn.execute("DELETE FROM jobs WHERE id <= (SELECT MAX(id) FROM jobs) - ?", (self.max_rows,))
+            self.written_total += len(rows)
+        except sqlite3.Error as e:
+            self.failed_batches += 1
+            logger.warning(f"Không ghi được {len(rows)} bản ghi vào sổ job: {e}")
+
+    def stats(self, since=None):
+        """Phân vị thời gian xử lý (ms) tổng và từng bước theo nhóm kích thước input, cho các job
+        kết thúc sau thời điểm since (unix time, None: toàn bộ sổ)."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT outcome, input_bytes, output_bytes, duration_ms, steps FROM jobs WHERE finished_at >= ?",
+                (since or 0,)
+            )
+            rows = cursor.fetchall()
+
+        buckets = {}
+        for outcome, input_bytes, output_bytes, duration_ms, steps in rows:
+            bucket = buckets.setdefault(_bucket_of(input_bytes or 0), {
+                "jobs": 0, "outcomes": {}, "input_bytes": [], "output_bytes": [], "duration_ms": [], "steps": {},
+            })
+            bucket["jobs"] += 1
+            bucket["outcomes"][outcome] = bucket["outcomes"].get(outcome, 0) + 1
+            # Thời gian chỉ tính job thực sự chạy pipeline thành công
+            if outcome != "ok":
+                continue
+            bucket["input_bytes"].append(input_bytes or 0)
+            bucket["output_bytes"].append(output_bytes or 0)
+            bucket["duration_ms"].append(duration_ms or 0)
+            for name, seconds in json.loads(steps or "{}").items():
+                bucket["steps"].setdefault(name, []).append(seconds * 1000)
+
+        result = []
+        for name, _, _ in SIZE_BUCKETS:
+            bucket = buckets.get(name)
+            if bucket is None:
+                continue
+            durations = sorted(bucket["duration_ms"])
+            result.append({
+                "bucket": name,
+                "jobs": bucket["jobs"],
+                "outcomes": bucket["outcomes"],
+                "mean_input_bytes": int(sum(bucket["input_bytes"]) / len(durations)) if durations else None,
+                "mean_output_bytes": int(sum(bucket["output_bytes"]) / len(durations)) if durations else None,
+                "duration_ms": {f"p{p}": percentile(durations, p) for p in PERCENTILES},
+                "steps_ms": {
+                    step: {f"p{p}": round(percentile(values, p), 1) for p in (50, 95)}
+                    for step, values in ((step, sorted(v)) for step, v in bucket["steps"].items())
+                },
+            })
+        return {"jobs": len(rows), "buckets": result}
+
+    def writer_stats(self):
+        return {
+            "recorded_total": self.recorded_total,
+            "written_total": self.written_total,
+            "dropped_total": self.dropped_total,
+            "failed_batches": self.failed_batches,
+            "pending": self._pending.qsize(),
+        }
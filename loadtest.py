@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Công cụ tạo tải cho API (chạy với một instance đang chạy, vd ./start.sh).
+
+- Gọi /process (+ /download), /process?download=true, /process-multiple (+ /download-zip),
+  /process-raw theo tỉ lệ cấu hình, với số client đồng thời, kích thước batch và bộ file tuỳ chọn.
+- File đầu vào: thư mục docx thật (--files) hoặc docx tổng hợp sinh sẵn (mặc định),
+  có đủ các tag [[BLOCK_START0]], [[SECTION_START0]], [[ROW0]], [[ROW1]], ngắt trang, bảng.
+- Báo cáo: throughput, độ trễ p50/p95/p99 theo loại request, tỉ lệ lỗi theo status,
+  RSS của server theo thời gian (từ /metrics, và từ /proc nếu có --pid).
+
+Cách dùng:
+    python loadtest.py --url http://localhost:8000 --concurrency 8 --duration 60
+    python loadtest.py --files ./samples --mix process=1,multiple=1 --batch-size 2-10
+    python loadtest.py --generate ./synthetic --count 20 --pages 5-200   (chỉ sinh file)
+"""
+
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import zipfile
+import argparse
+import threading
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+import requests
+
+# ------------------------------
+# Synthetic documents
+# ------------------------------
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+WORDS = ("khách hàng", "hợp đồng", "tín dụng", "tài sản", "bảo đảm", "số tiền", "thời hạn",
+         "lãi suất", "chi nhánh", "ngân hàng", "đề xuất", "phê duyệt", "hồ sơ", "thẩm định")
+
+
+def _run(text, bold=False):
+    rpr = '<w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman"/>'
+    rpr += '<w:b/>' if bold else ''
+    rpr += '<w:sz w:val="26"/></w:rPr>'
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+
+def _paragraph(rnd, text=None, page_break=False):
+    if text is None:
+        text = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 16))) + '.'
+    # Cắt text thành nhiều run như Word thường làm (tag có thể bị tách giữa các run)
+    runs = []
+    pos = 0
+    while pos < len(text):
+        step = rnd.randint(5, 40)
+        runs.append(_run(text[pos:pos + step], bold=rnd.random() < 0.1))
+        pos += step
+    if page_break:
+        runs.append('<w:r><w:br w:type="page"/></w:r>')
+    ppr = '<w:pPr><w:spacing w:after="120"/><w:jc w:val="both"/></w:pPr>'
+    return f'<w:p>{ppr}{"".join(runs)}</w:p>'
+
+
+def _table(rnd):
+    rows = []
+    for _ in range(rnd.randint(2, 8)):
+        tag = rnd.choice(('', '', '[[ROW0]]', '[[ROW1]]'))
+        cells = []
+        for c in range(3):
+            text = (tag if c == 0 else '') + ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4)))
+            cells.append(f'<w:tc><w:tcPr><w:tcW w:w="3000" w:type="dxa"/></w:tcPr>{_paragraph(rnd, text)}</w:tc>')
+        rows.append(f'<w:tr>{"".join(cells)}</w:tr>')
+    grid = '<w:tblGrid>' + '<w:gridCol w:w="3000"/>' * 3 + '</w:tblGrid>'
+    return f'<w:tbl><w:tblPr><w:tblW w:w="9000" w:type="dxa"/></w:tblPr>{grid}{"".join(rows)}</w:tbl>'
+
+
+def synthetic_document_xml(pages, seed=0, paragraphs_per_page=12):
+    """document.xml tổng hợp khoảng `pages` trang, xác định theo seed."""
+    rnd = random.Random(seed)
+    body = []
+    if rnd.random() < 0.3:
+        body.append(_paragraph(rnd, 'Thẻ 1', page_break=True))
+    for page in range(pages):
+        for i in range(paragraphs_per_page):
+            roll = rnd.random()
+            if roll < 0.05:
+                body.append(_paragraph(rnd, '[[BLOCK_START0]]'))
+                body.extend(_paragraph(rnd) for _ in range(rnd.randint(1, 4)))
+                body.append(_paragraph(rnd, '[[BLOCK_END]]'))
+            elif roll < 0.08:
+                body.append(_paragraph(rnd, 'Mục [[SECTION_START0]]bị xoá[[SECTION_END]] giữ lại'))
+            elif roll < 0.15:
+                body.append(_table(rnd))
+            elif roll < 0.20:
+                body.append('<w:p/>')
+            else:
+                body.append(_paragraph(rnd))
+        if page < pages - 1:
+            body.append(_paragraph(rnd, '', page_break=True))
+    body.append('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+                '<w:pgMar w:top="1134" w:right="1134" w:bottom="1134" w:left="1701"/></w:sectPr>')
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:document xmlns:w="{W_NS}"><w:body>{"".join(body)}</w:body></w:document>')
+
+
+def synthetic_docx(pages, seed=0):
+    """Bytes của một file docx tổng hợp hợp lệ (mở được bằng Word)."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', CONTENT_TYPES)
+        zf.writestr('_rels/.rels', ROOT_RELS)
+        zf.writestr('word/document.xml', synthetic_document_xml(pages, seed))
+    return buf.getvalue()
+
+
+def _parse_range(text):
+    lo, _, hi = text.partition('-')
+    lo = int(lo)
+    return lo, int(hi) if hi else lo
+
+
+def load_corpus(args):
+    """Danh sách (tên, bytes) dùng làm đầu vào."""
+    if args.files:
+        corpus = []
+        for name in sorted(os.listdir(args.files)):
+            if name.endswith('.docx'):
+                with open(os.path.join(args.files, name), 'rb') as f:
+                    corpus.append((name, f.read()))
+        if not corpus:
+            sys.exit(f"Không có file .docx nào trong {args.files}")
+        return corpus
+    lo, hi = _parse_range(args.pages)
+    rnd = random.Random(args.seed)
+    return [(f"synthetic_{i}.docx", synthetic_docx(rnd.randint(lo, hi), seed=args.seed + i))
+            for i in range(args.count)]
+
+
+# ------------------------------
+# Load generator
+# ------------------------------
+
+def percentile(sorted_values, p):
+    """Percentile theo nearest-rank trên list đã sắp xếp."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class Recorder:
+    """Gom kết quả từ các thread client."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}  # tên request -> list (giây, status)
+        self.documents = 0
+
+    def add(self, name, seconds, status):
+        with self.lock:
+            self.results.setdefault(name, []).append((seconds, status))
+
+    def add_documents(self, count):
+        with self.lock:
+            self.documents += count
+
+
+def _timed(recorder, name, func):
+    start = time.perf_counter()
+    try:
+        response = func()
+        status = response.status_code
+    except requests.RequestException as e:
+        response = None
+        status = type(e).__name__
+    recorder.add(name, time.perf_counter() - start, status)
+    return response if status == 200 else None
+
+
+def scenario_process(session, args, corpus, rnd, recorder):
+    name, data = rnd.choice(corpus)
+    resp = _timed(recorder, "POST /process", lambda: session.post(
+        f"{args.url}/process", files={"file": (name, data)}, timeout=args.timeout))
+    if resp is None:
+        return
+    recorder.add_documents(1)
+    if args.download:
+        filename = resp.json()["output_filename"]
+        _timed(recorder, "GET /download", lambda: session.get(
+            f"{args.url}/download/{filename}", timeout=args.timeout))
+
+
+def scenario_inline(session, args, corpus, rnd, recorder):
+    name, data = rnd.choice(corpus)
+    resp = _timed(recorder, "POST /process?download=true", lambda: session.post(
+        f"{args.url}/process", params={"download": "true"}, files={"file": (name, data)},
+        timeout=args.timeout))
+    if resp is not None:
+        recorder.add_documents(1)
+
+
+def scenario_multiple(session, args, corpus, rnd, recorder):
+    lo, hi = _parse_range(args.batch_size)
+    batch = [rnd.choice(corpus) for _ in range(rnd.randint(lo, hi))]
+    resp = _timed(recorder, "POST /process-multiple", lambda: session.post(
+        f"{args.url}/process-multiple", files=[("files", item) for item in batch],
+        timeout=args.timeout))
+    if resp is None:
+        return
+    recorder.add_documents(len(batch))
+    if args.download:
+        body = resp.json()
+        path = "download-zip" if body.get("is_zip") else "download"
+        _timed(recorder, f"GET /{path}", lambda: session.get(
+            f"{args.url}/{path}/{body['output_filename']}", timeout=args.timeout))
+
+
+def scenario_raw(session, args, corpus, rnd, recorder):
+    name, data = rnd.choice(corpus)
+    resp = _timed(recorder, "POST /process-raw", lambda: session.post(
+        f"{args.url}/process-raw", data=data,
+        headers={"Content-Type": "application/octet-stream", "X-Filename": quote(name)},
+        timeout=args.timeout))
+    if resp is not None:
+        recorder.add_documents(1)
+
+
+SCENARIOS = {
+    "process": scenario_process,
+    "inline": scenario_inline,
+    "multiple": scenario_multiple,
+    "raw": scenario_raw,
+}
+
+
+def _parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            sys.exit(f"Loại request không hợp lệ: {name} (chọn trong {', '.join(SCENARIOS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def process_tree_rss(pid):
+    """Tổng RSS (bytes) của pid và mọi process con (đọc /proc), None nếu không đọc được."""
+    page = os.sysconf("SC_PAGE_SIZE")
+    children = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    except OSError:
+        return None
+    total = 0
+    stack = [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * page
+        except (OSError, ValueError, IndexError):
+            if p == pid:
+                return None
+        stack.extend(children.get(p, ()))
+    return total
+
+
+def sample_server(args, stop, samples, started):
+    """Lấy mẫu /metrics (và RSS từ /proc nếu có --pid) mỗi --sample-interval giây."""
+    session = requests.Session()
+    while not stop.is_set():
+        sample = {"t": round(time.monotonic() - started, 2)}
+        try:
+            metrics = session.get(f"{args.url}/metrics", timeout=5).json()
+            memory = metrics.get("memory", {})
+            admission = metrics.get("admission", {})
+            sample["worker_rss_bytes"] = memory.get("rss_bytes")
+            sample["jobs_active"] = admission.get("jobs_active")
+            sample["queue_depth"] = admission.get("queue_depth")
+        except (requests.RequestException, ValueError):
+            pass
+        if args.pid:
+            sample["server_rss_bytes"] = process_tree_rss(args.pid)
+        samples.append(sample)
+        stop.wait(args.sample_interval)
+
+
+def run(args, corpus):
+    mix = _parse_mix(args.mix)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    recorder = Recorder()
+    samples = []
+    stop = threading.Event()
+    started = time.monotonic()
+    deadline = started + args.duration
+    remaining = [args.requests]
+    remaining_lock = threading.Lock()
+
+    def take():
+        if args.requests:
+            with remaining_lock:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+            return True
+        return time.monotonic() < deadline
+
+    def client(index):
+        rnd = random.Random(args.seed * 1000 + index)
+        session = requests.Session()
+        while take():
+            scenario = rnd.choices(names, weights)[0]
+            SCENARIOS[scenario](session, args, corpus, rnd, recorder)
+
+    sampler = threading.Thread(target=sample_server, args=(args, stop, samples, started), daemon=True)
+    sampler.start()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    sampler.join()
+    return build_report(recorder, samples, elapsed, args)
+
+
+def build_report(recorder, samples, elapsed, args):
+    endpoints = {}
+    total = 0
+    errors = 0
+    for name, results in sorted(recorder.results.items()):
+        latencies = sorted(seconds for seconds, _ in results)
+        statuses = {}
+        for _, status in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        failed = sum(n for status, n in statuses.items() if status != "200")
+        total += len(results)
+        errors += failed
+        endpoints[name] = {
+            "count": len(results),
+            "errors": failed,
+            "error_rate": round(failed / len(results), 4),
+            "status": statuses,
+            "latency_ms": {
+                "mean": round(1000 * sum(latencies) / len(latencies), 1),
+                "p50": round(1000 * percentile(latencies, 50), 1),
+                "p95": round(1000 * percentile(latencies, 95), 1),
+                "p99": round(1000 * percentile(latencies, 99), 1),
+                "max": round(1000 * latencies[-1], 1),
+            },
+        }
+    rss_key = "server_rss_bytes" if args.pid else "worker_rss_bytes"
+    rss_values = [s[rss_key] for s in samples if s.get(rss_key)]
+    return {
+        "config": {
+            "url": args.url, "concurrency": args.concurrency, "mix": args.mix,
+            "batch_size": args.batch_size, "files": args.files or f"synthetic x{args.count} ({args.pages} trang)",
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "requests_per_second": round(total / elapsed, 2) if elapsed else None,
+        "documents_per_second": round(recorder.documents / elapsed, 2) if elapsed else None,
+        "error_rate": round(errors / total, 4) if total else None,
+        "endpoints": endpoints,
+        "rss": {
+            "source": rss_key,
+            "min_bytes": min(rss_values) if rss_values else None,
+            "max_bytes": max(rss_values) if rss_values else None,
+            "last_bytes": rss_values[-1] if rss_values else None,
+        },
+        "timeline": samples,
+    }
+
+
+def print_report(report):
+    mb = lambda v: f"{v / 1024 / 1024:.0f} MB" if v else "-"
+    print(f"\nThời gian: {report['elapsed_seconds']}s, {report['requests']} request, "
+          f"{report['requests_per_second']} req/s, {report['documents_per_second']} docx/s, "
+          f"tỉ lệ lỗi {report['error_rate']}")
+    print(f"\n{'Request':<30}{'count':>7}{'lỗi':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  status")
+    for name, ep in report["endpoints"].items():
+        lat = ep["latency_ms"]
+        print(f"{name:<30}{ep['count']:>7}{ep['errors']:>6}{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}"
+              f"{lat['max']:>9}  {ep['status']}")
+    rss = report["rss"]
+    print(f"\nRSS ({rss['source']}): min {mb(rss['min_bytes'])}, max {mb(rss['max_bytes'])}, "
+          f"cuối {mb(rss['last_bytes'])}")
+    timeline = report["timeline"]
+    step = max(1, len(timeline) // 20)
+    print(f"\n{'t(s)':>8}{'RSS':>10}{'jobs':>6}{'queue':>7}")
+    for sample in timeline[::step]:
+        print(f"{sample['t']:>8}{mb(sample.get(rss['source'])):>10}"
+              f"{str(sample.get('jobs_active', '-')):>6}{str(sample.get('queue_depth', '-')):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo tải cho DOCX Processor API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=4, help="số client chạy đồng thời")
+    parser.add_argument("--duration", type=float, default=30, help="thời gian chạy (giây)")
+    parser.add_argument("--requests", type=int, default=0, help="tổng số kịch bản thay cho --duration")
+    parser.add_argument("--mix", default="process=3,inline=1,multiple=1",
+                        help="tỉ lệ các loại request: process, inline, multiple, raw")
+    parser.add_argument("--batch-size", default="2-5", help="số file mỗi request /process-multiple (vd 2-5)")
+    parser.add_argument("--no-download", dest="download", action="store_false",
+                        help="không gọi /download sau khi xử lý")
+    parser.add_argument("--files", help="thư mục chứa file .docx thật")
+    parser.add_argument("--count", type=int, default=8, help="số file tổng hợp")
+    parser.add_argument("--pages", default="5-50", help="số trang của file tổng hợp (vd 5-50)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--pid", type=int, help="pid của server (uvicorn master) để đo RSS toàn bộ")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--json", help="ghi báo cáo đầy đủ ra file JSON")
+    parser.add_argument("--generate", metavar="DIR", help="chỉ sinh file tổng hợp vào DIR rồi thoát")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args)
+    if args.generate:
+        os.makedirs(args.generate, exist_ok=True)
+        for name, data in corpus:
+            with open(os.path.join(args.generate, name), 'wb') as f:
+                f.write(data)
+        print(f"Đã sinh {len(corpus)} file vào {args.generate}")
+        return
+
+    total_mb = sum(len(data) for _, data in corpus) / 1024 / 1024
+    print(f"Đầu vào: {len(corpus)} file ({total_mb:.1f} MB), {args.concurrency} client, mix {args.mix}")
+    report = run(args, corpus)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã ghi báo cáo: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tiện ích log cho API:
+- request id cho từng request (contextvar) và filter gắn nó vào mọi log record;
+- đọc N dòng cuối của file log bằng seek ngược từ cuối file (không đọc cả file);
+- theo dõi file log trực tiếp (live tail), kể cả khi RotatingFileHandler xoay file;
+- lọc theo level tối thiểu và request id.
+"""
+
+import os
+import asyncio
+import logging
+import contextvars
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s'
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+
+class RequestIdFilter(logging.Filter):
+    """Gắn request id hiện tại (hoặc '-') vào record để formatter dùng %(request_id)s."""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+def tail_lines(path, n, block_size=8192):
+    """Trả về tối đa n dòng cuối của file, chỉ đọc các block cần thiết từ cuối file."""
+    if n <= 0:
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        chunks = []
+        newlines = 0
+        # Cần n+1 ký tự xuống dòng để chắc chắn dòng thứ n tính từ cuối là trọn vẹn
+        while pos > 0 and newlines <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            chunks.append(chunk)
+            newlines += chunk.count(b'\n')
+    data = b''.join(reversed(chunks))
+    lines = data.splitlines()
+    return [line.decode('utf-8', errors='replace') for line in lines[-n:]]
+
+
+def _parse_header(line):
+    """(level, request_id) nếu line là dòng đầu của một record theo LOG_FORMAT, ngược lại None."""
+    parts = line.split(' - ', 4)
+    if len(parts) < 4 or parts[2] not in LEVELS:
+        return None
+    request_id = None
+    if len(parts) == 5 and parts[3].startswith('[') and parts[3].endswith(']'):
+        request_id = parts[3][1:-1]
+    return parts[2], request_id
+
+
+class RecordFilter:
+    """
+    Lọc dòng log theo level tối thiểu và request id. Các dòng không có header
+    (vd traceback) đi theo quyết định của record đứng trước chúng.
+    """
+
+    def __init__(self, level=None, request_id=None):
+        self.min_level = LEVELS.get(level.upper(), 0) if level else 0
+        self.request_id = request_id or None
+        self.reset()
+
+    @property
+    def active(self):
+        return bool(self.min_level or self.request_id)
+
+    def reset(self):
+        # Dòng tiếp nối không rõ record gốc chỉ được giữ khi không lọc gì
+        self._keep = not self.active
+
+    def __call__(self, line):
+        header = _parse_header(line)
+        if header is not None:
+            level, request_id = header
+            self._keep = (LEVELS[level] >= self.min_level
+                          and (self.request_id is None or request_id == self.request_id))
+        return self._keep
+
+
+def filtered_tail(path, n, record_filter=None, block_size=8192):
+    """n dòng cuối thoả record_filter; đọc ngược thêm từng đợt khi bộ lọc loại bớt dòng."""
+    if record_filter is None or not record_filter.active:
+        return tail_lines(path, n, block_size)
+    want = n
+    while True:
+        lines = tail_lines(path, want, block_size)
+        record_filter.reset()
+        kept = [line for line in lines if record_filter(line)]
+        # len(lines) < want nghĩa là đã đọc tới đầu file
+        if len(kept) >= n or len(lines) < want:
+            return kept[-n:]
+        want *= 4
+
+
+async def follow(path, record_filter=None, poll_interval=0.5, is_disconnected=None):
+    """
+    Async generator trả về các dòng mới được ghi vào path (giống `tail -F`).
+    Khi file bị xoay (inode đổi hoặc file bị cắt ngắn), đọc nốt phần còn lại của
+    file cũ rồi mở file mới từ đầu.
+    """
+    f = None
+    buf = b''
+    from_end = True  # lần mở đầu tiên bắt đầu từ cuối file; file mới sau khi xoay thì đọc từ đầu
+    try:
+        while True:
+            if is_disconnected is not None and await is_disconnected():
+                return
+            if f is None:
+                try:
+                    f = open(path, 'rb')
+                    if from_end:
+                        f.seek(0, os.SEEK_END)
+                        from_end = False
+                except FileNotFoundError:
+                    f = None
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+            data = f.read()
+            if not data:
+                rotated = False
+                try:
+                    st = os.stat(path)
+                    rotated = st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+                except FileNotFoundError:
+                    rotated = True
+                if rotated:
+                    f.close()
+                    f = None
+                    from_end = False
+                    continue
+                await asyncio.sleep(poll_interval)
+                continue
+
+            buf += data
+            *complete, buf = buf.split(b'\n')
+            for raw in complete:
+                line = raw.decode('utf-8', errors='replace')
+                if record_filter is None or record_filter(line):
+                    yield line
+    finally:
+        if f is not None:
+            f.close()
@@ -11,23 +11,40 @@ An toàn cho bảng & header:
 
 Cách dùng:
     python process_docx.py input.docx output.docx
+    python process_docx.py --workers 4 input.docx output.docx   (chia body lớn, xử lý song song)
+    python process_docx.py --analyze input.docx   (chỉ thống kê tag, không sửa file)
 """
 
 import sys
 import os
 import re
+import json
 import zipfile
 import tempfile
 import shutil
+import io
+import time
+import uuid
+import contextlib
+import traceback
+import multiprocessing
+from xml.parsers import expat
+from bisect import bisect_right
 from defusedxml import minidom
+from defusedxml import ElementTree as SafeET
+from defusedxml import DefusedXmlException
+
+import docmodel
+import profiling
+from docxlimits import (DEFAULT_LIMITS, DocumentLimitExceeded, check_xml_depth, check_xml_elements, extract_docx,
+                        open_member)
 
 # ------------------------------
 # Zip helpers
 # ------------------------------
 
-def unpack_docx(docx_path, extract_dir):
-    with zipfile.ZipFile(docx_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_dir)
+def unpack_docx(docx_path, extract_dir, limits=DEFAULT_LIMITS):
+    extract_docx(docx_path, extract_dir, limits)
 
 def pack_docx(source_dir, output_path):
     with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as docx:
@@ -41,14 +58,195 @@ def pack_docx(source_dir, output_path):
 # XML utilities
 # ------------------------------
 
-def get_all_text_from_element(element):
+# Các tag mà pipeline đọc hoặc sửa; cây con không chứa tag nào trong số này
+# chỉ được giữ dạng chuỗi XML (docmodel.RawXML)
+PIPELINE_TAGS = frozenset({
+    'w:body', 'w:p', 'w:pPr', 'w:sectPr', 'w:br', 'w:drawing',
+    'w:t', 'w:tbl', 'w:tr', 'w:tc',
+})
+
+# Mọi tag của template ([[BLOCK_START0]], [[ROW1]], ...) đều chứa ký tự này
+TAG_MARKER = '['
+
+def parse_document_xml(content, limits=DEFAULT_LIMITS):
+    """
+    DOM cho pipeline: mô hình gọn của docmodel (ít bộ nhớ hơn nhiều so với minidom),
+    hoặc minidom nếu tài liệu có DOCTYPE/comment/PI/CDATA.
+    XML lồng sâu hơn limits.max_xml_depth bị từ chối (DocumentLimitExceeded) trước khi dựng DOM.
+    """
+    try:
+        return docmodel.parse(content, PIPELINE_TAGS, limits.max_xml_depth)
+    except docmodel.Unsupported:
+        check_xml_depth(content, limits)
+        return minidom.parseString(content)
+
+class ElementIndex:
+    """
+    Chỉ mục element của một cây con (thường là w:body), dựng bằng một lần duyệt:
+    - order: mọi element theo thứ tự tài liệu, pos[element] là vị trí trong order
+    - by_tag[tagName]: danh sách vị trí (tăng dần) của các element có tagName đó
+    - parents[i]: vị trí element cha của order[i], ends[i]: vị trí cuối của cây con order[i]
+    Truy vấn element con theo tag chỉ là bisect trên by_tag thay vì duyệt lại cả cây
+    như getElementsByTagName. Node bị gỡ qua remove_nodes(..., elements) được đánh dấu
+    để chỉ mục vẫn đúng sau mỗi bước.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.order = []
+        self.pos = {}
+        self.by_tag = {}
+        self.parents = []
+        self.ends = []
+        # _cuts[i]: vị trí của node bị gỡ sâu nhất chứa order[i] (nếu có)
+        self._cuts = {}
+        # Vị trí (tăng dần) các w:t có TAG_MARKER, tính khi marked() được gọi lần đầu
+        self._marked = None
+
+        stack = [(root, -1)]
+        while stack:
+            node, parent = stack.pop()
+            i = len(self.order)
+            self.order.append(node)
+            self.pos[node] = i
+            self.parents.append(parent)
+            self.ends.append(i)
+            self.by_tag.setdefault(node.tagName, []).append(i)
+            for child in reversed(node.childNodes):
+                if child.nodeType == child.ELEMENT_NODE:
+                    stack.append((child, i))
+        for i in range(len(self.order) - 1, 0, -1):
+            parent = self.parents[i]
+            if self.ends[i] > self.ends[parent]:
+                self.ends[parent] = self.ends[i]
+
+    def elements(self, tag, within=None):
+        """
+        Các element tagName == tag nằm trong within (không tính within), theo thứ tự tài liệu;
+        tương đương within.getElementsByTagName(tag).
+        """
+        if within is None:
+            within = self.root
+        start = self.pos.get(within)
+        if start is None:
+            return list(within.getElementsByTagName(tag))
+        positions = self.by_tag.get(tag)
+        if not positions:
+            return []
+        lo = bisect_right(positions, start)
+        hi = bisect_right(positions, self.ends[start])
+        order = self.order
+        cuts = self._cuts
+        if not cuts:
+            return [order[i] for i in positions[lo:hi]]
+        # Bỏ các element nằm dưới một node đã bị gỡ bên trong within
+        return [order[i] for i in positions[lo:hi] if cuts.get(i, -1) <= start]
+
+    def marked(self, node):
+        """
+        False nếu chắc chắn cây con của node không chứa tag: không w:t nào bên trong có
+        TAG_MARKER ở lần gọi đầu tiên. Ký tự '[' không thể bị tách giữa hai run nên tag bị
+        tách qua nhiều w:t vẫn được nhận ra. Các bước chỉ xoá bớt text, nên kết quả chỉ có
+        thể dương tính thừa; node ngoài chỉ mục luôn trả về True.
+        """
+        if self._marked is None:
+            order = self.order
+            self._marked = [
+                i for i in self.by_tag.get('w:t', ())
+                if order[i].firstChild is not None and TAG_MARKER in order[i].firstChild.nodeValue
+            ]
+        start = self.pos.get(node)
+        if start is None:
+            return True
+        k = bisect_right(self._marked, start)
+        return k < len(self._marked) and self._marked[k] <= self.ends[start]
+
+    def ancestor(self, node, tag_names):
+        """Element tổ tiên gần nhất của node có tagName thuộc tag_names (hoặc None)."""
+        i = self.pos.get(node)
+        if i is None:
+            cur = node.parentNode
+            while cur is not None and getattr(cur, "tagName", None) not in tag_names:
+                cur = cur.parentNode
+            return cur
+        if self._cuts.get(i, -1) == i:
+            return None
+        i = self.parents[i]
+        while i >= 0:
+            if self.order[i].tagName in tag_names:
+                return self.order[i]
+            if self._cuts.get(i, -1) == i:
+                break
+            i = self.parents[i]
+        return None
+
+    def detach(self, node):
+        """Ghi nhận node (và cây con của nó) đã bị gỡ khỏi cây."""
+        start = self.pos.get(node)
+        if start is None:
+            return
+        cuts = self._cuts
+        for i in range(start, self.ends[start] + 1):
+            if cuts.get(i, -1) < start:
+                cuts[i] = start
+
+def _may_have_tags(node, elements=None):
+    """Bộ lọc nhanh theo đoạn: False khi node chắc chắn không chứa tag nào (xem ElementIndex.marked)."""
+    return elements is None or elements.marked(node)
+
+def _elements(node, tag, elements=None):
+    """node.getElementsByTagName(tag), tra qua ElementIndex nếu có."""
+    if elements is not None:
+        return elements.elements(tag, node)
+    return node.getElementsByTagName(tag)
+
+def get_all_text_from_element(element, elements=None):
     """Nối toàn bộ text từ các w:t con (để debug/log)."""
-    text_elems = element.getElementsByTagName('w:t')
+    text_elems = _elements(element, 'w:t', elements)
     return ''.join([t.firstChild.nodeValue if (t.firstChild is not None) else '' for t in text_elems])
 
-def _iter_text_nodes_in(element):
+def remove_nodes(nodes, elements=None):
+    """
+    Xoá hàng loạt node khỏi cây DOM.
+    minidom.removeChild làm list.remove trên childNodes của parent (tuyến tính) cho mỗi node,
+    nên xoá hàng nghìn node là bậc hai. Ở đây mỗi parent chỉ được dựng lại childNodes
+    một lần và nối lại previousSibling/nextSibling trong cùng lượt đó.
+    Trả về số node thực sự được gỡ (node không còn parent thì bỏ qua).
+    Nếu có ElementIndex (elements) thì chỉ mục được cập nhật tương ứng.
+    """
+    by_parent = {}
+    for node in nodes:
+        if node.parentNode is not None:
+            by_parent.setdefault(node.parentNode, set()).add(node)
+
+    removed = 0
+    for parent, doomed in by_parent.items():
+        kept = [c for c in parent.childNodes if c not in doomed]
+        parent.childNodes[:] = kept
+        prev = None
+        for c in kept:
+            c.previousSibling = prev
+            if prev is not None:
+                prev.nextSibling = c
+            prev = c
+        if prev is not None:
+            prev.nextSibling = None
+        for node in doomed:
+            node.parentNode = node.previousSibling = node.nextSibling = None
+            if elements is not None:
+                elements.detach(node)
+        removed += len(doomed)
+
+        # Như removeChild: cache getElementById của document không còn đúng
+        doc = parent.ownerDocument
+        if doc is not None:
+            doc._id_cache.clear()
+            doc._id_search_stack = None
+    return removed
+
+def _iter_text_nodes_in(element, elements=None):
     """Trả về danh sách w:t (text nodes) theo thứ tự xuất hiện trong element."""
-    return list(element.getElementsByTagName('w:t'))
+    return list(_elements(element, 'w:t', elements))
 
 def _concat_and_spans(text_nodes):
     """
@@ -101,13 +299,13 @@ def _apply_kept_ranges_to_text_nodes(text_nodes, spans, kept_ranges):
         else:
             node.firstChild.nodeValue = new_text
 
-def _remove_pairs_in_same_paragraph(p, start_pat, end_pat):
+def _remove_pairs_in_same_paragraph(p, start_pat, end_pat, elements=None):
     """
     Xoá mọi cặp START..END (và phần giữa) nếu chúng nằm trong CÙNG MỘT w:p.
     Chỉ chỉnh sửa w:t; không đụng run/paragraph khác.
     Trả về True nếu có thay đổi.
     """
-    ts = _iter_text_nodes_in(p)
+    ts = _iter_text_nodes_in(p, elements)
     if not ts:
         return False
     full, spans = _concat_and_spans(ts)
@@ -139,11 +337,13 @@ def _remove_pairs_in_same_paragraph(p, start_pat, end_pat):
     _apply_kept_ranges_to_text_nodes(ts, spans, kept)
     return True
 
-def _has_ancestor_tag(node, tag_names):
+def _has_ancestor_tag(node, tag_names, elements=None):
     """
     Trả về True nếu node có ancestor với tagName thuộc tag_names (list).
     tag_names ví dụ: ['w:tbl', 'w:tr', 'w:tc']
     """
+    if elements is not None:
+        return elements.ancestor(node, tag_names) is not None
     cur = node.parentNode
     while cur is not None:
         if getattr(cur, "tagName", None) in tag_names:
@@ -152,11 +352,11 @@ def _has_ancestor_tag(node, tag_names):
     return False
 
 
-def _cut_after_start_in_paragraph(p, start_pat):
+def _cut_after_start_in_paragraph(p, start_pat, elements=None):
     """
     Nếu đoạn có START (không có END), cắt từ vị trí START đến hết đoạn.
     """
-    ts = _iter_text_nodes_in(p)
+    ts = _iter_text_nodes_in(p, elements)
     if not ts:
         return False
     full, spans = _concat_and_spans(ts)
@@ -171,11 +371,11 @@ def _cut_after_start_in_paragraph(p, start_pat):
     _apply_kept_ranges_to_text_nodes(ts, spans, kept)
     return True
 
-def _cut_before_end_in_paragraph(p, end_pat):
+def _cut_before_end_in_paragraph(p, end_pat, elements=None):
     """
     Nếu đoạn có END (không có START), cắt từ đầu đến hết END.
     """
-    ts = _iter_text_nodes_in(p)
+    ts = _iter_text_nodes_in(p, elements)
     if not ts:
         return False
     full, spans = _concat_and_spans(ts)
@@ -191,56 +391,167 @@ def _cut_before_end_in_paragraph(p, end_pat):
     return True
 
 # ------------------------------
-# First page helpers
+# Page layout model
 # ------------------------------
 
-def get_first_page_elements(body):
-    """Thu tất cả w:p, w:tbl của trang đầu dựa trên page/section break."""
-    first_page_elements = []
+_BREAK_KINDS = ('break', 'content_and_break')
 
-    for child in body.childNodes:
+def _kind_of_paragraph(text, has_drawing, has_break):
+    """Phân loại một w:p theo nội dung (text/hình) và việc có ngắt trang hay không."""
+    has_content = bool(text.strip()) or has_drawing
+    if has_break:
+        return 'content_and_break' if has_content else 'break'
+    return 'content' if has_content else 'empty_p'
+
+def _scan_element(node, kinds):
+    """
+    Duyệt cây con của node đúng một lần.
+    Trả về (text, has_drawing, has_page_br, first_pPr_has_sectPr, has_sectPr);
+    mọi w:p gặp trên đường (kể cả node) được phân loại và ghi vào kinds.
+    """
+    texts = []
+    has_drawing = False
+    has_page_br = False
+    ppr_sect = None  # None: chưa gặp w:pPr nào
+    has_sect = False
+    for child in node.childNodes:
         if child.nodeType != child.ELEMENT_NODE:
             continue
-        if child.tagName not in ['w:p', 'w:tbl']:
-            continue
+        c_text, c_drawing, c_br, c_ppr_sect, c_sect = _scan_element(child, kinds)
+        texts.append(c_text)
+        has_drawing = has_drawing or c_drawing
+        has_page_br = has_page_br or c_br
+        has_sect = has_sect or c_sect
+        if ppr_sect is None:
+            ppr_sect = c_ppr_sect
+
+    tag = node.tagName
+    if tag == 'w:t':
+        texts.insert(0, node.firstChild.nodeValue if (node.firstChild is not None) else '')
+    elif tag == 'w:drawing':
+        has_drawing = True
+    elif tag == 'w:br':
+        has_page_br = has_page_br or node.getAttribute('w:type') == 'page'
+    elif tag == 'w:sectPr':
+        has_sect = True
+    elif tag == 'w:pPr':
+        # w:pPr đứng trước mọi w:pPr con của nó theo thứ tự tài liệu
+        ppr_sect = has_sect
+
+    text = ''.join(texts)
+    if tag == 'w:p':
+        kinds[node] = _kind_of_paragraph(text, has_drawing, has_page_br or bool(ppr_sect))
+    return text, has_drawing, has_page_br, ppr_sect, has_sect
+
+class PageLayout:
+    """
+    Mô hình bố cục trang của w:body, tính trong một lần duyệt:
+    - nodes: childNodes của body theo thứ tự, kinds[node] là phân loại của từng node
+      ('content', 'content_and_break', 'break', 'empty_p', 'other')
+    - breaks: chỉ số trong nodes của các node kết thúc trang (ngắt trang / sectPr)
+    - kinds cũng chứa phân loại của mọi w:p lồng bên trong (bảng, sdt, ...)
+    Dùng remove() để xoá node khỏi DOM và cập nhật mô hình tương ứng.
+    Lưu ý: phân loại phụ thuộc vào text, nên cần dựng lại sau khi các bước gỡ tag sửa text.
+    """
 
-        has_page_break = False
-        if child.tagName == 'w:p':
-            runs = child.getElementsByTagName('w:r')
-            for run in runs:
-                for br in run.getElementsByTagName('w:br'):
-                    if br.getAttribute('w:type') == 'page':
-                        has_page_break = True
-                        break
-                if has_page_break:
-                    break
-
-            pPr = child.getElementsByTagName('w:pPr')
-            if pPr:
-                sectPr = pPr[0].getElementsByTagName('w:sectPr')
-                if sectPr:
-                    has_page_break = True
-
-        first_page_elements.append(child)
-        if has_page_break:
-            break
+    def __init__(self, body, elements=None):
+        self.body = body
+        self.elements = elements
+        self.kinds = {}
+        self.texts = {}
+        self.nodes = []
+        self.breaks = []
+        for node in body.childNodes:
+            kind = 'other'
+            if node.nodeType == node.ELEMENT_NODE:
+                text = _scan_element(node, self.kinds)[0]
+                if node.tagName == 'w:tbl':
+                    kind = 'content'
+                elif node.tagName == 'w:p':
+                    kind = self.kinds[node]
+                if kind != 'other':
+                    self.texts[node] = text
+            self.kinds[node] = kind
+            self.nodes.append(node)
+        self._index_breaks()
+
+    def _index_breaks(self):
+        self.breaks = [i for i, n in enumerate(self.nodes) if self.kinds[n] in _BREAK_KINDS]
+
+    def kind(self, node):
+        return self.kinds.get(node, 'other')
+
+    def first_page_elements(self):
+        """Các w:p, w:tbl cấp body từ đầu đến hết node ngắt trang đầu tiên."""
+        end = self.breaks[0] + 1 if self.breaks else len(self.nodes)
+        return [n for n in self.nodes[:end] if n in self.texts]
+
+    def leading_kind(self):
+        """Phân loại của node đầu tiên không phải 'empty_p' (None nếu không có)."""
+        for node in self.nodes:
+            kind = self.kinds[node]
+            if kind != 'empty_p':
+                return kind
+        return None
+
+    def blank_page_breaks(self, next_kind=None):
+        """
+        Các node 'break' mà sau nó (bỏ qua các 'empty_p') là một node ngắt trang khác,
+        tức là trang giữa hai lần ngắt không có nội dung.
+        next_kind là phân loại của node đứng ngay sau body (khi body chỉ là một đoạn
+        của tài liệu), None nếu body là phần cuối.
+        """
+        result = []
+        # next_kind: phân loại của node không phải 'empty_p' gần nhất phía sau
+        for node in reversed(self.nodes):
+            kind = self.kinds[node]
+            if kind == 'break' and next_kind in _BREAK_KINDS:
+                result.append(node)
+            if kind != 'empty_p':
+                next_kind = kind
+        result.reverse()
+        return result
+
+    def empty_paragraphs(self):
+        """Mọi w:p (mọi cấp) không có text/hình và không phải ngắt trang."""
+        return [n for n, kind in self.kinds.items() if kind == 'empty_p']
+
+    def remove(self, nodes):
+        """Xoá các node khỏi DOM và cập nhật mô hình (kể cả các w:p con của chúng)."""
+        removed = remove_nodes(nodes, self.elements)
+        dropped = set(nodes)
+        for node in nodes:
+            if node.nodeType == node.ELEMENT_NODE:
+                dropped.update(_elements(node, 'w:p', self.elements))
+        for node in dropped:
+            self.kinds.pop(node, None)
+            self.texts.pop(node, None)
+        self.nodes = [n for n in self.nodes if n not in dropped]
+        self._index_breaks()
+        return removed
 
-    return first_page_elements
+# ------------------------------
+# First page helpers
+# ------------------------------
+
+def get_first_page_elements(body, elements=None):
+    """Thu tất cả w:p, w:tbl của trang đầu dựa trên page/section break."""
+    return PageLayout(body, elements).first_page_elements()
 
-def remove_first_page_if_the1(body):
+def remove_first_page_if_the1(body, layout=None):
     """Xoá trang đầu nếu chỉ có 'thẻ 1' (không phân biệt hoa/thường)."""
     print("Bước 0: Kiểm tra và xóa trang đầu nếu chỉ có 'thẻ 1'")
-    first = get_first_page_elements(body)
+    if layout is None:
+        layout = PageLayout(body)
+    first = layout.first_page_elements()
     if not first:
         print("  Không tìm thấy elements ở trang đầu")
         return
 
-    txt = ''.join(get_all_text_from_element(e) for e in first).strip().lower()
+    txt = ''.join(layout.texts[e] for e in first).strip().lower()
     print(f"  Nội dung trang đầu: '{txt}'")
     if txt == 'thẻ 1':
-        for e in first:
-            if e.parentNode:
-                e.parentNode.removeChild(e)
+        layout.remove(first)
         print(f"  ✓ Đã xóa {len(first)} elements từ trang đầu")
 
 # ------------------------------
@@ -250,14 +561,8 @@ def remove_first_page_if_the1(body):
 # *** BẮT ĐẦU THAY ĐỔI ***
 # Hàm này là hàm mới, kết hợp logic của `remove_block_content_including_tables`
 # và `process_removal_between_tags`
-def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
-    """
-    Xoá các node (w:p, w:tbl) nằm giữa [[START_TAG{label}]] và [[END_TAG]].
-    Hàm này duyệt các childNodes (w:p, w:tbl) của body và xoá mọi thứ ở giữa,
-    bao gồm cả bảng.
-    Các tag start/end sẽ được xoá khỏi các node chứa chúng.
-    Trả về tổng số thay đổi (nodes bị xóa + số cặp được xử lý trong cùng đoạn).
-    """
+def _block_patterns(start_tag_type, end_tag_type, label):
+    """(start_pat, end_pat) cho một loại block, hoặc None nếu kiểu tag không hợp lệ."""
     # Xác định pattern dựa trên type
     if start_tag_type == 'BLOCK_START':
         start_pat = rf'\[\[BLOCK_START{label}\]\]'
@@ -265,7 +570,7 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
         start_pat = rf'\[\[SECTION_START{label}\]\]'
     else:
         print(f"Lỗi: Kiểu tag bắt đầu không hợp lệ: {start_tag_type}")
-        return 0 # Kiểu tag không hợp lệ
+        return None # Kiểu tag không hợp lệ
 
     if end_tag_type == 'BLOCK_END':
         end_pat = r'\[\[BLOCK_END\]\]'
@@ -273,12 +578,32 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
         end_pat = r'\[\[SECTION_END\]\]'
     else:
         print(f"Lỗi: Kiểu tag kết thúc không hợp lệ: {end_tag_type}")
-        return 0 # Kiểu tag không hợp lệ
+        return None # Kiểu tag không hợp lệ
+    return start_pat, end_pat
+
+def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label, elements=None):
+    """
+    Xoá các node (w:p, w:tbl) nằm giữa [[START_TAG{label}]] và [[END_TAG]].
+    Hàm này duyệt các childNodes (w:p, w:tbl) của body và xoá mọi thứ ở giữa,
+    bao gồm cả bảng.
+    Các tag start/end sẽ được xoá khỏi các node chứa chúng.
+    Trả về tổng số thay đổi (nodes bị xóa + số cặp được xử lý trong cùng đoạn).
+    """
+    patterns = _block_patterns(start_tag_type, end_tag_type, label)
+    if patterns is None:
+        return 0
+    changes, _ = _remove_nodes_between_patterns(body, *patterns, elements=elements)
+    return changes
 
+def _remove_nodes_between_patterns(body, start_pat, end_pat, in_block=False, elements=None):
+    """
+    Một lượt xoá block trên các childNodes của body. in_block là trạng thái khi bắt đầu
+    (True nếu body là một đoạn nằm giữa block đã mở ở phía trước).
+    Trả về (số thay đổi, trạng thái in_block khi kết thúc).
+    """
     nodes_to_remove = []
     pairs_handled = 0  # Đếm số cặp được xử lý trong cùng đoạn
-    in_block = False
-    
+
     end_pat_compiled = re.compile(end_pat)
 
     # body.childNodes là một Live NodeList, cần copy ra list để xoá an toàn
@@ -290,7 +615,13 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
         if node.tagName not in ['w:p', 'w:tbl']:
             continue
 
-        node_text = get_all_text_from_element(node)
+        # Không có tag: nằm trong block thì bị xoá, ngoài block thì giữ nguyên
+        if not _may_have_tags(node, elements):
+            if in_block:
+                nodes_to_remove.append(node)
+            continue
+
+        node_text = get_all_text_from_element(node, elements)
         start_match = re.search(start_pat, node_text)
         end_match = re.search(end_pat, node_text) # This is used for the in_block check
 
@@ -304,7 +635,7 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
                 else:
                     # Xoá tag [[END_TAG]] khỏi node này
                     if node.tagName == 'w:p':
-                        _cut_before_end_in_paragraph(node, end_pat)
+                        _cut_before_end_in_paragraph(node, end_pat, elements)
             else:
                 nodes_to_remove.append(node)
 
@@ -315,18 +646,18 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
             # Nếu có một cặp START...END trong cùng một node
             if end_match_after:
                 if node.tagName == 'w:p':
-                    if _remove_pairs_in_same_paragraph(node, start_pat, end_pat):
+                    if _remove_pairs_in_same_paragraph(node, start_pat, end_pat, elements):
                         pairs_handled += 1
                         # Check if the paragraph is now empty and should be removed
-                        node_text_after = get_all_text_from_element(node)
+                        node_text_after = get_all_text_from_element(node, elements)
                         if not node_text_after.strip():
                             nodes_to_remove.append(node)
                 elif node.tagName == 'w:tbl':
                     # Process paragraphs within the table
-                    for p_in_tbl in node.getElementsByTagName('w:p'):
-                        p_text = get_all_text_from_element(p_in_tbl)
+                    for p_in_tbl in _elements(node, 'w:p', elements):
+                        p_text = get_all_text_from_element(p_in_tbl, elements)
                         if re.search(start_pat, p_text) and re.search(end_pat, p_text):
-                            if _remove_pairs_in_same_paragraph(p_in_tbl, start_pat, end_pat):
+                            if _remove_pairs_in_same_paragraph(p_in_tbl, start_pat, end_pat, elements):
                                 pairs_handled += 1
             else:
                 # Bắt đầu một block mới (không có end tag trong cùng node)
@@ -338,69 +669,131 @@ def remove_nodes_between_tags(body, start_tag_type, end_tag_type, label):
                 else:
                     # Chỉ xoá tag và phần sau nó
                     if node.tagName == 'w:p':
-                        _cut_after_start_in_paragraph(node, start_pat)
+                        _cut_after_start_in_paragraph(node, start_pat, elements)
 
-    for node in nodes_to_remove:
-        if node.parentNode:
-            node.parentNode.removeChild(node)
+    remove_nodes(nodes_to_remove, elements)
 
-    return len(nodes_to_remove) + pairs_handled
+    return len(nodes_to_remove) + pairs_handled, in_block
 
 # *** KẾT THÚC THAY ĐỔI ***
 # (Hàm `remove_block_content_including_tables` và `process_removal_between_tags` cũ đã bị xóa)
 
 
-def clear_row_content_with_tag(body, label):
+# ------------------------------
+# Table row index
+# ------------------------------
+
+_ROW_LABEL_RE = re.compile(r'\[\[ROW([^\[\]]+)\]\]')
+
+class RowIndex:
+    """
+    Chỉ mục các w:tr trong body, dựng một lần:
+    - rows: các w:tr theo thứ tự tài liệu (kể cả bảng lồng)
+    - tables[tr]: w:tbl chứa hàng, texts[tr]: text ghép của hàng ('' với hàng không có tag)
+    - labels[tr]: các nhãn ROW có trong hàng (vd {'0', '1'} cho [[ROW0]], [[ROW1]])
+    - by_label[label]: các hàng chứa [[ROW{label}]]
+    Lấy các hàng theo nhãn chỉ là tra cứu, không cần quét lại toàn bộ bảng.
+    """
+
+    def __init__(self, body, elements=None):
+        if elements is None:
+            elements = ElementIndex(body)
+        self.elements = elements
+        self.rows = []
+        self.tables = {}
+        self.texts = {}
+        self.labels = {}
+        self.by_label = {}
+        for tr in _elements(body, 'w:tr', self.elements):
+            # Hàng không có tag thì không cần ghép text
+            text = get_all_text_from_element(tr, self.elements) if self.elements.marked(tr) else ''
+            labels = set(_ROW_LABEL_RE.findall(text))
+            self.rows.append(tr)
+            self.tables[tr] = elements.ancestor(tr, ('w:tbl',))
+            self.texts[tr] = text
+            self.labels[tr] = labels
+            for label in labels:
+                self.by_label.setdefault(label, []).append(tr)
+        self._order = {tr: i for i, tr in enumerate(self.rows)}
+
+    def has_label(self, tr, label):
+        return str(label) in self.labels.get(tr, ())
+
+    def rows_with_labels(self, labels):
+        """Các hàng chứa ít nhất một nhãn trong labels, theo thứ tự tài liệu."""
+        found = set()
+        for label in labels:
+            found.update(self.by_label.get(str(label), ()))
+        return sorted(found, key=self._order.__getitem__)
+
+    def _forget(self, tr):
+        for label in self.labels.get(tr, ()):
+            self.by_label[label].remove(tr)
+        self.labels[tr] = set()
+        self.texts[tr] = ''
+
+    def clear(self, tr):
+        """Xoá text của mọi w:t trong hàng (kể cả hàng lồng bên trong) và cập nhật chỉ mục."""
+        for t in _elements(tr, 'w:t', self.elements):
+            if t.firstChild:
+                t.firstChild.nodeValue = ''
+        self._forget(tr)
+        for inner in _elements(tr, 'w:tr', self.elements):
+            self._forget(inner)
+
+    def remove(self, rows):
+        """Xoá các hàng khỏi DOM và khỏi chỉ mục (kể cả hàng lồng bên trong)."""
+        removed = remove_nodes(rows, self.elements)
+        dropped = set(rows)
+        for tr in rows:
+            dropped.update(_elements(tr, 'w:tr', self.elements))
+        for tr in dropped:
+            if tr in self.labels:
+                self._forget(tr)
+                del self.labels[tr], self.texts[tr], self.tables[tr]
+        self.rows = [tr for tr in self.rows if tr not in dropped]
+        return removed
+
+def clear_row_content_with_tag(body, label, index=None):
     """Xoá nội dung của w:tr có [[ROW{label}]], nhưng giữ lại hàng.
     Nội dung ở đây là các text nodes (w:t).
     """
+    return clear_rows_content_with_tags(body, [label], index)
+
+def clear_rows_content_with_tags(body, labels, index=None):
+    """Như clear_row_content_with_tag nhưng cho nhiều nhãn ROW cùng lúc."""
+    if index is None:
+        index = RowIndex(body)
     rows_cleared = 0
-    tag_pattern = rf'\[\[ROW{label}\]\]'
-    
-    for tr in body.getElementsByTagName('w:tr'):
-        # Phải kiểm tra lại parentNode vì có thể hàng đã bị xoá trong bước trước
-        if not tr.parentNode:
-            continue
-            
-        row_text = get_all_text_from_element(tr)
-        if re.search(tag_pattern, row_text):
-            # Tìm thấy hàng chứa tag. Xoá text của tất cả w:t con.
-            text_nodes = tr.getElementsByTagName('w:t')
-            for t in text_nodes:
-                if t.firstChild:
-                    t.firstChild.nodeValue = ''
+    for tr in index.rows_with_labels(labels):
+        # Hàng có thể đã bị xoá trắng khi xử lý hàng cha chứa nó
+        if any(index.has_label(tr, label) for label in labels):
+            index.clear(tr)
             rows_cleared += 1
     return rows_cleared
 
 
-def remove_rows_with_tag(body, label):
+def remove_rows_with_tag(body, label, index=None):
     """Xoá w:tr có [[ROW{label}]] (vd [[ROW0]])."""
-    rows_removed = 0
-    tag_pattern = rf'\[\[ROW{label}\]\]'
-    
-    # We need to iterate and remove carefully.
-    # It's better to find all rows to be removed first, then remove them.
-    rows_to_remove = []
-    for tr in body.getElementsByTagName('w:tr'):
-        row_text = get_all_text_from_element(tr)
-        if re.search(tag_pattern, row_text):
-            rows_to_remove.append(tr)
+    return remove_rows_with_tags(body, [label], index)
 
+def remove_rows_with_tags(body, labels, index=None):
+    """Xoá mọi w:tr chứa [[ROW{label}]] với label thuộc labels, chỉ tra cứu trong RowIndex."""
+    if index is None:
+        index = RowIndex(body)
+    rows_to_remove = index.rows_with_labels(labels)
     for tr in rows_to_remove:
-        if tr.parentNode:
-            print(f"  - Removing a w:tr node containing [[ROW{label}]]")
-            tr.parentNode.removeChild(tr)
-            rows_removed += 1
-            
-    return rows_removed
+        found = ', '.join(f"[[ROW{label}]]" for label in labels if index.has_label(tr, label))
+        print(f"  - Removing a w:tr node containing {found}")
+    return index.remove(rows_to_remove)
 
-def _replace_tags_in_text_nodes(body, patterns):
+def _replace_tags_in_text_nodes(body, patterns, elements=None):
     """
     Gỡ tag bằng replace trực tiếp trong w:t để không đụng run/paragraph.
     patterns: list[str] regex
     """
     changed = 0
-    for t in body.getElementsByTagName('w:t'):
+    for t in _elements(body, 'w:t', elements):
         if t.firstChild and t.firstChild.nodeType == t.firstChild.TEXT_NODE:
             old = t.firstChild.nodeValue
             new = old
@@ -411,7 +804,13 @@ def _replace_tags_in_text_nodes(body, patterns):
                 changed += 1
     return changed
 
-def remove_all_remaining_tags(body):
+def _fill_empty_text_nodes(body, container_tags, elements):
+    """Gắn text node rỗng cho các w:t không có con nằm trong một container thuộc container_tags."""
+    for t in elements.elements('w:t', body):
+        if t.firstChild is None and elements.ancestor(t, container_tags) is not None:
+            t.appendChild(t.ownerDocument.createTextNode(''))
+
+def remove_all_remaining_tags(body, elements=None):
     """
     Gỡ sạch các tag còn lại, bao gồm [[ROW_END]], xử lý cả trường hợp tag bị tách.
     """
@@ -425,12 +824,20 @@ def remove_all_remaining_tags(body):
     ]
     
     changed_elements_count = 0
-    
+    container_tags = ['w:p', 'w:tc', 'w:tr']
+
+    if elements is not None:
+        # Container không có tag được bỏ qua bên dưới; chỉ cần làm như khi xử lý chúng:
+        # w:t rỗng nằm trong container được gắn text node rỗng
+        _fill_empty_text_nodes(body, container_tags, elements)
+
     # Iterate through all paragraphs and table cells, as these are common containers for w:t
     # Also iterate through w:tr for completeness, though w:tc is usually sufficient for table text
-    for container_tag in ['w:p', 'w:tc', 'w:tr']:
-        for container_elem in body.getElementsByTagName(container_tag):
-            text_nodes = _iter_text_nodes_in(container_elem)
+    for container_tag in container_tags:
+        for container_elem in _elements(body, container_tag, elements):
+            if not _may_have_tags(container_elem, elements):
+                continue
+            text_nodes = _iter_text_nodes_in(container_elem, elements)
             if not text_nodes:
                 continue
             
@@ -479,91 +886,109 @@ def classify_node(node):
     if node.tagName == 'w:tbl':
         return 'content'
 
-    # It's a w:p
-    text = get_all_text_from_element(node).strip()
-    has_text = bool(text)
-    has_drawing = bool(node.getElementsByTagName('w:drawing'))
-
-    is_page_break = False
-    for br in node.getElementsByTagName('w:br'):
-        if br.getAttribute('w:type') == 'page':
-            is_page_break = True
-            break
-    
-    if not is_page_break:
-        pPrs = node.getElementsByTagName('w:pPr')
-        if pPrs:
-            if pPrs[0].getElementsByTagName('w:sectPr'):
-                is_page_break = True
-
-    if is_page_break:
-        if has_text or has_drawing:
-            return 'content_and_break'
-        else:
-            return 'break'
-    
-    if has_text or has_drawing:
-        return 'content'
-    
-    return 'empty_p' # Empty paragraph
-
-def remove_blank_pages(body):
-    nodes = list(body.childNodes)
-    classifications = [classify_node(n) for n in nodes]
+    kinds = {}
+    _scan_element(node, kinds)
+    return kinds[node]
 
-    nodes_to_remove = []
-    for i in range(len(classifications) - 1):
-        # Look for a break followed by another break, with only empty paragraphs in between
-        if classifications[i] == 'break':
-            # Find the next non-empty_p classification
-            next_content_idx = -1
-            for j in range(i + 1, len(classifications)):
-                if classifications[j] != 'empty_p':
-                    next_content_idx = j
-                    break
-            
-            if next_content_idx != -1 and classifications[next_content_idx] in ['break', 'content_and_break']:
-                # We have a break, followed by empties, followed by another break.
-                # Remove the first break.
-                nodes_to_remove.append(nodes[i])
-
-    for node in nodes_to_remove:
-        if node.parentNode:
-            node.parentNode.removeChild(node)
-    
-    return len(nodes_to_remove)
+def remove_blank_pages(body, layout=None, next_kind=None):
+    """Xoá node ngắt trang đứng trước một ngắt trang khác mà giữa chúng chỉ có đoạn trống."""
+    if layout is None:
+        layout = PageLayout(body)
+    return layout.remove(layout.blank_page_breaks(next_kind))
 
-def remove_all_empty_paragraphs(body):
+def remove_all_empty_paragraphs(body, layout=None):
     """Removes all paragraphs that contain no visible content."""
-    nodes_to_remove = []
-    for p in body.getElementsByTagName('w:p'):
-        text = get_all_text_from_element(p).strip()
-        has_drawing = p.getElementsByTagName('w:drawing')
-        if not text and not has_drawing:
-            # Ensure the paragraph is not a page break before removing
-            if classify_node(p) not in ['break', 'content_and_break']:
-                nodes_to_remove.append(p)
-    
-    for node in nodes_to_remove:
-        if node.parentNode:
-            node.parentNode.removeChild(node)
-            
-    return len(nodes_to_remove)
+    if layout is None:
+        layout = PageLayout(body)
+    return layout.remove(layout.empty_paragraphs())
 
 # ------------------------------
 # Orchestrator
 # ------------------------------
 
-def process_document_xml(xml_path):
+def document_census(body, elements):
+    """Số đoạn/bảng/hàng và số lượng từng tag (ghép text theo từng w:p) của body trước khi xử lý."""
+    tags = {}
+    for p in elements.elements('w:p', body):
+        if not elements.marked(p):
+            continue
+        for m in _INVENTORY_TAG_RE.finditer(get_all_text_from_element(p, elements)):
+            tags[m.group(1)] = tags.get(m.group(1), 0) + 1
+    return {
+        'paragraphs': len(elements.elements('w:p', body)),
+        'tables': len(elements.elements('w:tbl', body)),
+        'rows': len(elements.elements('w:tr', body)),
+        'tags': dict(sorted(tags.items())),
+    }
+
+def _merge_census(parts):
+    merged = {'paragraphs': 0, 'tables': 0, 'rows': 0, 'tags': {}}
+    for part in parts:
+        for key in ('paragraphs', 'tables', 'rows'):
+            merged[key] += part[key]
+        for name, count in part['tags'].items():
+            merged['tags'][name] = merged['tags'].get(name, 0) + count
+    merged['tags'] = dict(sorted(merged['tags'].items()))
+    return merged
+
+class JobCancelled(Exception):
+    """Job bị huỷ từ bên ngoài (cancel được set), pipeline dừng ở ranh giới giữa hai bước."""
+
+def check_cancelled(cancel, step=None):
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled(f"Job bị huỷ sau bước {step}" if step else "Job bị huỷ trước khi xử lý")
+
+def _stopwatch(steps, cancel=None):
+    """Hàm lap(name, final=False): ghi số giây kể từ lần lap trước (hoặc lúc tạo) vào
+    steps[name], rồi (trừ bước cuối) raise JobCancelled nếu cancel đã được set."""
+    last = [time.perf_counter()]
+
+    def lap(name, final=False):
+        now = time.perf_counter()
+        steps[name] = round(now - last[0], 4)
+        last[0] = now
+        if not final:
+            check_cancelled(cancel, name)
+    return lap
+
+def process_document_xml(xml_path, workers=1, report=None, cancel=None, limits=DEFAULT_LIMITS):
+    """
+    Chạy toàn bộ pipeline trên document.xml (ghi đè file).
+    workers > 1: chia body thành các đoạn và xử lý song song (xem process_document_xml_parallel);
+    nếu body không chia được thì xử lý tuần tự như bình thường.
+    report: dict (tuỳ chọn) được điền số liệu của lần chạy: số đoạn/bảng/hàng, số tag,
+    số thay đổi ở từng bước ('removed') và thời gian từng bước tính bằng giây ('steps').
+    cancel: object có is_set() (vd threading.Event), được kiểm tra sau mỗi bước; khi đã set
+    thì raise JobCancelled và không ghi file.
+    limits: DocxLimits; document.xml quá nhiều element hoặc lồng quá sâu bị từ chối
+    (DocumentLimitExceeded) trước khi dựng DOM.
+    """
+    if report is None:
+        report = {}
+    check_cancelled(cancel)
+    if workers > 1 and process_document_xml_parallel(xml_path, workers, report, cancel, limits):
+        return
+
+    report.clear()
+    report['mode'] = 'sequential'
+    steps = report['steps'] = {}
+    lap = _stopwatch(steps, cancel)
+
     print("Bắt đầu xử lý document.xml")
     with open(xml_path, 'r', encoding='utf-8') as f:
         content = f.read()
 
-    dom = minidom.parseString(content)
+    check_xml_elements(content, limits)
+    dom = parse_document_xml(content, limits)
     body = dom.getElementsByTagName('w:body')[0]
+    # Chỉ mục element dùng chung cho mọi bước, được cập nhật khi các bước gỡ node
+    elements = ElementIndex(body)
+    report.update(document_census(body, elements))
+    lap('parse')
 
     # 0) Trang đầu nếu chỉ có "thẻ 1"
-    remove_first_page_if_the1(body)
+    remove_first_page_if_the1(body, PageLayout(body, elements))
+    lap('first_page')
 
     # *** BẮT ĐẦU THAY ĐỔI ***
     # 1) Xoá toàn bộ block [[BLOCK_START0]]...[[BLOCK_END]], bao gồm cả bảng
@@ -573,29 +998,32 @@ def process_document_xml(xml_path):
     iteration = 0
     while True:
         iteration += 1
-        removed_nodes_block = remove_nodes_between_tags(body, 'BLOCK_START', 'BLOCK_END', '0')
+        removed_nodes_block = remove_nodes_between_tags(body, 'BLOCK_START', 'BLOCK_END', '0', elements)
         total_removed_block += removed_nodes_block
         print(f"  [Lần {iteration}] Xử lý {removed_nodes_block} thay đổi")
         if removed_nodes_block == 0:
             break
     print(f"  Tổng cộng đã xoá/xử lý {total_removed_block} nodes/cặp")
+    lap('blocks')
 
     # 2) SECTION_START0..SECTION_END (hiện cũng xoá bao gồm cả bảng)
     # Lặp lại cho đến khi không còn cặp nào
     print("\nBước 2: Xử lý SECTION_START0..SECTION_END (bao gồm cả bảng)")
     total_removed_section = 0
     while True:
-        removed_nodes_section = remove_nodes_between_tags(body, 'SECTION_START', 'SECTION_END', '0')
+        removed_nodes_section = remove_nodes_between_tags(body, 'SECTION_START', 'SECTION_END', '0', elements)
         total_removed_section += removed_nodes_section
         if removed_nodes_section == 0:
             break
     print(f"  Đã xoá {total_removed_section} nodes (đoạn, bảng) ở giữa các SECTION tag")
+    lap('sections')
     # *** KẾT THÚC THAY ĐỔI ***
 
     # 3) Xoá hoàn toàn hàng [[ROW0]]
     print("\nBước 3: Xoá hoàn toàn các hàng có [[ROW0]]")
-    rows_removed_0 = remove_rows_with_tag(body, '0')
+    rows_removed_0 = remove_rows_with_tag(body, '0', RowIndex(body, elements))
     print(f"  Đã xoá {rows_removed_0} hàng ROW0")
+    lap('rows')
 
     # 4) Xoá tag [[ROW1]] (giữ nội dung)
     print("\nBước 4: Xoá tag [[ROW1]] (giữ nội dung)")
@@ -603,45 +1031,579 @@ def process_document_xml(xml_path):
 
     # 5) Gỡ tag còn lại (gồm cả [[ROW1]] etc.): replace tại w:t
     print("\nBước 5: Gỡ các tag còn lại")
-    tags_changed = remove_all_remaining_tags(body)
+    tags_changed = remove_all_remaining_tags(body, elements)
     print(f"  Đã sửa {tags_changed} text nodes có tag")
+    lap('tags')
+
+    # Các bước 1-5 đã sửa text nên dựng lại mô hình trang một lần cho bước 6 và 7
+    layout = PageLayout(body, elements)
 
     # 6) Xoá trang trắng
     print("\nBước 6: Xoá các trang trắng")
-    pages_removed = remove_blank_pages(body)
+    pages_removed = remove_blank_pages(body, layout)
     print(f"  Đã xoá {pages_removed} trang trắng")
+    lap('blank_pages')
 
     # 7) Dọn dẹp các đoạn văn trống
     print("\nBước 7: Dọn dẹp các đoạn văn trống")
-    empty_paras_removed = remove_all_empty_paragraphs(body)
+    empty_paras_removed = remove_all_empty_paragraphs(body, layout)
     print(f"  Đã xoá {empty_paras_removed} đoạn văn trống")
+    lap('empty_paragraphs')
 
     # 8) Lưu lại
     print("\nBước 8: Lưu document.xml")
     with open(xml_path, 'w', encoding='utf-8') as f:
         f.write(dom.toxml())
+    lap('serialize', final=True)
+    report['removed'] = {
+        'blocks': total_removed_block, 'sections': total_removed_section, 'rows': rows_removed_0,
+        'tags': tags_changed, 'blank_pages': pages_removed, 'empty_paragraphs': empty_paras_removed,
+    }
     print("Hoàn thành xử lý document.xml")
 
 # ------------------------------
-# CLI
+# Parallel chunked processing
 # ------------------------------
+#
+# Body được cắt (trên bytes gốc, không dựng DOM) thành các đoạn liên tiếp, mỗi đoạn kết thúc
+# ngay sau một đoạn văn ngắt trang/sectPr cấp body. Mỗi đoạn được parse và giữ trong một
+# process con riêng; process cha điều phối từng bước theo đúng thứ tự tuần tự:
+# - bước 0 chỉ chạy ở đoạn đầu (trang đầu phải nằm trọn trong đoạn đó);
+# - bước 1, 2: mỗi lượt đi qua các đoạn theo thứ tự, mang trạng thái in_block từ đoạn trước
+#   sang đoạn sau; lặp lại khi tổng số thay đổi của lượt còn khác 0;
+# - bước 3, 5, 7 độc lập giữa các đoạn nên chạy song song;
+# - bước 6 cần biết phân loại của node đứng sau đoạn, lấy từ leading_kind() của các đoạn sau.
+# Kết quả ghép lại theo thứ tự giống hệt khi xử lý tuần tự.
+
+class _Unsplittable(Exception):
+    pass
+
+def _start_tag_end(raw, start):
+    """Vị trí ngay sau '>' của start tag bắt đầu tại start (bỏ qua '>' trong giá trị thuộc tính)."""
+    quote = None
+    for i in range(start, len(raw)):
+        c = raw[i]
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in (0x22, 0x27):  # " '
+            quote = c
+        elif c == 0x3e:  # >
+            return i + 1
+    raise _Unsplittable()
+
+def split_body_xml(raw, parts):
+    """
+    Chia nội dung w:body của document.xml (bytes) thành tối đa `parts` đoạn có kích thước
+    gần bằng nhau, chỉ cắt ngay sau một w:p cấp body có ngắt trang hoặc sectPr.
+    Trả về dict gồm:
+      - skeleton: document.xml với body rỗng (để ghép kết quả)
+      - wrapper: (mở, đóng) để bọc một đoạn thành document.xml hợp lệ
+      - chunks: list bytes của từng đoạn
+    hoặc None nếu không chia được (ít hơn 2 đoạn, có DOCTYPE, ...).
+    """
+    parser = expat.ParserCreate()
+    state = {
+        'depth': 0, 'root': None, 'body_depth': None, 'body_start': None, 'body_end': None,
+        'top_p': False, 'top_break': False, 'ppr': 0, 'cut_pending': False,
+    }
+    candidates = []
+
+    def start(name, attrs):
+        state['depth'] += 1
+        depth = state['depth']
+        if depth == 1:
+            state['root'] = (name, parser.CurrentByteIndex)
+            return
+        body_depth = state['body_depth']
+        if body_depth is None:
+            if name == 'w:body':
+                state['body_depth'] = depth
+                state['body_start'] = parser.CurrentByteIndex
+            return
+        if state['body_end'] is not None:
+            return
+        if depth == body_depth + 1:
+            if state['cut_pending']:
+                candidates.append(parser.CurrentByteIndex)
+                state['cut_pending'] = False
+            state['top_p'] = name == 'w:p'
+            state['top_break'] = False
+            state['ppr'] = 0
+        elif state['top_p']:
+            if name == 'w:br' and attrs.get('w:type') == 'page':
+                state['top_break'] = True
+            elif name == 'w:pPr':
+                state['ppr'] += 1
+            elif name == 'w:sectPr' and state['ppr']:
+                state['top_break'] = True
+
+    def end(name):
+        depth = state['depth']
+        body_depth = state['body_depth']
+        if body_depth is not None and state['body_end'] is None:
+            if depth == body_depth:
+                state['body_end'] = parser.CurrentByteIndex
+            elif depth == body_depth + 1:
+                state['cut_pending'] = state['top_p'] and state['top_break']
+                state['top_p'] = False
+            elif state['top_p'] and name == 'w:pPr':
+                state['ppr'] -= 1
+        state['depth'] -= 1
+
+    def forbid(*args):
+        raise _Unsplittable()
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.StartDoctypeDeclHandler = forbid
+    try:
+        parser.Parse(raw, True)
+        if state['body_depth'] != 2 or state['body_end'] is None:
+            return None
+        root_name, root_start = state['root']
+        root_open = raw[root_start:_start_tag_end(raw, root_start)]
+        inner_start = _start_tag_end(raw, state['body_start'])
+    except (expat.ExpatError, _Unsplittable):
+        return None
+    inner_end = state['body_end']
+    # <w:body/> rỗng: start tag kết thúc bằng '/>' và không có nội dung
+    if inner_end < inner_start:
+        return None
+
+    target = (inner_end - inner_start) / max(1, parts)
+    cuts = [inner_start]
+    for pos in candidates:
+        if len(cuts) >= parts:
+            break
+        if pos - cuts[-1] >= target:
+            cuts.append(pos)
+    if len(cuts) < 2:
+        return None
+    cuts.append(inner_end)
+
+    body_open = raw[state['body_start']:inner_start]
+    return {
+        'skeleton': raw[:inner_start] + raw[inner_end:],
+        'wrapper': (root_open + body_open, b'</w:body></' + root_name.encode('utf-8') + b'>'),
+        'chunks': [raw[a:b] for a, b in zip(cuts, cuts[1:])],
+    }
+
+class _ChunkSession:
+    """DOM của một đoạn body trong process con; mỗi method là một bước của pipeline."""
+
+    def load(self, xml_text, limits=DEFAULT_LIMITS):
+        self.dom = parse_document_xml(xml_text, limits)
+        self.body = self.dom.getElementsByTagName('w:body')[0]
+        self.elements = ElementIndex(self.body)
+        self.layout = None
+
+    def census(self):
+        return document_census(self.body, self.elements)
+
+    def first_page(self):
+        layout = PageLayout(self.body, self.elements)
+        if not layout.breaks:
+            # Trang đầu kéo dài sang đoạn sau, không xử lý riêng được
+            return False
+        remove_first_page_if_the1(self.body, layout)
+        return True
+
+    def between(self, start_pat, end_pat, in_block):
+        return _remove_nodes_between_patterns(self.body, start_pat, end_pat, in_block, self.elements)
+
+    def rows(self, label):
+        return remove_rows_with_tag(self.body, label, RowIndex(self.body, self.elements))
+
+    def tags(self):
+        return remove_all_remaining_tags(self.body, self.elements)
+
+    def page_layout(self):
+        self.layout = PageLayout(self.body, self.elements)
+        return self.layout.leading_kind()
+
+    def blank_pages(self, next_kind):
+        return remove_blank_pages(self.body, self.layout, next_kind)
+
+    def empty_paragraphs(self):
+        return remove_all_empty_paragraphs(self.body, self.layout)
+
+    def serialize(self):
+        return ''.join(node.toxml() for node in self.body.childNodes)
+
+def _chunk_worker(conn):
+    """Vòng lặp của process con: nhận (lệnh, *tham số), trả về (trạng thái, kết quả, stdout)."""
+    session = _ChunkSession()
+    while True:
+        command, *args = conn.recv()
+        if command == 'stop':
+            break
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                result = getattr(session, command)(*args)
+        except DocumentLimitExceeded as e:
+            conn.send(('limit', str(e), out.getvalue()))
+        except Exception:
+            conn.send(('error', traceback.format_exc(), out.getvalue()))
+        else:
+            conn.send(('ok', result, out.getvalue()))
+    conn.close()
+
+class _ChunkWorkers:
+    """Một process con cho mỗi đoạn; stdout của process con được in lại theo thứ tự đoạn."""
+
+    def __init__(self, count):
+        # spawn: an toàn khi process cha có nhiều thread (vd uvicorn + thread pool)
+        ctx = multiprocessing.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        try:
+            for _ in range(count):
+                parent_conn, child_conn = ctx.Pipe()
+                process = ctx.Process(target=_chunk_worker, args=(child_conn,), daemon=True)
+                process.start()
+                child_conn.close()
+                self.conns.append(parent_conn)
+                self.processes.append(process)
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.conns)
+
+    def _receive(self, i):
+        try:
+            status, result, output = self.conns[i].recv()
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"Process xử lý đoạn {i + 1} đã dừng đột ngột: {e!r}")
+        if output:
+            print(output, end='')
+        if status == 'limit':
+            raise DocumentLimitExceeded(result)
+        if status == 'error':
+            raise RuntimeError(f"Lỗi khi xử lý đoạn {i + 1}:\n{result}")
+        return result
+
+    def call(self, i, command, *args):
+        self.conns[i].send((command, *args))
+        return self._receive(i)
+
+    def broadcast(self, command, args_per_chunk=None):
+        """Gửi lệnh cho mọi đoạn cùng lúc rồi thu kết quả theo thứ tự đoạn."""
+        for i, conn in enumerate(self.conns):
+            args = args_per_chunk[i] if args_per_chunk is not None else ()
+            conn.send((command, *args))
+        return [self._receive(i) for i in range(len(self.conns))]
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self.conns:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _carry_blocks(workers, start_tag_type, end_tag_type, label):
+    """Một lượt xoá block qua mọi đoạn theo thứ tự, mang in_block sang đoạn kế tiếp."""
+    patterns = _block_patterns(start_tag_type, end_tag_type, label)
+    if patterns is None:
+        return 0
+    total = 0
+    in_block = False
+    for i in range(len(workers)):
+        changes, in_block = workers.call(i, 'between', *patterns, in_block)
+        total += changes
+    return total
+
+# Chia đoạn tốn thêm khoảng 50% CPU so với chạy tuần tự (lượt expat để tìm điểm cắt, khởi động
+# process con, pickle từng đoạn, ghép kết quả) và phần tuần tự (tìm điểm cắt, xoá block mang
+# trạng thái qua các đoạn, ghép) không song song được. Đo trên sample nhân bản: 7 MB (15x
+# sample) chỉ nhanh hơn tối đa ~1.4x với 4 core rảnh và chậm hơn tuần tự khi core không rảnh
+# hẳn; từ ~14 MB mới nhanh hơn ~2x. Với 2 process lợi ích tối đa ~1.3x nên không đáng chia.
+PARALLEL_MIN_BYTES = 16 * 1024 * 1024
+PARALLEL_MIN_WORKERS = 3
+
+def parallel_workers(xml_path, workers, min_bytes=PARALLEL_MIN_BYTES):
+    """Số process nên dùng cho xml_path khi có sẵn tối đa `workers` process: 1 (tuần tự) nếu
+    file nhỏ hơn min_bytes hoặc ít hơn PARALLEL_MIN_WORKERS process."""
+    if workers < PARALLEL_MIN_WORKERS or os.path.getsize(xml_path) < min_bytes:
+        return 1
+    return workers
+
+def process_document_xml_parallel(xml_path, workers, report=None, cancel=None, limits=DEFAULT_LIMITS):
+    """
+    Xử lý document.xml bằng tối đa `workers` process con, mỗi process giữ một đoạn body.
+    Kết quả giống hệt process_document_xml tuần tự. Trả về False (không sửa file) nếu
+    body không chia được thành ít nhất 2 đoạn, khi đó nên xử lý tuần tự.
+    report, cancel, limits: như ở process_document_xml; huỷ giữa chừng thì các process con được dừng.
+    """
+    if report is None:
+        report = {}
+    steps = {}
+    lap = _stopwatch(steps, cancel)
+    with open(xml_path, 'rb') as f:
+        raw = f.read()
+    check_xml_elements(raw, limits)
+    plan = split_body_xml(raw, workers)
+    if plan is None:
+        return False
 
-def main():
-    if len(sys.argv) != 3:
-        print("Cách sử dụng: python process_docx.py <input.docx> <output.docx>")
-        print("Ví dụ: python process_docx.py TEST.docx TEST_processed.docx")
-        sys.exit(1)
+    chunks = plan['chunks']
+    wrap_open, wrap_close = plan['wrapper']
+    print(f"Bắt đầu xử lý document.xml (song song {len(chunks)} đoạn)")
+    with _ChunkWorkers(len(chunks)) as pool:
+        pool.broadcast('load', [((wrap_open + chunk + wrap_close).decode('utf-8'), limits) for chunk in chunks])
+        census = _merge_census(pool.broadcast('census'))
+        lap('parse')
+
+        # 0) Trang đầu nếu chỉ có "thẻ 1"
+        if not pool.call(0, 'first_page'):
+            print("  Trang đầu vượt quá đoạn thứ nhất, chuyển sang xử lý tuần tự")
+            return False
+        lap('first_page')
+
+        # 1) BLOCK_START0..BLOCK_END
+        print("\nBước 1: Xử lý BLOCK_START0..BLOCK_END (bao gồm cả bảng)")
+        total_removed_block = 0
+        iteration = 0
+        while True:
+            iteration += 1
+            removed_nodes_block = _carry_blocks(pool, 'BLOCK_START', 'BLOCK_END', '0')
+            total_removed_block += removed_nodes_block
+            print(f"  [Lần {iteration}] Xử lý {removed_nodes_block} thay đổi")
+            if removed_nodes_block == 0:
+                break
+        print(f"  Tổng cộng đã xoá/xử lý {total_removed_block} nodes/cặp")
+        lap('blocks')
+
+        # 2) SECTION_START0..SECTION_END
+        print("\nBước 2: Xử lý SECTION_START0..SECTION_END (bao gồm cả bảng)")
+        total_removed_section = 0
+        while True:
+            removed_nodes_section = _carry_blocks(pool, 'SECTION_START', 'SECTION_END', '0')
+            total_removed_section += removed_nodes_section
+            if removed_nodes_section == 0:
+                break
+        print(f"  Đã xoá {total_removed_section} nodes (đoạn, bảng) ở giữa các SECTION tag")
+        lap('sections')
+
+        # 3) Xoá hoàn toàn hàng [[ROW0]]
+        print("\nBước 3: Xoá hoàn toàn các hàng có [[ROW0]]")
+        rows_removed_0 = sum(pool.broadcast('rows', [('0',)] * len(pool)))
+        print(f"  Đã xoá {rows_removed_0} hàng ROW0")
+        lap('rows')
+
+        # 4) [[ROW1]] được gỡ ở bước 5
+        print("\nBước 4: Xoá tag [[ROW1]] (giữ nội dung)")
+
+        # 5) Gỡ tag còn lại
+        print("\nBước 5: Gỡ các tag còn lại")
+        tags_changed = sum(pool.broadcast('tags'))
+        print(f"  Đã sửa {tags_changed} text nodes có tag")
+        lap('tags')
+
+        # 6) Xoá trang trắng: node sau đoạn i là node đầu (khác 'empty_p') của các đoạn sau
+        print("\nBước 6: Xoá các trang trắng")
+        leading = pool.broadcast('page_layout')
+        next_kinds = []
+        next_kind = None
+        for kind in reversed(leading):
+            next_kinds.append((next_kind,))
+            if kind is not None:
+                next_kind = kind
+        next_kinds.reverse()
+        pages_removed = sum(pool.broadcast('blank_pages', next_kinds))
+        print(f"  Đã xoá {pages_removed} trang trắng")
+        lap('blank_pages')
+
+        # 7) Dọn dẹp các đoạn văn trống
+        print("\nBước 7: Dọn dẹp các đoạn văn trống")
+        empty_paras_removed = sum(pool.broadcast('empty_paragraphs'))
+        print(f"  Đã xoá {empty_paras_removed} đoạn văn trống")
+        lap('empty_paragraphs')
+
+        # 8) Ghép các đoạn vào khung document (body rỗng) rồi lưu
+        print("\nBước 8: Lưu document.xml")
+        parts = pool.broadcast('serialize')
+
+    skeleton = minidom.parseString(plan['skeleton'].decode('utf-8'))
+    marker = uuid.uuid4().hex
+    skeleton.getElementsByTagName('w:body')[0].appendChild(skeleton.createComment(marker))
+    head, tail = skeleton.toxml().split(f'<!--{marker}-->')
+    with open(xml_path, 'w', encoding='utf-8') as f:
+        f.write(head)
+        for part in parts:
+            f.write(part)
+        f.write(tail)
+    lap('serialize', final=True)
+    report.clear()
+    report.update(census, mode='parallel', chunks=len(chunks), steps=steps, removed={
+        'blocks': total_removed_block, 'sections': total_removed_section, 'rows': rows_removed_0,
+        'tags': tags_changed, 'blank_pages': pages_removed, 'empty_paragraphs': empty_paras_removed,
+    })
+    print("Hoàn thành xử lý document.xml")
+    return True
 
-    input_docx = sys.argv[1]
-    output_docx = sys.argv[2]
+# ------------------------------
+# Dry-run analysis
+# ------------------------------
 
-    if not os.path.exists(input_docx):
-        print(f"Lỗi: Không tìm thấy file {input_docx}")
-        sys.exit(1)
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_INVENTORY_TAG_RE = re.compile(r'\[\[(BLOCK_START\d+|BLOCK_END|SECTION_START\d+|SECTION_END|ROW\d+|ROW_END)\]\]')
 
-    print(f"Đang xử lý file: {input_docx}")
-    temp_dir = tempfile.mkdtemp()
+def analyze_document_xml(source, limits=DEFAULT_LIMITS):
+    """
+    Thống kê tag trong document.xml mà không dựng DOM và không sửa gì:
+    đọc streaming (iterparse), ghép text theo từng w:p (bắt được cả tag bị tách run).
+    source: đường dẫn hoặc file-like object.
+    limits: độ sâu lồng nhau và số element tối đa (vượt -> DocumentLimitExceeded).
+    Trả về dict: số lượng từng tag, trạng thái cân bằng BLOCK/SECTION,
+    có trang bìa 'thẻ 1' hay không, số đoạn/bảng/hàng.
+    """
+    tags = {}
+    pairs = {
+        'BLOCK': {'starts': 0, 'ends': 0, 'unclosed': 0, 'unmatched_ends': 0},
+        'SECTION': {'starts': 0, 'ends': 0, 'unclosed': 0, 'unmatched_ends': 0},
+    }
+    counts = {'paragraphs': 0, 'tables': 0, 'rows': 0}
+
+    p_texts = []           # stack text của các w:p đang mở (tag được tính cho w:p trong cùng)
+    depth = 0
+    body_depth = None
+    first_page = []        # text các w:p/w:tbl cấp body thuộc trang đầu
+    first_page_done = False
+    top_text = []          # text của node cấp body hiện tại
+    top_break = False
+    in_ppr = 0
+    elements = 0
+
+    for event, elem in SafeET.iterparse(source, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            depth += 1
+            elements += 1
+            if depth > limits.max_xml_depth:
+                raise DocumentLimitExceeded(f"document.xml lồng nhau sâu hơn {limits.max_xml_depth} cấp")
+            if elements > limits.max_xml_elements:
+                raise DocumentLimitExceeded(
+                    f"document.xml có hơn {limits.max_xml_elements} element, vượt giới hạn"
+                )
+            if tag == W_NS + 'body':
+                body_depth = depth
+            elif body_depth is not None and depth == body_depth + 1:
+                top_text = []
+                top_break = False
+            if tag == W_NS + 'p':
+                p_texts.append([])
+            elif tag == W_NS + 'pPr':
+                in_ppr += 1
+            continue
+
+        # event == 'end'
+        if tag == W_NS + 't':
+            text = elem.text or ''
+            if p_texts:
+                p_texts[-1].append(text)
+            top_text.append(text)
+        elif tag == W_NS + 'br':
+            if elem.get(W_NS + 'type') == 'page':
+                top_break = True
+        elif tag == W_NS + 'sectPr':
+            if in_ppr:
+                top_break = True
+        elif tag == W_NS + 'pPr':
+            in_ppr -= 1
+        elif tag == W_NS + 'tbl':
+            counts['tables'] += 1
+        elif tag == W_NS + 'tr':
+            counts['rows'] += 1
+        elif tag == W_NS + 'p':
+            counts['paragraphs'] += 1
+            text = ''.join(p_texts.pop())
+            if '[[' in text:
+                for m in _INVENTORY_TAG_RE.finditer(text):
+                    name = m.group(1)
+                    tags[name] = tags.get(name, 0) + 1
+                    kind = 'BLOCK' if name.startswith('BLOCK') else 'SECTION' if name.startswith('SECTION') else None
+                    if kind is None:
+                        continue
+                    state = pairs[kind]
+                    if name.endswith('_END'):
+                        state['ends'] += 1
+                        if state['unclosed']:
+                            state['unclosed'] -= 1
+                        else:
+                            state['unmatched_ends'] += 1
+                    else:
+                        state['starts'] += 1
+                        state['unclosed'] += 1
+
+        if body_depth is not None and depth == body_depth + 1:
+            # Hết một node cấp body: cập nhật trang đầu rồi giải phóng bộ nhớ
+            if not first_page_done and tag in (W_NS + 'p', W_NS + 'tbl'):
+                first_page.append(''.join(top_text))
+                if tag == W_NS + 'p' and top_break:
+                    first_page_done = True
+            elem.clear()
+        depth -= 1
+
+    return {
+        'tags': dict(sorted(tags.items())),
+        'pairs': pairs,
+        'unbalanced': [k for k, v in pairs.items() if v['unclosed'] or v['unmatched_ends']],
+        'cover_page_the1': ''.join(first_page).strip().lower() == 'thẻ 1',
+        **counts,
+    }
+
+def analyze_docx(docx_path, limits=DEFAULT_LIMITS):
+    """analyze_document_xml cho word/document.xml đọc thẳng từ file docx (không giải nén ra đĩa),
+    trong giới hạn kích thước/tỉ lệ nén của limits."""
+    with zipfile.ZipFile(docx_path, 'r') as zf:
+        with open_member(zf, 'word/document.xml', limits) as f:
+            try:
+                return analyze_document_xml(f, limits)
+            except DefusedXmlException as e:
+                # DTD/entity bị defusedxml chặn: từ chối như ở pipeline xử lý (check_xml_depth)
+                raise DocumentLimitExceeded(f"document.xml dùng cấu trúc XML bị cấm ({type(e).__name__})")
 
+# ------------------------------
+# Profiling
+# ------------------------------
+
+# Các hàm được tổng hợp thời gian (inclusive) trong kết quả profile
+PROFILE_FUNCTIONS = (
+    'unpack_docx', 'parse_document_xml', 'remove_first_page_if_the1', 'remove_nodes_between_tags',
+    'remove_rows_with_tag', 'remove_all_remaining_tags', '_apply_kept_ranges_to_text_nodes',
+    'remove_blank_pages', 'remove_all_empty_paragraphs', 'toxml', 'pack_docx',
+)
+
+def write_profile(profiler, path, name):
+    """Ghi profile ra path: *.json -> speedscope, còn lại -> collapsed stacks."""
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            json.dump(profiling.to_speedscope(profiler, name), f)
+        else:
+            f.write(profiling.to_collapsed(profiler))
+
+# ------------------------------
+# CLI
+# ------------------------------
+
+def process_docx(input_docx, output_docx, workers=1):
+    temp_dir = tempfile.mkdtemp()
     try:
         print("Đang giải nén file docx...")
         unpack_docx(input_docx, temp_dir)
@@ -651,7 +1613,11 @@ def main():
             print("Lỗi: Không tìm thấy word/document.xml trong file docx")
             sys.exit(1)
 
-        process_document_xml(doc_xml_path)
+        chunk_workers = parallel_workers(doc_xml_path, workers)
+        if chunk_workers < workers:
+            print(f"document.xml nhỏ hơn {PARALLEL_MIN_BYTES // (1024 * 1024)} MB hoặc ít hơn "
+                  f"{PARALLEL_MIN_WORKERS} process: xử lý tuần tự")
+        process_document_xml(doc_xml_path, chunk_workers)
 
         print(f"\nĐang tạo file output: {output_docx}")
         pack_docx(temp_dir, output_docx)
@@ -660,5 +1626,51 @@ def main():
     finally:
         shutil.rmtree(temp_dir)
 
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--analyze':
+        if not os.path.exists(sys.argv[2]):
+            print(f"Lỗi: Không tìm thấy file {sys.argv[2]}")
+            sys.exit(1)
+        print(json.dumps(analyze_docx(sys.argv[2]), ensure_ascii=False, indent=2))
+        return
+
+    args = sys.argv[1:]
+    workers = 1
+    profile_path = None
+    while len(args) > 2 and args[0] in ('--workers', '--profile'):
+        if args[0] == '--workers' and args[1].isdigit():
+            workers = int(args[1])
+        elif args[0] == '--profile':
+            profile_path = args[1]
+        else:
+            break
+        args = args[2:]
+
+    if len(args) != 2:
+        print("Cách sử dụng: python process_docx.py [--workers N] [--profile <out.json|out.folded>] <input.docx> <output.docx>")
+        print("       python process_docx.py --analyze <input.docx>")
+        print("Ví dụ: python process_docx.py TEST.docx TEST_processed.docx")
+        print("       --profile: xử lý tuần tự dưới profiler, ghi speedscope JSON (*.json) hoặc collapsed stacks")
+        sys.exit(1)
+
+    input_docx, output_docx = args
+
+    if not os.path.exists(input_docx):
+        print(f"Lỗi: Không tìm thấy file {input_docx}")
+        sys.exit(1)
+
+    print(f"Đang xử lý file: {input_docx}")
+    if profile_path is None:
+        process_docx(input_docx, output_docx, workers)
+        return
+
+    # Process con không được profile: chạy tuần tự
+    profiler = profiling.StackProfiler()
+    profiler.run(process_docx, input_docx, output_docx)
+    write_profile(profiler, profile_path, os.path.basename(input_docx))
+    print(f"\nProfile ({profiler.total_ns / 1e9:.2f}s) đã được ghi vào: {profile_path}")
+    for name, seconds in profiling.function_totals(profiler, PROFILE_FUNCTIONS).items():
+        print(f"  {name}: {seconds}s")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Profile một lần xử lý để tìm lý do một tài liệu cụ thể chạy chậm:
+- profiler tất định dựa trên sys.setprofile: ghi lại cây lời gọi đầy đủ (cả hàm C/builtin)
+  của thread đang chạy, thời gian tự thân (self time) của mỗi node theo nano giây;
+- xuất ra dạng collapsed stacks ("a;b;c <micro giây>", dùng cho flamegraph.pl, speedscope,
+  ...) hoặc file JSON của speedscope (https://www.speedscope.app);
+- chỉ profile thread gọi StackProfiler.run (job phải chạy tuần tự, không chia process con).
+Profiler làm job chậm đi vài lần, tỉ lệ giữa các hàm vẫn dùng được để so sánh.
+"""
+
+import os
+import sys
+import time
+
+_perf_ns = time.perf_counter_ns
+
+
+class _Node:
+    __slots__ = ("key", "parent", "children", "self_ns")
+
+    def __init__(self, key, parent):
+        self.key = key
+        self.parent = parent
+        self.children = {}
+        self.self_ns = 0
+
+
+def _frame_label(key):
+    if isinstance(key, str):
+        return key, None, None
+    filename, lineno, name = key.co_filename, key.co_firstlineno, key.co_qualname
+    return f"{name} ({os.path.basename(filename)}:{lineno})", filename, lineno
+
+
+class StackProfiler:
+    """Cây lời gọi của một thread với thời gian tự thân của từng stack."""
+
+    def __init__(self):
+        self.root = _Node("<root>", None)
+        self._node = self.root
+        self._last = 0
+        self.total_ns = 0
+
+    def _callback(self, frame, event, arg):
+        now = _perf_ns()
+        node = self._node
+        node.self_ns += now - self._last
+        if event == "call":
+            key = frame.f_code
+        elif event == "c_call":
+            key = f"<{getattr(arg, '__qualname__', None) or repr(arg)}>"
+        else:
+            # return / c_return / c_exception; bỏ qua lần trả về khỏi frame đã bật profiler
+            if node.parent is not None:
+                self._node = node.parent
+            self._last = _perf_ns()
+            return
+        child = node.children.get(key)
+        if child is None:
+            child = node.children[key] = _Node(key, node)
+        self._node = child
+        self._last = _perf_ns()
+
+    def run(self, func, *args, **kwargs):
+        """Chạy func(*args, **kwargs) dưới profiler, trả về kết quả của func."""
+        previous = sys.getprofile()
+        started = _perf_ns()
+        self._last = started
+        sys.setprofile(self._callback)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(previous)
+            self.total_ns += _perf_ns() - started
+
+    def stacks(self):
+        """(danh sách node từ ngoài vào trong, self ns) của mọi stack có thời gian tự thân."""
+        result = []
+        pending = [(child, (child,)) for child in self.root.children.values()]
+        while pending:
+            node, path = pending.pop()
+            if node.self_ns:
+                result.append((path, node.self_ns))
+            pending.extend((child, path + (child,)) for child in node.children.values())
+        return result
+
+
+def to_collapsed(profiler):
+    """Collapsed stacks: mỗi dòng 'frame;frame;... <self time micro giây>'."""
+    totals = {}
+    for path, self_ns in profiler.stacks():
+        line = ";".join(_frame_label(node.key)[0].replace(";", ":") for node in path)
+        totals[line] = totals.get(line, 0) + self_ns
+    return "".join(f"{line} {ns // 1000}\n" for line, ns in sorted(totals.items()) if ns >= 1000)
+
+
+def to_speedscope(profiler, name):
+    """File JSON speedscope (profile dạng 'sampled', weight là self time micro giây)."""
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    for path, self_ns in profiler.stacks():
+        sample = []
+        for node in path:
+            index = frame_index.get(node.key)
+            if index is None:
+                label, filename, lineno = _frame_label(node.key)
+                frame = {"name": label}
+                if filename is not None:
+                    frame.update(file=filename, line=lineno)
+                index = frame_index[node.key] = len(frames)
+                frames.append(frame)
+            sample.append(index)
+        samples.append(sample)
+        weights.append(self_ns / 1000)
+    total = sum(weights)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "docx_processor",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "microseconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def function_totals(profiler, names):
+    """Thời gian bao gồm (inclusive, giây) của các hàm Python có tên trong names; lời gọi đệ quy
+    chỉ tính một lần."""
+    totals = dict.fromkeys(names, 0)
+    for path, self_ns in profiler.stacks():
+        seen = set()
+        for node in path:
+            name = getattr(node.key, "co_name", None)
+            if name in totals and name not in seen:
+                seen.add(name)
+                totals[name] += self_ns
+    return {name: round(ns / 1e9, 4) for name, ns in totals.items()}
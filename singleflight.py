@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Gộp các job trùng nội dung đang chạy (single-flight), trong một worker và giữa các worker:
+- khoá theo sha256 của file input;
+- trong cùng process: request đến sau chờ Future của job đang chạy;
+- giữa các process: mỗi khoá có một file lock `<hash>.lock` (flock). Process giữ lock là
+  process đang xử lý; process khác để lại file đánh dấu `<hash>.<pid>_<x>.wait` trong lúc
+  chờ lock và khi lấy được thì dùng luôn file kết quả `<hash>.docx`, không xử lý lại;
+- job ghi kết quả thẳng vào output của request (workspace / OUTPUT_DIR), chỉ công bố sang
+  thư mục dùng chung (hardlink nếu cùng filesystem, không thì chép) khi có request khác đang
+  chờ đúng khoá đó;
+- chỉ dùng chung kết quả với job đang chạy: request đến khi không còn job nào giữ lock sẽ
+  tự xử lý. File kết quả công bố bị xoá sau result_ttl giây (purge() chạy theo chu kỳ).
+"""
+
+import os
+import time
+import uuid
+import errno
+import fcntl
+import shutil
+import asyncio
+import hashlib
+import logging
+
+logger = logging.getLogger("docx_processor")
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_key(path):
+    """sha256 (hex) của nội dung file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    """Tạo target cùng nội dung với source: hardlink nếu được (cùng filesystem), không thì chép."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _pid_of_marker(name):
+    try:
+        return int(name.rsplit(".", 2)[-2].split("_", 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SingleFlight:
+    """Chạy compute(output) một lần cho mỗi khoá đang bận; các lời gọi trùng nhận chung kết quả."""
+
+    def __init__(self, directory, result_ttl=30, poll_interval=0.05):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._inflight = {}  # khoá -> Future(đường dẫn kết quả công bố) của job đang chạy trong process này
+        self._waiting = {}   # khoá -> số lời gọi trong process này đang chờ job đó
+        self._purged_at = 0.0
+        self.computed_total = 0
+        self.shared_local_total = 0
+        self.shared_remote_total = 0
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _try_lock(self, fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise
+        return True
+
+    async def _lock(self, key):
+        """Giữ lock của khoá; trả về (fd, waited) với waited=True nếu phải chờ process khác.
+        Trong lúc chờ có file đánh dấu .wait để process đang xử lý biết cần công bố kết quả."""
+        fd = os.open(self._path(key, ".lock"), os.O_RDWR | os.O_CREAT, 0o666)
+        waited = False
+        marker = None
+        try:
+            while not self._try_lock(fd):
+                if marker is None:
+                    marker = self._path(key, f".{os.getpid()}_{uuid.uuid4().hex[:8]}.wait")
+                    open(marker, "w").close()
+                waited = True
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            os.close(fd)
+            raise
+        finally:
+            if marker is not None:
+                try:
+                    os.remove(marker)
+                except FileNotFoundError:
+                    pass
+        return fd, waited
+
+    def _has_remote_waiters(self, key):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return False
+        return any(name.startswith(key + ".") and name.endswith(".wait") for name in names)
+
+    def _publish(self, output, result_path):
+        target = result_path + f".{os.getpid()}_{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            link_or_copy(output, target)
+            os.replace(target, result_path)
+        finally:
+            if os.path.exists(target):
+                os.remove(target)
+
+    def purge(self):
+        """Xoá file kết quả/file tạm quá result_ttl và file .wait của process đã chết
+        (tối đa mỗi result_ttl/2 giây một lần)."""
+        now = time.time()
+        if now - self._purged_at < self.result_ttl / 2:
+            return
+        self._purged_at = now
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".lock"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".wait"):
+                    pid = _pid_of_marker(name)
+                    if pid is not None and not _pid_alive(pid):
+                        os.remove(path)
+                elif now - os.stat(path).st_mtime > self.result_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def run(self, key, compute, output):
+        """
+        Tạo file kết quả cho khoá key tại output (đường dẫn). compute(output) là coroutine tạo
+        file kết quả, chỉ được gọi khi không có job trùng khoá nào đang chạy; lời gọi trùng
+        nhận bản hardlink/chép của kết quả. Trả về True nếu đã tự xử lý, False nếu dùng chung.
+        """
+        while key in self._inflight:
+            future = self._inflight[key]
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            try:
+                result_path = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue  # job đang chạy bị huỷ (client ngắt kết nối): thử lại từ đầu
+                raise
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+            if result_path is None:
+                continue
+            await asyncio.to_thread(link_or_copy, result_path, output)
+            self.shared_local_total += 1
+            logger.info(f"Dùng chung kết quả của job trùng nội dung đang chạy ({key[:12]})")
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        published = None
+        try:
+            self.purge()
+            result_path = self._path(key, ".docx")
+            fd, waited = await self._lock(key)
+            try:
+                if waited and os.path.exists(result_path):
+                    await asyncio.to_thread(link_or_copy, result_path, output)
+                    published = result_path
+                    computed = False
+                    self.shared_remote_total += 1
+                    logger.info(f"Dùng chung kết quả của job trùng nội dung ở worker khác ({key[:12]})")
+                else:
+                    await compute(output)
+                    computed = True
+                    self.computed_total += 1
+                    # Không có await giữa lúc kiểm tra và set_result khi không công bố: lời gọi
+                    # trùng đến sau lúc này sẽ tự xử lý thay vì chờ kết quả không tồn tại
+                    if self._waiting.get(key) or self._has_remote_waiters(key):
+                        await asyncio.to_thread(self._publish, output, result_path)
+                        published = result_path
+            finally:
+                # Request đến sau sẽ tạo lock mới và tự xử lý; process đang chờ vẫn giữ file
+                # lock cũ, lấy được lock thì dùng kết quả (hoặc tự xử lý nếu job này lỗi)
+                try:
+                    os.remove(self._path(key, ".lock"))
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # tránh cảnh báo "exception was never retrieved" khi không ai chờ
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(published)
+        return computed
+
+    def stats(self):
+        return {
+            "computed_total": self.computed_total,
+            "shared_local_total": self.shared_local_total,
+            "shared_remote_total": self.shared_remote_total,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Trang tĩnh (index.html) giữ trong bộ nhớ:
+- đọc file một lần, chỉ đọc lại khi mtime/size thay đổi (kiểm tra tối đa mỗi check_interval giây);
+- nén sẵn gzip (và brotli nếu cài gói `brotli`) ngay khi nạp;
+- ETag mạnh cho từng biến thể, hỗ trợ If-None-Match -> 304 Not Modified.
+"""
+
+import os
+import gzip
+import time
+import hashlib
+import threading
+
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli là tuỳ chọn
+    brotli = None
+
+
+def _accepted_encodings(header):
+    """Tập content-coding client chấp nhận (q > 0) từ header Accept-Encoding."""
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(token)
+    return accepted
+
+
+class CachedPage:
+    """Phục vụ một file tĩnh từ bộ nhớ với ETag, Cache-Control và các biến thể nén sẵn."""
+
+    def __init__(self, path, media_type="text/html; charset=utf-8",
+                 cache_control="public, max-age=60", check_interval=2.0):
+        self.path = path
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._variants = {}  # encoding ('identity' | 'gzip' | 'br') -> (body, etag)
+
+    def _load(self, signature):
+        with open(self.path, "rb") as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {"identity": (body, f'"{digest}"')}
+        variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            variants["br"] = (brotli.compress(body), f'"{digest}-br"')
+        self._variants = variants
+        self._signature = signature
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._variants and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._variants and now - self._checked_at < self.check_interval:
+                return
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+            if signature != self._signature:
+                self._load(signature)
+            self._checked_at = now
+
+    def preload(self):
+        """Nạp trước khi nhận request (bỏ qua lỗi, sẽ thử lại ở request đầu tiên)."""
+        try:
+            self._refresh()
+        except OSError:
+            pass
+
+    def response(self, request):
+        self._refresh()
+        accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in self._variants and candidate in accepted:
+                encoding = candidate
+                break
+        body, etag = self._variants[encoding]
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {t.strip() for t in if_none_match.split(",")}
+            known = {tag for _, tag in self._variants.values()}
+            if "*" in tags or tags & known:
+                return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=headers)
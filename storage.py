@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Lưu trữ tạm (scratch) cho từng request.
+
+- Mỗi request có một workspace riêng (thư mục `req_<pid>_<ngẫu nhiên>`), không bao giờ
+  trùng giữa các request/worker, và bị xoá ngay khi request kết thúc (context manager).
+- Mặc định workspace nằm trên RAM (/dev/shm); nếu dữ liệu dự kiến lớn hơn ngưỡng
+  hoặc RAM không đủ chỗ thì dùng thư mục trên đĩa.
+- Khi khởi động, dọn các workspace còn sót lại của process đã chết.
+- RetentionSweeper dọn file kết quả không được download theo TTL và quota dung lượng; chỉ
+  xoá file có tên do unique_name sinh ra (không đụng file khác, vd file mẫu trong repo).
+"""
+
+import os
+import re
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+logger = logging.getLogger("docx_processor")
+
+WORKSPACE_PREFIX = "req_"
+
+# Tên do unique_name sinh ra
+_UNIQUE_NAME_RE = re.compile(r"[A-Za-z0-9]+_\d{8}_\d{6}_[0-9a-f]{8}(\.\w+)?")
+
+
+def unique_name(prefix, ext):
+    """Tên file không trùng: <prefix>_<YYYYmmdd_HHMMSS>_<8 hex><ext>."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}{ext}"
+
+
+def is_unique_name(name):
+    """name có dạng do unique_name sinh ra (file service tự tạo)."""
+    return _UNIQUE_NAME_RE.fullmatch(name) is not None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """Thư mục làm việc riêng của một request; xoá toàn bộ khi close()/ra khỏi khối with."""
+
+    def __init__(self, root, in_ram):
+        self.root = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{os.getpid()}_", dir=root)
+        self.in_ram = in_ram
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScratchStorage:
+    """Cấp phát workspace trên RAM (ram_dir) hoặc đĩa (disk_dir) theo kích thước dự kiến."""
+
+    # Dữ liệu giải nén của docx thường lớn hơn file nén vài lần
+    EXPANSION_FACTOR = 4
+
+    def __init__(self, ram_dir, disk_dir, ram_max_bytes):
+        self.disk_dir = disk_dir
+        self.ram_max_bytes = ram_max_bytes
+        os.makedirs(disk_dir, exist_ok=True)
+        self.ram_dir = None
+        if ram_dir:
+            try:
+                os.makedirs(ram_dir, exist_ok=True)
+                self.ram_dir = ram_dir
+            except OSError as e:
+                logger.warning(f"Không dùng được scratch trên RAM {ram_dir}: {e}")
+
+    def _fits_in_ram(self, expected_bytes):
+        if self.ram_dir is None or expected_bytes > self.ram_max_bytes:
+            return False
+        try:
+            free = shutil.disk_usage(self.ram_dir).free
+        except OSError:
+            return False
+        return free > expected_bytes * self.EXPANSION_FACTOR
+
+    def workspace(self, expected_bytes=0):
+        in_ram = self._fits_in_ram(expected_bytes)
+        if in_ram:
+            try:
+                return Workspace(self.ram_dir, True)
+            except OSError as e:
+                logger.warning(f"Không tạo được workspace trên RAM, dùng đĩa: {e}")
+        return Workspace(self.disk_dir, False)
+
+    def purge_stale(self):
+        """Xoá workspace của các process không còn sống (vd worker bị kill giữa chừng)."""
+        removed = 0
+        for base in filter(None, (self.ram_dir, self.disk_dir)):
+            try:
+                names = os.listdir(base)
+            except OSError:
+                continue
+            for name in names:
+                if not name.startswith(WORKSPACE_PREFIX):
+                    continue
+                try:
+                    pid = int(name[len(WORKSPACE_PREFIX):].split("_", 1)[0])
+                except ValueError:
+                    continue
+                if not _pid_alive(pid):
+                    shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+                    removed += 1
+        return removed
+
+
+class RetentionSweeper:
+    """
+    Dọn file kết quả/upload bị bỏ quên (client không bao giờ download):
+    - xoá file cũ hơn ttl_seconds;
+    - nếu tổng dung lượng các thư mục vượt max_bytes, xoá file cũ nhất trước đến khi đủ quota
+      (bỏ qua file mới hơn min_age_seconds vì có thể đang được ghi).
+    Chạy trong một thread nền nên không chặn xử lý request. Chỉ xét file có tên do
+    unique_name sinh ra: workspace `req_*` đang dùng và file khác trong thư mục (file mẫu
+    commit trong repo, ...) không bị đụng tới. hooks: các hàm gọi thêm sau mỗi lượt dọn
+    (vd SingleFlight.purge).
+    """
+
+    def __init__(self, directories, ttl_seconds, max_bytes, interval_seconds=60, min_age_seconds=30, hooks=()):
+        self.directories = list(directories)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.min_age_seconds = min_age_seconds
+        self.hooks = list(hooks)
+        self.evicted_ttl = 0
+        self.evicted_quota = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+        self.usage = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _list_files(self):
+        entries = []
+        for directory in self.directories:
+            try:
+                it = os.scandir(directory)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if not is_unique_name(entry.name):
+                        continue
+                    try:
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path, directory))
+        return entries
+
+    def _evict(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Đã bị xoá (download xong hoặc worker khác đã dọn)
+            return False
+        except OSError as e:
+            logger.warning(f"Không xoá được {path}: {e}")
+            return False
+        self.evicted_bytes += size
+        return True
+
+    def sweep(self):
+        """Một lượt dọn; trả về số file đã xoá."""
+        now = time.time()
+        entries = sorted(self._list_files())
+        kept = []
+        removed = 0
+        for mtime, size, path, directory in entries:
+            if now - mtime > self.ttl_seconds:
+                if self._evict(path, size):
+                    self.evicted_ttl += 1
+                    removed += 1
+                continue
+            kept.append((mtime, size, path, directory))
+
+        total = sum(size for _, size, _, _ in kept)
+        survivors = []
+        for mtime, size, path, directory in kept:
+            if total > self.max_bytes and now - mtime > self.min_age_seconds:
+                if self._evict(path, size):
+                    self.evicted_quota += 1
+                    removed += 1
+                    total -= size
+                    continue
+            survivors.append((size, directory))
+
+        usage = {d: {"bytes": 0, "files": 0} for d in self.directories}
+        for directory in self.directories:
+            try:
+                usage[directory]["fs_free_bytes"] = shutil.disk_usage(directory).free
+            except OSError:
+                pass
+        for size, directory in survivors:
+            usage[directory]["bytes"] += size
+            usage[directory]["files"] += 1
+        self.usage = usage
+        self.last_sweep = now
+        if removed:
+            logger.info(f"Retention: đã xoá {removed} file, còn {total} bytes")
+        return removed
+
+    def _run(self):
+        while not self._stop.is_set():
+            for task in [self.sweep, *self.hooks]:
+                try:
+                    task()
+                except Exception as e:
+                    logger.error(f"Lỗi khi dọn file: {e}", exc_info=True)
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        total = sum(u["bytes"] for u in self.usage.values())
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "quota_bytes": self.max_bytes,
+            "used_bytes": total,
+            "directories": self.usage,
+            "evicted_ttl_total": self.evicted_ttl,
+            "evicted_quota_total": self.evicted_quota,
+            "evicted_bytes_total": self.evicted_bytes,
+            "last_sweep": self.last_sweep,
+        }
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Các module của service nằm phẳng ở thư mục gốc repo
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_DOCX = os.path.join(ROOT, "uploads", "input_20251030_161708.docx")
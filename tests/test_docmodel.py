@@ -0,0 +1,35 @@
+"""docmodel phải serialize giống hệt minidom (từng byte), với mọi cách giữ tag."""
+
+import io
+import zipfile
+
+import pytest
+from defusedxml import minidom
+
+import docmodel
+import loadtest
+import main
+from conftest import SAMPLE_DOCX
+
+# Escape trong text/thuộc tính, xuống dòng \r\n, tab, unicode ngoài BMP, thẻ rỗng
+EDGE_CASES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+    '<w:document xmlns:w="urn:w" a="x&amp;y&lt;&gt;&quot;\'&#9;&#10;&#13;z"><w:body>'
+    '<w:p><w:r><w:t xml:space="preserve"> a &amp; b &lt; c &gt; d " \' \r\n é 😀 [[ROW1]]</w:t></w:r></w:p>'
+    '<w:x/><w:y b="1"></w:y></w:body></w:document>'
+)
+
+
+def _documents():
+    yield pytest.param(zipfile.ZipFile(SAMPLE_DOCX).read("word/document.xml").decode("utf-8"), id="sample")
+    for pages, seed in ((1, 0), (5, 1), (20, 2)):
+        data = loadtest.synthetic_docx(pages, seed=seed)
+        content = zipfile.ZipFile(io.BytesIO(data)).read("word/document.xml").decode("utf-8")
+        yield pytest.param(content, id=f"synthetic-{pages}p")
+    yield pytest.param(EDGE_CASES_XML, id="edge-cases")
+
+
+@pytest.mark.parametrize("keep_tags", [main.PIPELINE_TAGS, frozenset()], ids=["pipeline-tags", "all-raw"])
+@pytest.mark.parametrize("content", list(_documents()))
+def test_toxml_matches_minidom(content, keep_tags):
+    assert docmodel.parse(content, keep_tags).toxml() == minidom.parseString(content).toxml()
@@ -0,0 +1,62 @@
+"""Response đã gửi xong (kể cả dạng stream) không được tính là client ngắt kết nối."""
+
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import ROOT, SAMPLE_DOCX
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # app.py tạo uploads/outputs/logs theo thư mục hiện tại: chạy trong thư mục tạm
+    workdir = tmp_path_factory.mktemp("app")
+    os.symlink(os.path.join(ROOT, "index.html"), workdir / "index.html")
+    previous_cwd = os.getcwd()
+    previous_admission_dir = os.environ.get("ADMISSION_DIR")
+    os.chdir(workdir)
+    os.environ["ADMISSION_DIR"] = str(workdir / "state")
+    sys.modules.pop("app", None)
+    try:
+        import app
+        yield TestClient(app.app)
+    finally:
+        sys.modules.pop("app", None)
+        os.chdir(previous_cwd)
+        if previous_admission_dir is None:
+            os.environ.pop("ADMISSION_DIR", None)
+        else:
+            os.environ["ADMISSION_DIR"] = previous_admission_dir
+
+
+def _disconnected_total(client):
+    return client.get("/metrics").json()["cancellation"]["disconnected_total"]
+
+
+def _sample():
+    with open(SAMPLE_DOCX, "rb") as f:
+        return f.read()
+
+
+def test_streamed_download_not_counted_as_disconnect(client):
+    before = _disconnected_total(client)
+    response = client.post("/process?download=true", files={"file": ("a.docx", _sample())})
+    assert response.status_code == 200
+    zipfile.ZipFile(io.BytesIO(response.content)).testzip()
+    assert _disconnected_total(client) == before
+
+
+def test_streamed_archive_not_counted_as_disconnect(client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a.docx", _sample())
+        zf.writestr("b.docx", _sample())
+    before = _disconnected_total(client)
+    response = client.post("/process-archive", files={"file": ("batch.zip", archive.getvalue())})
+    assert response.status_code == 200
+    assert len(zipfile.ZipFile(io.BytesIO(response.content)).namelist()) >= 2
+    assert _disconnected_total(client) == before
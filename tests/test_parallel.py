@@ -0,0 +1,37 @@
+"""Chế độ song song phải cho kết quả giống hệt chế độ tuần tự và phiên bản gốc."""
+
+import hashlib
+import zipfile
+
+import main
+from conftest import SAMPLE_DOCX
+
+# md5 của word/document.xml sau khi xử lý file mẫu bằng main.py gốc (trước khi tối ưu)
+BASELINE_MD5 = "1171df2c34097e9a7e0f2131fbd5a727"
+
+
+def _process(tmp_path, name, workers):
+    xml_path = tmp_path / name
+    xml_path.write_bytes(zipfile.ZipFile(SAMPLE_DOCX).read("word/document.xml"))
+    report = {}
+    main.process_document_xml(str(xml_path), workers, report)
+    return xml_path.read_bytes(), report
+
+
+def test_parallel_matches_sequential_and_baseline(tmp_path):
+    sequential, seq_report = _process(tmp_path, "sequential.xml", 1)
+    parallel, par_report = _process(tmp_path, "parallel.xml", 3)
+
+    assert seq_report["mode"] == "sequential"
+    assert par_report["mode"] == "parallel" and par_report["chunks"] > 1
+    assert parallel == sequential
+    assert hashlib.md5(sequential).hexdigest() == BASELINE_MD5
+    assert par_report["removed"] == seq_report["removed"]
+
+
+def test_small_documents_stay_sequential(tmp_path):
+    xml_path = tmp_path / "document.xml"
+    xml_path.write_bytes(zipfile.ZipFile(SAMPLE_DOCX).read("word/document.xml"))
+    assert main.parallel_workers(str(xml_path), 4) == 1
+    assert main.parallel_workers(str(xml_path), 2, min_bytes=0) == 1
+    assert main.parallel_workers(str(xml_path), 4, min_bytes=0) == 4
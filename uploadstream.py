@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Nhận file upload theo kiểu stream:
+- multipart/form-data: đọc body của request từng đoạn (request.stream()) và đưa vào parser
+  của python-multipart; mỗi part file được ghi thẳng vào đường dẫn đích (không qua
+  SpooledTemporaryFile/UploadFile); part nào nhận xong thì được trả về ngay, để nơi gọi bắt
+  đầu xử lý trong khi các part sau vẫn đang được upload;
+- body thô (application/octet-stream, kể cả Transfer-Encoding: chunked): ghi thẳng ra file.
+"""
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class UploadStreamError(Exception):
+    """Body multipart không hợp lệ hoặc vượt giới hạn số file."""
+
+
+class ReceivedFile:
+    """Một file đã nhận xong: thứ tự trong request, tên file gốc, đường dẫn đã ghi, số bytes."""
+
+    __slots__ = ("index", "filename", "path", "size")
+
+    def __init__(self, index, filename, path):
+        self.index = index
+        self.filename = filename
+        self.path = path
+        self.size = 0
+
+
+def _decode(value, charset):
+    try:
+        return value.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        return value.decode("latin-1")
+
+
+async def receive_body(request, target_path):
+    """Ghi toàn bộ body của request vào target_path theo từng đoạn, trả về số bytes đã nhận."""
+    size = 0
+    with open(target_path, "wb") as out:
+        async for chunk in request.stream():
+            out.write(chunk)
+            size += len(chunk)
+    return size
+
+
+async def receive_files(request, field_name, target_path, max_files=1000):
+    """
+    Async generator: với mỗi part file của trường field_name, ghi nội dung vào
+    target_path(index, filename) và yield ReceivedFile ngay khi part đó kết thúc.
+    Các trường không phải file hoặc khác field_name bị bỏ qua.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadStreamError("Request phải là multipart/form-data có boundary")
+    charset = params.get(b"charset", b"utf-8").decode("latin-1")
+
+    headers = {}
+    header_field = bytearray()
+    header_value = bytearray()
+    current = {"file": None, "out": None}
+    finished = []
+    count = 0
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        nonlocal count
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        name = _decode(options.get(b"name", b""), charset)
+        if name != field_name or b"filename" not in options:
+            return
+        if count >= max_files:
+            raise UploadStreamError(f"Quá nhiều file, tối đa {max_files} file mỗi request")
+        received = ReceivedFile(count, _decode(options[b"filename"], charset), None)
+        received.path = target_path(count, received.filename)
+        count += 1
+        current["file"] = received
+        current["out"] = open(received.path, "wb")
+
+    def on_part_data(data, start, end):
+        out = current["out"]
+        if out is not None:
+            out.write(data[start:end])
+            current["file"].size += end - start
+
+    def on_part_end():
+        out = current["out"]
+        if out is not None:
+            out.close()
+            finished.append(current["file"])
+            current["file"] = current["out"] = None
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            while finished:
+                yield finished.pop(0)
+        parser.finalize()
+        while finished:
+            yield finished.pop(0)
+    except MultipartParseError as e:
+        raise UploadStreamError(f"Body multipart không hợp lệ: {e}")
+    finally:
+        if current["out"] is not None:
+            current["out"].close()